@@ -0,0 +1,158 @@
+# Optional compiled backend for the per-element strain kernels.
+# If Numba is installed, the eigen-decomposition, azimuth, circular-mean, and Savage-Simpson moment kernels
+# can be JIT-compiled and run in parallel across cores. Otherwise (or by default) the NumPy path is used.
+# The backend is chosen by set_backend(), by the [general] backend config option, or by the environment
+# variable STRAIN_2D_BACKEND, each one of 'numpy' or 'numba'.
+
+import math
+import os
+import numpy as np
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+BACKENDS = ('numpy', 'numba')
+_backend = 'numpy'
+
+
+def set_backend(name):
+    """
+    Choose the backend for the per-element strain kernels.
+    Asking for numba without Numba installed falls back to numpy, with a warning.
+
+    :param name: string, 'numpy' or 'numba'. Empty string means the STRAIN_2D_BACKEND environment variable, or numpy.
+    :returns: string, the backend in use
+    """
+    global _backend
+    if not name:
+        name = os.environ.get('STRAIN_2D_BACKEND', 'numpy')
+    name = name.lower()
+    if name not in BACKENDS:
+        raise ValueError("Error! Backend " + name + " not recognized. Options are " + ", ".join(BACKENDS) + ".")
+    if name == 'numba' and not NUMBA_AVAILABLE:
+        print("Warning! Numba backend requested but numba is not installed. Using numpy.")
+        name = 'numpy'
+    _backend = name
+    return _backend
+
+
+def get_backend():
+    """:returns: string, the backend in use, 'numpy' or 'numba'"""
+    return _backend
+
+
+def use_numba():
+    """
+    Whether the per-element strain kernels currently run through the Numba backend.
+
+    :returns: bool, True if set_backend() selected numba (and Numba is installed)
+    """
+    return _backend == 'numba'
+
+
+set_backend('')
+
+
+if NUMBA_AVAILABLE:
+    DEG_PER_RAD = 180.0 / np.pi
+    RAD_PER_DEG = np.pi / 180.0
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _strain_products_element(exx, exy, eyy):
+        """The arithmetic of strain_tensor_toolbox.compute_strain_products, for one element."""
+        p = exx - eyy
+        abs_exy = abs(exy)
+        max_shear = math.sqrt(p * p + exy * exy * 4) * 0.5
+        I2nd = (exx * eyy - exy * exy) * 0.5
+        dilatation = exx + eyy
+
+        p = p * 0.5
+        scale = max(abs(p), abs_exy)
+        root = math.sqrt(scale) * math.sqrt(p / scale * p + abs_exy / scale * abs_exy)
+        z = math.copysign(root, p) + p
+        e1 = eyy + z
+        e2 = eyy - abs_exy / z * abs_exy
+        h = math.hypot(exy, z)
+        v00 = z / h
+        v10 = exy / h
+        v01 = -v10
+        v11 = v00
+        if exy == 0:
+            e1, e2 = exx, eyy
+            v00, v01, v10, v11 = 1.0, 0.0, 0.0, 1.0
+        if math.isnan(exx) or math.isnan(exy) or math.isnan(eyy):
+            e1, e2 = 0.0, 0.0
+            v00, v01, v10, v11 = np.nan, np.nan, np.nan, np.nan
+
+        if e1 < e2:
+            azimuth = 90 - math.atan2(v10, v00) * DEG_PER_RAD
+        else:
+            azimuth = 90 - math.atan2(v11, v01) * DEG_PER_RAD
+        if azimuth < 0:
+            azimuth = azimuth + 180
+        if azimuth > 180:
+            azimuth = azimuth - 180
+        return I2nd, max_shear, dilatation, azimuth, e1, e2, v00, v01, v10, v11
+
+    @numba.njit(parallel=True, cache=True, error_model='numpy')
+    def strain_products(exx, exy, eyy, out):
+        """
+        :param exx: 1d array
+        :param exy: 1d array
+        :param eyy: 1d array
+        :param out: 2d array (10, len(exx)), filled with [I2nd, max_shear, dilatation, azimuth, e1, e2, v00..v11]
+        """
+        for i in numba.prange(len(exx)):
+            products = _strain_products_element(exx[i], exy[i], eyy[i])
+            for k in range(10):
+                out[k, i] = products[k]
+
+    @numba.njit(parallel=True, cache=True, error_model='numpy')
+    def angle_means(azimuths, theta, sd):
+        """
+        :param azimuths: 2d array (M, K), K azimuths in degrees for each of M points. NaNs are ignored.
+        :param theta: 1d array (M,), filled with the mean azimuths
+        :param sd: 1d array (M,), filled with the standard deviations of azimuths
+        """
+        for i in numba.prange(azimuths.shape[0]):
+            s, c, count = 0.0, 0.0, 0
+            for k in range(azimuths.shape[1]):
+                phi = azimuths[i, k]
+                if not math.isnan(phi):
+                    s += math.sin((90 - phi) * RAD_PER_DEG * 2)
+                    c += math.cos((90 - phi) * RAD_PER_DEG * 2)
+                    count += 1
+            if count == 0:
+                theta[i], sd[i] = np.nan, np.nan
+                continue
+            s, c = s / count, c / count
+            R = math.sqrt(s * s + c * c)
+            sd[i] = math.sqrt(-2 * math.log(R)) * DEG_PER_RAD / 2 if R > 0 else np.inf
+            t = 90 - math.atan2(s, c) / 2 * DEG_PER_RAD
+            if t < 0:
+                t = t + 180
+            elif t > 180:
+                t = t - 180
+            theta[i] = t
+
+    @numba.njit(parallel=True, cache=True, error_model='numpy')
+    def savage_simpson_moments(exx, exy, eyy, landmask, factor, moment_map):
+        """
+        :param exx: 1d array, nanostrain
+        :param exy: 1d array, nanostrain
+        :param eyy: 1d array, nanostrain
+        :param landmask: 1d array, moment is only computed where landmask > 0
+        :param factor: float, 2 * mu * depth * area, in SI units with mu in GPa
+        :param moment_map: 1d array, filled with the moment rate of each element
+        """
+        for i in numba.prange(len(exx)):
+            if landmask[i] > 0:
+                products = _strain_products_element(exx[i], exy[i], eyy[i])
+                e1, e2 = products[4], products[5]
+                moment_map[i] = factor * max(abs(e1), abs(e2), abs(e1 + e2))
+            else:
+                moment_map[i] = 0.0
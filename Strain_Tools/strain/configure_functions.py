@@ -6,7 +6,8 @@ import shutil
 from . import utilities
 
 Params = collections.namedtuple("Params", ['strain_method', 'input_file', 'range_strain', 'range_data', 'inc',
-                                           'xdata', 'ydata', 'outdir', 'method_specific', 'write_metrics'])
+                                           'xdata', 'ydata', 'outdir', 'method_specific', 'write_metrics',
+                                           'cache_inputs', 'backend', 'precision'])
 Comps_Params = collections.namedtuple("Comps_Params", ['range_strain', 'inc', 'strain_dict', 'outdir'])
 
 avail_modules = "  delaunay\n  delaunay_flat\n  geostats\n  gpsgridder\n  loc_avg_grad\n  wavelets\n  visr\n  velmap\n"
@@ -65,9 +66,12 @@ def read_strain_config(configfile, desired_method=None):
     output_dir = config.get('general', 'output_dir')
     input_file = config.get('general', 'input_vel_file')
     write_metrics = config.getint('general', 'write_metrics') if config.has_option('general', 'write_metrics') else 0
+    cache_inputs = config.getint('general', 'cache_inputs') if config.has_option('general', 'cache_inputs') else 0
+    backend = config.get('general', 'backend') if config.has_option('general', 'backend') else ''
     range_strain = config.get('strain', 'range_strain')
     range_data = config.get('strain', 'range_data') if config.has_option('strain', 'range_data') else range_strain
     inc = config.get('strain', 'inc')
+    precision = config.get('strain', 'precision') if config.has_option('strain', 'precision') else 'float64'
     if range_data == '':
         range_data = range_strain
 
@@ -82,10 +86,12 @@ def read_strain_config(configfile, desired_method=None):
     range_strain = utilities.get_float_range(range_strain)
     range_data = utilities.get_float_range(range_data)
     inc = utilities.get_float_inc(inc)
+    precision = utilities.get_float_precision(precision)
     xdata, ydata, _ = utilities.make_grid(range_strain, inc)
     MyParams = Params(strain_method=strain_method, input_file=input_file, range_strain=range_strain,
                       range_data=range_data, inc=inc, xdata=xdata, ydata=ydata,
-                      outdir=output_dir, method_specific=method_specific, write_metrics=write_metrics)
+                      outdir=output_dir, method_specific=method_specific, write_metrics=write_metrics,
+                      cache_inputs=cache_inputs, backend=backend, precision=precision)
     return MyParams
 
 
@@ -119,10 +125,13 @@ def write_example_strain_config(outfile):
     genconfig["output_dir"] = "Output"
     genconfig["input_vel_file"] = "../test/testing_data/NorCal_stationvels.txt"
     genconfig["write_metrics"] = "0"
+    genconfig["cache_inputs"] = "0"
+    genconfig["backend"] = ""
     strainconfig = configobj["strain"]
     strainconfig["range_strain"] = "-125/-120/38/42"
     strainconfig["range_data"] = "-125/-119/37.5/42.5"
     strainconfig["inc"] = "0.04/0.04"
+    strainconfig["precision"] = "float64"
     d1 = configobj["visr"]
     d1["distance_weighting"] = "gaussian"
     d1["spatial_weighting"] = "voronoi"
@@ -140,9 +149,12 @@ def write_example_strain_config(outfile):
     d2["poisson"] = "0.5"
     d2["fd"] = "0.01"
     d2["eigenvalue"] = "0.0005"
+    d2["implementation"] = "gmt"
     d3 = configobj["loc_avg_grad"]
     d3["EstimateRadiusKm"] = "80"
     d3["nstations"] = "8"
+    d3["neighborhood"] = "nearest"
+    d3["weighting"] = "none"
     d4 = configobj["wavelets"]
     d4["code_dir"] = ""
     d4["qmin"] = "4"
@@ -158,6 +170,11 @@ def write_example_strain_config(outfile):
     d5["range_north"] = "0.342"  # This is 38 km / 111 km / deg
     d5["nugget_north"] = "6"
     d5["trend"] = "0"
+    d5["fit_variogram"] = "0"
+    d5["chunk_size"] = "5000"
+    d5["neighborhood"] = "global"
+    d5["approximation"] = "none"
+    d5["strain_mode"] = "finite_difference"
     d6 = configobj["velmap"]
     d6["smoothing_constant"] = "1e-2"
     dcomps = configobj["strain-comparison"]
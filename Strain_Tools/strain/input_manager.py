@@ -1,5 +1,9 @@
 # The input manager for Strain analysis.
 
+import glob
+import hashlib
+import os
+import numpy as np
 from . import velocity_io
 
 
@@ -7,24 +11,84 @@ from . import velocity_io
 def inputs(MyParams):
     """ Generate input velocity field."""
     print("------------------------------")
-    myVelfield = velocity_io.read_stationvels(MyParams.input_file)
-    myVelfield = clean_velfield(myVelfield, coord_box=MyParams.range_data)
+    cache_file = get_velocity_cache_name(MyParams.input_file, MyParams.range_data) if MyParams.cache_inputs else None
+    if cache_file is not None and os.path.isfile(cache_file):
+        myVelfield = read_velocity_cache(cache_file)
+    else:
+        myVelfield = velocity_io.read_stationvels(MyParams.input_file)
+        myVelfield = clean_velfield(myVelfield, coord_box=MyParams.range_data)
+        if cache_file is not None:
+            write_velocity_cache(myVelfield, cache_file)
     if len(myVelfield) == 0:
         raise ValueError("Error! Velocity field has no velocities.")
-    for item in myVelfield:
-        if item.se == 0 or item.sn == 0 or item.su == 0:
-            raise ValueError("Error! Velocity uncertainty cannot be zero.")
+    if np.any((myVelfield.se == 0) | (myVelfield.sn == 0) | (myVelfield.su == 0)):
+        raise ValueError("Error! Velocity uncertainty cannot be zero.")
     return myVelfield
 
 
 def clean_velfield(myVelfield, coord_box=(-180, 180, -90, 90)):
     """ Clean input velocity field."""
+    myVelfield = velocity_io.as_velocity_field(myVelfield)
     print("{} stations before applying cleaning.".format(len(myVelfield)))
-    select_velfield = []
-    for station_vel in myVelfield:
-        if (coord_box[0] < station_vel.elon < coord_box[1]) and (coord_box[2] < station_vel.nlat < coord_box[3]):
-            select_velfield.append(station_vel)
+    within_box = (coord_box[0] < myVelfield.elon) & (myVelfield.elon < coord_box[1]) & \
+                 (coord_box[2] < myVelfield.nlat) & (myVelfield.nlat < coord_box[3])
+    select_velfield = myVelfield[within_box]
     print("%d stations after imposing bounding box.\n" % (len(select_velfield)))
     if len(select_velfield) == 0:
         raise ValueError("Error! No velocities left after reading/selecting velocities.")
     return select_velfield
+
+
+# ----------------- BINARY CACHE -------------------------
+def get_velocity_cache_name(input_file, range_data):
+    """
+    Name of the binary sidecar for a velocity file, next to the velocity file.
+    The name changes whenever the file's path, size, modification time, or range_data change.
+
+    :param input_file: string, name of velocity file
+    :param range_data: list of [W, E, S, N] used for cleaning
+    :returns: string, name of the sidecar's numeric file
+    """
+    stats = os.stat(input_file)
+    key = "%s|%d|%d|%s" % (os.path.abspath(input_file), stats.st_size, stats.st_mtime_ns,
+                           '/'.join([repr(float(x)) for x in range_data]))
+    return input_file + '.' + hashlib.sha1(key.encode()).hexdigest()[0:16] + '.velcache.npy'
+
+
+def read_velocity_cache(cache_file):
+    """Memory-map a cleaned velocity field from its binary sidecar (read-only)."""
+    print("Reading cached velocities %s " % cache_file)
+    data = np.load(cache_file, mmap_mode='r')
+    names = np.load(cache_file[:-len('.npy')] + '.names.npy')
+    myVelfield = velocity_io.VelocityField.from_array(data, name=names)
+    print("%d stations after imposing bounding box.\n" % (len(myVelfield)))
+    return myVelfield
+
+
+def write_velocity_cache(myVelfield, cache_file):
+    """
+    Write a cleaned velocity field into its binary sidecar.
+    The names go first and the numeric block last, so a partly-written cache is never picked up.
+    Sidecars left over from earlier versions of the same velocity file are removed.
+    """
+    print("Writing cached velocities %s " % cache_file)
+    try:
+        remove_stale_velocity_caches(cache_file)
+        for filename, array in [(cache_file[:-len('.npy')] + '.names.npy', myVelfield.name),
+                                (cache_file, np.ascontiguousarray(myVelfield.data))]:
+            with open(filename + '.tmp', 'wb') as ofile:
+                np.save(ofile, array)
+            os.replace(filename + '.tmp', filename)
+    except OSError as err:  # e.g., read-only data directory: run without the cache
+        print("Warning! Could not write velocity cache (%s)." % err)
+    return
+
+
+def remove_stale_velocity_caches(cache_file):
+    """Remove the other sidecars of the same velocity file, which can never be hit again."""
+    prefix = cache_file[:-len('.0123456789abcdef.velcache.npy')]
+    current = [cache_file, cache_file[:-len('.npy')] + '.names.npy']
+    for filename in glob.glob(glob.escape(prefix) + '.' + '[0-9a-f]' * 16 + '.velcache*.npy'):
+        if filename not in current and filename.endswith(('.velcache.npy', '.velcache.names.npy')):
+            os.remove(filename)
+    return
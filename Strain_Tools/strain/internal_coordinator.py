@@ -2,7 +2,7 @@
 Driver program for strain calculation
 """
 import importlib
-from . import input_manager, output_manager
+from . import compiled_kernels, input_manager, output_manager
 
 
 def get_model(model_name):
@@ -20,6 +20,7 @@ def strain_coordinator(MyParams):
     """
     Main function for strain computation
     """
+    compiled_kernels.set_backend(MyParams.backend)
     velField = input_manager.inputs(MyParams)
     strain_model = get_model(MyParams.strain_method)  # getting an object of type that inherits from Strain_2d
     constructed_object = strain_model(MyParams)   # calling the constructor, building strain model from our params
@@ -50,7 +50,7 @@
 
 import numpy as np
 from scipy.spatial import Delaunay
-from .. import output_manager, produce_gridded, utilities
+from .. import output_manager, produce_gridded, triangulation_cache, utilities, velocity_io
 from strain.models.strain_2d import Strain_2d
 
 
@@ -60,21 +60,31 @@ class delaunay(Strain_2d):
         Strain_2d.__init__(self, params.inc, params.range_strain, params.range_data, params.xdata, params.ydata,
                            params.outdir)
         self._Name = 'delaunay'
+        self._geometry_cache = verify_inputs_delaunay(params.method_specific)
+        self._dtype = params.precision
 
     def compute(self, myVelfield):
         print("------------------------------\nComputing strain via Delaunay on a sphere, and converting to a grid.")
 
-        [xcentroid, ycentroid, triangle_verts, rot, exx, exy, eyy] = compute_with_delaunay_polygons(myVelfield)
+        myVelfield = velocity_io.as_velocity_field(myVelfield)
+        geometry = triangulation_cache.get_triangle_geometry(myVelfield.elon, myVelfield.nlat, self._xdata,
+                                                             self._ydata, sphere_design_inverses,
+                                                             cache_dir=self._geometry_cache, method_name=self._Name)
+        [xcentroid, ycentroid, triangle_verts, rot, exx, exy, eyy] = compute_with_delaunay_polygons(
+            myVelfield, geometry['simplices'], geometry['design_inverse'])
 
-        rot_grd, exx_grd, exy_grd, eyy_grd = produce_gridded.tri2grid(self._xdata, self._ydata,
-                                                                                  triangle_verts, rot, exx, exy, eyy)
+        rot_grd, exx_grd, exy_grd, eyy_grd = produce_gridded.tri2grid(self._xdata, self._ydata, triangle_verts,
+                                                                      rot, exx, exy, eyy,
+                                                                      index_map=geometry['index_map'],
+                                                                      dtype=self._dtype)
 
         # Here we output convenient things on polygons, since it's intuitive for the user.
         output_manager.outputs_1d(xcentroid, ycentroid, triangle_verts, rot, exx, exy, eyy, self._strain_range,
                                   myVelfield, self._outdir)
 
         # Velocities aren't used in Delaunay
-        Ve, Vn = np.nan*np.empty(exx_grd.shape), np.nan*np.empty(exx_grd.shape)
+        Ve = np.full(exx_grd.shape, np.nan, dtype=self._dtype)
+        Vn = np.full(exx_grd.shape, np.nan, dtype=self._dtype)
         velfield_within_box = utilities.filter_by_bounding_box(myVelfield, self._strain_range)
         model_velfield = velfield_within_box
         residual_velfield = utilities.subtract_two_velfields(velfield_within_box, model_velfield)
@@ -83,108 +93,59 @@ class delaunay(Strain_2d):
         return [Ve, Vn, rot_grd, exx_grd, exy_grd, eyy_grd, velfield_within_box, residual_velfield]
 
 
-def compute_with_delaunay_polygons(myVelfield):
-    elon = [x.elon for x in myVelfield]
-    nlat = [x.nlat for x in myVelfield]
-    e = [x.e for x in myVelfield]
-    n = [x.n for x in myVelfield]
-    se = [x.se for x in myVelfield]
-    sn = [x.sn for x in myVelfield]
-    z = np.array([elon, nlat])
-    z = z.T
-    tri = Delaunay(z)
-
-    triangle_vertices = z[tri.simplices]
+def verify_inputs_delaunay(method_specific_dict):
+    # Takes a dictionary and returns the optional directory for caching the triangle geometry
+    geometry_cache = method_specific_dict.get('geometry_cache', '')
+    return geometry_cache if geometry_cache else None
+
+
+def compute_with_delaunay_polygons(myVelfield, simplices=None, design_inverse=None):
+    """
+    :param myVelfield: VelocityField or list of StationVels
+    :param simplices: optional (T, 3) station indices of each triangle, e.g., Delaunay(...).simplices
+    :param design_inverse: optional (T, 6, 6) inverses of the design matrices, from sphere_design_inverses
+    """
+    myVelfield = velocity_io.as_velocity_field(myVelfield)
+    elon, nlat = myVelfield.elon, myVelfield.nlat
+    e, n = myVelfield.e, myVelfield.n
+    se, sn = myVelfield.se, myVelfield.sn
+    z = np.column_stack((elon, nlat))
+    if simplices is None:
+        simplices = Delaunay(z).simplices
+
+    vertex_index = simplices  # station index of each vertex of each triangle
+    triangle_vertices = z[vertex_index]
     trishape = np.shape(triangle_vertices)  # 516 x 3 x 2, for example
     print("Number of triangle elements: %d" % (trishape[0]))
 
     # We are going to solve for the velocity gradient tensor at the centroid of each triangle.
-    centroids = []
-    for i in range(trishape[0]):
-        xcor_mean = np.mean(
-                [
-                    triangle_vertices[i, 0, 0], 
-                    triangle_vertices[i, 1, 0], 
-                    triangle_vertices[i, 2, 0]
-                ]
-            )
-        ycor_mean = np.mean(
-                [
-                    triangle_vertices[i, 0, 1], 
-                    triangle_vertices[i, 1, 1], 
-                    triangle_vertices[i, 2, 1]
-                ]
-            )
-        centroids.append([xcor_mean, ycor_mean])
-    xcentroid = [x[0] for x in centroids]
-    ycentroid = [x[1] for x in centroids]
-
-    # Initialize arrays.
-    rot = []
-    exx, exy, eyy = [], [], []
-
-    # for each triangle:
-    for i in range(trishape[0]):
-        # Get the velocities of each vertex (VE1, VN1, VE2, VN2, VE3, VN3)
-        # Get velocities for Vertex 1 (triangle_vertices[i,0,0] and triangle_vertices[i,0,1])
-        xindex1 = np.where(elon == triangle_vertices[i, 0, 0])
-        yindex1 = np.where(nlat == triangle_vertices[i, 0, 1])
-        index1 = int(np.intersect1d(xindex1, yindex1)[0])
-        xindex2 = np.where(elon == triangle_vertices[i, 1, 0])
-        yindex2 = np.where(nlat == triangle_vertices[i, 1, 1])
-        index2 = int(np.intersect1d(xindex2, yindex2)[0])
-        xindex3 = np.where(elon == triangle_vertices[i, 2, 0])
-        yindex3 = np.where(nlat == triangle_vertices[i, 2, 1])
-        index3 = int(np.intersect1d(xindex3, yindex3)[0])
-
-        phi = np.array(
-                [
-                    triangle_vertices[i, 0, 0], 
-                    triangle_vertices[i, 1, 0], 
-                    triangle_vertices[i, 2, 0]
-                ]
-            )
-        theta = np.array(
-                [
-                    triangle_vertices[i, 0, 1], 
-                    triangle_vertices[i, 1, 1], 
-                    triangle_vertices[i, 2, 1]
-                ]
-            )
-        theta = [i - 90 for i in theta]
-        u_phi = np.array([e[index1], e[index2], e[index3]])
-        u_theta = np.array([n[index1], n[index2], n[index3]])
-        u_theta = np.array([-i for i in u_theta])  # colatitude needs negative theta values.
-        s_phi = np.array([se[index1], se[index2], se[index3]])
-        s_theta = np.array([sn[index1], sn[index2], sn[index3]])
-
-
-        # HERE WE PLUG IN BILL'S CODE!
-        weight = 1
-        paramsel = 0
-        [e_phiphi, e_thetaphi, e_thetatheta, omega_r, U_theta, U_phi, s_omega_r, \
-            s_e_phiphi, s_e_thetaphi, s_e_thetatheta, s_U_theta, s_U_phi, chi2, \
-            OMEGA, THETA_p, PHI_p, s_OMEGA, s_THETA_p, s_PHI_p, r_PHITHETA, u_phi_p, \
-            u_theta_p] = strain_sphere(
-                phi, 
-                theta, 
-                u_phi, 
-                u_theta, 
-                s_phi, 
-                s_theta, 
-                weight, 
-                paramsel
-            )
-
-        # The components that are easily computed
-        # Units: nanostrain per year.
-        # There might be a sign issue here compared to other codes.
-        exx.append(-e_phiphi * 1e6)
-        exy.append(e_thetaphi * 1e6)
-        eyy.append(-e_thetatheta * 1e6)
-
-        # # Compute a number of values based on tensor properties.
-        rot.append(OMEGA * 1000 * 1000)
+    xcentroid, ycentroid = np.mean(triangle_vertices, axis=1).T
+
+    phi = triangle_vertices[:, :, 0]
+    theta = triangle_vertices[:, :, 1] - 90
+    u_phi = e[vertex_index]
+    u_theta = -n[vertex_index]  # colatitude needs negative theta values.
+    s_phi = se[vertex_index]
+    s_theta = sn[vertex_index]
+
+    # HERE WE PLUG IN BILL'S CODE, for all triangles at once
+    weight = 1
+    paramsel = 0
+    [e_phiphi, e_thetaphi, e_thetatheta, omega_r, U_theta, U_phi, s_omega_r, \
+        s_e_phiphi, s_e_thetaphi, s_e_thetatheta, s_U_theta, s_U_phi, chi2, \
+        OMEGA, THETA_p, PHI_p, s_OMEGA, s_THETA_p, s_PHI_p, r_PHITHETA, u_phi_p, \
+        u_theta_p] = strain_sphere_batch(phi, theta, u_phi, u_theta, s_phi, s_theta, weight, paramsel,
+                                         design_inverse=design_inverse)
+
+    # The components that are easily computed
+    # Units: nanostrain per year.
+    # There might be a sign issue here compared to other codes.
+    exx = -e_phiphi * 1e6
+    exy = e_thetaphi * 1e6
+    eyy = -e_thetatheta * 1e6
+
+    # # Compute a number of values based on tensor properties.
+    rot = OMEGA * 1000 * 1000
 
     return [xcentroid, ycentroid, triangle_vertices, rot, exx, exy, eyy]
 
@@ -420,6 +381,213 @@ def strain_sphere(phi, theta, u_phi, u_theta, s_phi, s_theta, weight, paramsel):
         ]
 
 
+def strain_sphere_batch(phi, theta, u_phi, u_theta, s_phi, s_theta, weight, paramsel, design_inverse=None):
+    """
+    Vectorized strain_sphere for many triangles (or other groups of n stations) at once.
+    Every input is a 2D array of shape (T, n), one row per group, in the same units as strain_sphere.
+    The T small least-squares problems are stacked into (T, 2n, p) design tensors and solved with batched solves.
+    When each system is square (3 stations, paramsel 0), the weights drop out and the solution operator is just the
+    inverse of the design matrix, which can be passed in as design_inverse (see sphere_design_inverses).
+
+    :returns: the same 22 quantities as strain_sphere, as arrays of shape (T,), except u_phi_p and u_theta_p (T, n)
+    """
+    theta = np.deg2rad(np.asarray(theta, dtype=float))  # convert to radians
+    phi = np.deg2rad(np.asarray(phi, dtype=float))
+    u_phi, u_theta = np.asarray(u_phi, dtype=float), np.asarray(u_theta, dtype=float)
+    s_phi, s_theta = np.asarray(s_phi, dtype=float), np.asarray(s_theta, dtype=float)
+    r0 = 6.378e6  # mean equitorial Earth radius
+    ntri, n = np.shape(u_phi)
+    nan_array, zero_array = np.full(ntri, np.nan), np.zeros(ntri)
+
+    theta_0 = np.mean(theta, axis=1)
+    phi_0 = np.mean(phi, axis=1)
+
+    # check for colinearity
+    dc = 90 - theta
+    Gc = np.stack((np.ones(np.shape(phi)), phi), axis=2)
+    mc = np.einsum('tij,tj->ti', np.linalg.pinv(Gc), dc)
+    resc = np.einsum('tij,tj->ti', Gc, mc) - dc  # residuals
+    colin = np.where(np.max(np.abs(resc), axis=1) < 1e-5, 1, 0)
+    colin = np.where(np.all(np.abs(phi - phi_0[:, None]) < 1e-5, axis=1) |
+                     np.all(np.abs(theta - theta_0[:, None]) < 1e-5, axis=1), 2, colin)
+    for colin_type in (1, 2):
+        if np.any(colin == colin_type):
+            print(['Warning:  Points are collinear. Type=' + str(colin_type) +
+                   ' (%d groups)' % np.sum(colin == colin_type)])
+
+    # #%% Make the matrix needed for least squares inversion, with rows ordered u_phi_1, u_theta_1, u_phi_2, ...
+    d = np.stack((u_phi, u_theta), axis=2).reshape(ntri, 2 * n)
+
+    G = sphere_design_matrices(phi, theta, paramsel)
+
+    # #% perform the inversion as in an overdetermined system
+    # Same ordering of data variances as strain_sphere: all s_phi, then all s_theta
+    covd_diag = np.hstack((np.square(s_phi), np.square(s_theta)))
+    GT = np.transpose(G, (0, 2, 1))
+    if design_inverse is not None:
+        M = design_inverse
+    elif weight == 1:
+        GTW = GT / covd_diag[:, None, :]
+        M = np.linalg.solve(np.matmul(GTW, G), GTW)
+    else:
+        M = np.linalg.solve(np.matmul(GT, G), GT)
+
+    m = np.einsum('tij,tj->ti', M, d)
+    dpred = np.einsum('tij,tj->ti', G, m)
+
+    # #the predicted u_phi_p, u_theta_p
+    u_phi_p = dpred[:, ::2]
+    u_theta_p = dpred[:, 1::2]
+
+    if paramsel == 2:
+        omega_theta, omega_phi, omega_r = nan_array, nan_array, nan_array
+        e_phiphi, e_thetaphi, e_thetatheta = m[:, 0], m[:, 1], m[:, 2]
+    elif paramsel == 1:
+        omega_theta, omega_phi, omega_r = m[:, 0], m[:, 1], m[:, 2]
+        e_phiphi, e_thetaphi, e_thetatheta = nan_array, nan_array, nan_array
+    else:
+        omega_theta, omega_phi, omega_r = m[:, 0], m[:, 1], m[:, 2]
+        e_phiphi, e_thetaphi, e_thetatheta = m[:, 3], m[:, 4], m[:, 5]
+
+    U_theta = r0 * omega_phi
+    U_phi = -r0 * omega_theta
+
+    covm = np.matmul(M * covd_diag[:, None, :], np.transpose(M, (0, 2, 1)))
+    s_params = np.sqrt(np.diagonal(covm, axis1=1, axis2=2))
+
+    # # % obtain the uncertainties
+    if paramsel == 2:
+        s_e_phiphi, s_e_thetaphi, s_e_thetatheta = s_params[:, 0], s_params[:, 1], s_params[:, 2]
+        s_U_phi, s_U_theta = zero_array, zero_array
+        s_omega_r = nan_array
+    elif paramsel == 1:
+        s_e_phiphi, s_e_thetaphi, s_e_thetatheta = zero_array, zero_array, zero_array
+        s_U_phi, s_U_theta = r0 * s_params[:, 0], r0 * s_params[:, 1]
+        s_omega_r = s_params[:, 2]
+    else:
+        s_U_phi, s_U_theta = r0 * s_params[:, 0], r0 * s_params[:, 1]
+        s_omega_r = s_params[:, 2]
+        s_e_phiphi, s_e_thetaphi, s_e_thetatheta = s_params[:, 3], s_params[:, 4], s_params[:, 5]
+
+    N = 2 * n
+    residuals = d - dpred
+    chi2 = np.sum(np.square(residuals) / covd_diag, axis=1) / N  # N-6 but a divide by zero happened
+
+    # # % Compute the Euler Vectors for the solid body rotation
+    # # % from (A7) of Savage et al., October 2001, JGR appendix
+    if paramsel != 2:
+        OMEGA = np.sqrt(np.square(omega_r) + np.square(omega_phi) + np.square(omega_theta))
+        y = omega_r * np.cos(theta_0) - omega_theta * np.sin(theta_0)
+        THETA_p = np.arccos(y / OMEGA)
+        A = omega_r * np.sin(theta_0) * np.sin(phi_0) + omega_theta * np.cos(theta_0) * np.sin(
+            phi_0) + omega_phi * np.cos(phi_0)
+        B = omega_r * np.sin(theta_0) * np.cos(phi_0) + omega_theta * np.cos(theta_0) * np.cos(
+            phi_0) - omega_phi * np.sin(phi_0)
+        PHI_p = np.arctan2(A, B)
+        z = 1 / np.sqrt(1 - (np.square(y / OMEGA)))
+
+        # %cast the problem of finding the uncertainties as a linear
+        # %inverse problem (linearized) of
+        J = np.zeros([ntri, 3, 3])
+        J[:, 0, 0] = omega_r / OMEGA
+        J[:, 0, 1] = omega_phi / OMEGA
+        J[:, 0, 2] = omega_theta / OMEGA
+
+        J[:, 1, 0] = (np.sin(theta_0) / (A * A + B * B)) * (B * np.sin(phi_0) - A * np.cos(phi_0))
+        J[:, 1, 1] = (1 / (A * A + B * B)) * (B * np.cos(phi_0) + A * np.sin(phi_0))
+        J[:, 1, 2] = (np.cos(theta_0) / (A * A + B * B)) * (B * np.sin(phi_0) - A * np.cos(phi_0))
+
+        J[:, 2, 0] = -(z / OMEGA) * (np.cos(theta_0) - y * omega_r / (OMEGA * OMEGA))
+        J[:, 2, 1] = z * y * omega_phi / (OMEGA * OMEGA * OMEGA)
+        J[:, 2, 2] = (z / OMEGA) * (np.sin(theta_0) + y * omega_theta / (OMEGA * OMEGA))
+
+        covp = np.stack([np.stack([covm[:, 2, 2], covm[:, 2, 1], covm[:, 2, 0]], axis=1),
+                         np.stack([covm[:, 2, 1], covm[:, 1, 1], covm[:, 0, 1]], axis=1),
+                         np.stack([covm[:, 2, 0], covm[:, 0, 1], covm[:, 0, 0]], axis=1)], axis=1)
+        covE = np.matmul(np.matmul(J, covp), np.transpose(J, (0, 2, 1)))
+
+        s_OMEGA = np.sqrt(covE[:, 0, 0])
+        s_PHI_p = np.sqrt(covE[:, 1, 1])
+        s_THETA_p = np.sqrt(covE[:, 2, 2])
+
+        r_PHITHETA = covE[:, 1, 2] / np.sqrt(covE[:, 1, 1] * covE[:, 2, 2])
+
+        # Recover the sign convention: positive is clockwise.
+        # If the radial component of the omega vector points down, it's counter-clockwise
+        OMEGA = np.where(omega_r < 0, -OMEGA, OMEGA)
+
+    else:
+        OMEGA, THETA_p, PHI_p, r_PHITHETA = nan_array, nan_array, nan_array, nan_array
+        s_OMEGA, s_PHI_p, s_THETA_p = nan_array, nan_array, nan_array
+
+    return [
+            e_phiphi,
+            e_thetaphi,
+            e_thetatheta,
+            omega_r,
+            U_theta,
+            U_phi,
+            s_omega_r,
+            s_e_phiphi,
+            s_e_thetaphi,
+            s_e_thetatheta,
+            s_U_theta,
+            s_U_phi,
+            chi2,
+            OMEGA,
+            THETA_p,
+            PHI_p,
+            s_OMEGA,
+            s_THETA_p,
+            s_PHI_p,
+            r_PHITHETA,
+            u_phi_p,
+            u_theta_p
+        ]
+
+
+def sphere_design_matrices(phi, theta, paramsel):
+    """
+    Stacked design matrices of strain_sphere for many groups of stations.
+
+    :param phi: 2D array (T, n), longitudes in radians
+    :param theta: 2D array (T, n), theta in radians, as in strain_sphere
+    :param paramsel: same as strain_sphere
+    :returns: 3D array (T, 2n, p), rows ordered u_phi_1, u_theta_1, u_phi_2, ...
+    """
+    r0 = 6.378e6  # mean equitorial Earth radius
+    ntri, n = np.shape(phi)
+    theta_0 = np.mean(theta, axis=1)
+    phi_0 = np.mean(phi, axis=1)
+    del_phi = phi - phi_0[:, None]
+    del_theta = theta - theta_0[:, None]
+    sin0, cos0 = np.sin(theta_0)[:, None], np.cos(theta_0)[:, None]
+    zeros, ones = np.zeros(np.shape(phi)), np.ones(np.shape(phi))
+    if paramsel != 2:
+        phi_rows = [-r0 * ones, -r0 * cos0 * del_phi, r0 * del_theta]
+        theta_rows = [-r0 * cos0 * del_phi, r0 * ones, -r0 * sin0 * del_phi]
+        if paramsel != 1:  # if we're solving for both strain and rotation.
+            phi_rows += [r0 * sin0 * del_phi, r0 * del_theta, zeros]
+            theta_rows += [zeros, r0 * sin0 * del_phi, r0 * del_theta]
+    else:
+        phi_rows = [r0 * sin0 * del_phi, r0 * del_theta, zeros]
+        theta_rows = [zeros, r0 * sin0 * del_phi, r0 * del_theta]
+    return np.stack((np.stack(phi_rows, axis=2), np.stack(theta_rows, axis=2)), axis=2).reshape(ntri, 2 * n, -1)
+
+
+def sphere_design_inverses(triangle_vertices):
+    """
+    Inverses of the square (6 x 6) design matrices of strain_sphere_batch for triangles, with paramsel 0.
+    They depend only on station geometry.
+
+    :param triangle_vertices: 3D array (T, 3, 2) of lon/lat in degrees
+    :returns: 3D array (T, 6, 6)
+    """
+    phi = np.deg2rad(triangle_vertices[:, :, 0])
+    theta = np.deg2rad(triangle_vertices[:, :, 1] - 90)
+    return np.linalg.inv(sphere_design_matrices(phi, theta, paramsel=0))
+
+
 def print_all_values(
         e_phiphi, 
         e_thetaphi, 
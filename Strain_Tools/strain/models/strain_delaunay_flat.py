@@ -14,8 +14,7 @@ ftp://ftp.ingv.it/pub/salvatore.barba/RevEu/Cai_StrainBIFROST_2007.pdf
 
 import numpy as np
 from scipy.spatial import Delaunay
-from numpy.linalg import inv
-from .. import strain_tensor_toolbox, output_manager, produce_gridded, utilities
+from .. import strain_tensor_toolbox, output_manager, produce_gridded, triangulation_cache, utilities, velocity_io
 from strain.models.strain_2d import Strain_2d
 
 
@@ -25,14 +24,23 @@ class delaunay_flat(Strain_2d):
         Strain_2d.__init__(self, params.inc, params.range_strain, params.range_data, params.xdata, params.ydata,
                            params.outdir)
         self._Name = 'delaunay_flat'
+        self._geometry_cache = verify_inputs_delaunay_flat(params.method_specific)
+        self._dtype = params.precision
 
     def compute(self, myVelfield):
         print("------------------------------\nComputing strain via Delaunay on flat earth, and converting to a grid.")
 
-        [xcentroid, ycentroid, triangle_verts, rot, exx, exy, eyy] = compute_with_delaunay_polygons(myVelfield)
+        myVelfield = velocity_io.as_velocity_field(myVelfield)
+        geometry = triangulation_cache.get_triangle_geometry(myVelfield.elon, myVelfield.nlat, self._xdata,
+                                                             self._ydata, flat_design_inverses,
+                                                             cache_dir=self._geometry_cache, method_name=self._Name)
+        [xcentroid, ycentroid, triangle_verts, rot, exx, exy, eyy] = compute_with_delaunay_polygons(
+            myVelfield, geometry['simplices'], geometry['design_inverse'])
 
         rot_grd, exx_grd, exy_grd, eyy_grd = produce_gridded.tri2grid(self._xdata, self._ydata,
-                                                                      triangle_verts, rot, exx, exy, eyy)
+                                                                      triangle_verts, rot, exx, exy, eyy,
+                                                                      index_map=geometry['index_map'],
+                                                                      dtype=self._dtype)
 
         # Here we output convenient things on polygons, since it's intuitive for the user.
         output_manager.outputs_1d(
@@ -48,7 +56,8 @@ class delaunay_flat(Strain_2d):
         )
 
         # Velocities aren't used in Delaunay
-        Ve, Vn = np.nan*np.empty(np.shape(rot_grd)), np.nan*np.empty(np.shape(rot_grd))
+        Ve = np.full(np.shape(rot_grd), np.nan, dtype=self._dtype)
+        Vn = np.full(np.shape(rot_grd), np.nan, dtype=self._dtype)
         velfield_within_box = utilities.filter_by_bounding_box(myVelfield, self._strain_range)
         model_velfield = velfield_within_box
         residual_velfield = utilities.subtract_two_velfields(velfield_within_box, model_velfield)
@@ -57,90 +66,93 @@ class delaunay_flat(Strain_2d):
         return [Ve, Vn, rot_grd, exx_grd, exy_grd, eyy_grd, velfield_within_box, residual_velfield]
 
 
+def verify_inputs_delaunay_flat(method_specific_dict):
+    # Takes a dictionary and returns the optional directory for caching the triangle geometry
+    geometry_cache = method_specific_dict.get('geometry_cache', '')
+    return geometry_cache if geometry_cache else None
+
+
 # ----------------- COMPUTE -------------------------
-def compute_with_delaunay_polygons(myVelfield):
+def compute_with_delaunay_polygons(myVelfield, simplices=None, design_inverse=None):
+    """
+    :param myVelfield: VelocityField or list of StationVels
+    :param simplices: optional (T, 3) station indices of each triangle, e.g., Delaunay(...).simplices
+    :param design_inverse: optional (T, 3, 3) inverses of the design matrices, from flat_design_inverses
+    """
     print("Computing strain via delaunay method.")
-    elon = [x.elon for x in myVelfield]
-    nlat = [x.nlat for x in myVelfield]
-    e = [x.e for x in myVelfield]
-    n = [x.n for x in myVelfield]
-    z = np.array([elon, nlat])
-    z = z.T
-    tri = Delaunay(z)
+    myVelfield = velocity_io.as_velocity_field(myVelfield)
+    elon, nlat = myVelfield.elon, myVelfield.nlat
+    e, n = myVelfield.e, myVelfield.n
+    z = np.column_stack((elon, nlat))
+    if simplices is None:
+        simplices = Delaunay(z).simplices
 
-    triangle_vertices = z[tri.simplices]
-    trishape = np.shape(triangle_vertices)  # 516 x 3 x 2, for example
+    vertex_index = simplices  # station index of each vertex of each triangle
+    triangle_vertices = z[vertex_index]  # 516 x 3 x 2, for example
 
     # We are going to solve for the velocity gradient tensor at the centroid of each triangle.
-    centroids = []
-    for i in range(trishape[0]):
-        xcor_mean = np.mean([triangle_vertices[i, 0, 0], triangle_vertices[i, 1, 0], triangle_vertices[i, 2, 0]])
-        ycor_mean = np.mean([triangle_vertices[i, 0, 1], triangle_vertices[i, 1, 1], triangle_vertices[i, 2, 1]])
-        centroids.append([xcor_mean, ycor_mean])
-    xcentroid = [x[0] for x in centroids]
-    ycentroid = [x[1] for x in centroids]
-
-    # Initialize arrays.
-    rot = []
-    exx, exy, eyy = [], [], []
-
-    # for each triangle:
-    for i in range(trishape[0]):
-        # Get the velocities of each vertex (VE1, VN1, VE2, VN2, VE3, VN3)
-        # Get velocities for Vertex 1 (triangle_vertices[i,0,0] and triangle_vertices[i,0,1])
-        xindex1 = np.where(elon == triangle_vertices[i, 0, 0])
-        yindex1 = np.where(nlat == triangle_vertices[i, 0, 1])
-        index1 = np.intersect1d(xindex1, yindex1)
-        xindex2 = np.where(elon == triangle_vertices[i, 1, 0])
-        yindex2 = np.where(nlat == triangle_vertices[i, 1, 1])
-        index2 = np.intersect1d(xindex2, yindex2)
-        xindex3 = np.where(elon == triangle_vertices[i, 2, 0])
-        yindex3 = np.where(nlat == triangle_vertices[i, 2, 1])
-        index3 = np.intersect1d(xindex3, yindex3)
-
-        VE1 = e[index1[0]]
-        VN1 = n[index1[0]]
-        VE2 = e[index2[0]]
-        VN2 = n[index2[0]]
-        VE3 = e[index3[0]]
-        VN3 = n[index3[0]]
-        obs_vel = np.array([[VE1], [VN1], [VE2], [VN2], [VE3], [VN3]])
-
-        # Get the distance between centroid and vertex (in km)
-        dE1 = (triangle_vertices[i, 0, 0] - xcentroid[i]) * 111.0 * np.cos(np.deg2rad(ycentroid[i]))
-        dE2 = (triangle_vertices[i, 1, 0] - xcentroid[i]) * 111.0 * np.cos(np.deg2rad(ycentroid[i]))
-        dE3 = (triangle_vertices[i, 2, 0] - xcentroid[i]) * 111.0 * np.cos(np.deg2rad(ycentroid[i]))
-        dN1 = (triangle_vertices[i, 0, 1] - ycentroid[i]) * 111.0
-        dN2 = (triangle_vertices[i, 1, 1] - ycentroid[i]) * 111.0
-        dN3 = (triangle_vertices[i, 2, 1] - ycentroid[i]) * 111.0
-
-        Design_Matrix = np.array(
-            [[1, 0, dE1, dN1, 0, 0], [0, 1, 0, 0, dE1, dN1], [1, 0, dE2, dN2, 0, 0], [0, 1, 0, 0, dE2, dN2],
-             [1, 0, dE3, dN3, 0, 0], [0, 1, 0, 0, dE3, dN3]])
-
-        # Invert to get the components of the velocity gradient tensor.
-        DMinv = inv(Design_Matrix)
-        vel_grad = np.dot(DMinv, obs_vel)  # this is the money step.
-        # VE_centroid = vel_grad[0][0]
-        # VN_centroid = vel_grad[1][0]
-        dVEdE = vel_grad[2][0]
-        dVEdN = vel_grad[3][0]
-        dVNdE = vel_grad[4][0]
-        dVNdN = vel_grad[5][0]
-
-        # The components that are easily computed
-        [exx_triangle, exy_triangle, eyy_triangle,
-         rotation_triangle] = strain_tensor_toolbox.compute_strain_components_from_dx(dVEdE, dVNdE, dVEdN, dVNdN)
-
-        # # Compute a number of values based on tensor properties.
-        # [e11, e22, v] = strain_tensor_toolbox.eigenvector_eigenvalue(exx, exy, eyy)
-
-        # Convert to nanostrain
-        exx.append(np.multiply(exx_triangle, 1000))
-        exy.append(np.multiply(exy_triangle, 1000))
-        eyy.append(np.multiply(eyy_triangle, 1000))
-        rot.append(np.multiply(-rotation_triangle, 1000))  # sign convention clockwise is positive
+    xcentroid, ycentroid, dE, dN = get_centroid_offsets(triangle_vertices)
+
+    # Solve for the components of the velocity gradient tensor in all triangles at once.
+    [dVEdE, dVEdN, dVNdE, dVNdN] = solve_velocity_gradients(dE, dN, e[vertex_index], n[vertex_index],
+                                                            design_inverse=design_inverse)
+
+    # The components that are easily computed
+    [exx, exy, eyy, rot] = strain_tensor_toolbox.compute_strain_components_from_dx(dVEdE, dVNdE, dVEdN, dVNdN)
+
+    # Convert to nanostrain
+    exx = exx * 1000
+    exy = exy * 1000
+    eyy = eyy * 1000
+    rot = -rot * 1000  # sign convention clockwise is positive
 
     print("Success computing strain via delaunay flat-earth method.\n")
 
     return [xcentroid, ycentroid, triangle_vertices, rot, exx, exy, eyy]
+
+
+def get_centroid_offsets(triangle_vertices):
+    """
+    :param triangle_vertices: 3D array (T, 3, 2) of lon/lat in degrees
+    :returns: xcentroid, ycentroid (T,), and the east and north distances from centroid to each vertex, dE, dN (T, 3)
+    """
+    xcentroid, ycentroid = np.mean(triangle_vertices, axis=1).T
+
+    # Get the distance between centroid and vertex (in km)
+    dE = (triangle_vertices[:, :, 0] - xcentroid[:, None]) * 111.0 * np.cos(np.deg2rad(ycentroid[:, None]))
+    dN = (triangle_vertices[:, :, 1] - ycentroid[:, None]) * 111.0
+    return xcentroid, ycentroid, dE, dN
+
+
+def flat_design_inverses(triangle_vertices):
+    """
+    Inverses of the 3x3 design matrices [1, dE, dN] of solve_velocity_gradients. They depend only on station geometry.
+
+    :param triangle_vertices: 3D array (T, 3, 2) of lon/lat in degrees
+    :returns: 3D array (T, 3, 3)
+    """
+    _, _, dE, dN = get_centroid_offsets(triangle_vertices)
+    return np.linalg.inv(np.stack((np.ones(np.shape(dE)), dE, dN), axis=2))
+
+
+def solve_velocity_gradients(dE, dN, VE, VN, design_inverse=None):
+    """
+    Velocity gradient tensor at the centroid of many triangles, from the velocities at their vertices.
+    Each triangle's 6x6 system separates into two 3x3 systems (east and north) sharing one matrix,
+    [1, dE, dN] for each vertex, so both components are found together with one batched solve.
+
+    :param dE: 2d array (T, 3), east distance from centroid to each vertex, in km
+    :param dN: 2d array (T, 3), north distance from centroid to each vertex, in km
+    :param VE: 2d array (T, 3), east velocity of each vertex
+    :param VN: 2d array (T, 3), north velocity of each vertex
+    :param design_inverse: optional 3d array (T, 3, 3) from flat_design_inverses, replacing the solve with a matmul
+    :returns: dVEdE, dVEdN, dVNdE, dVNdN, each a 1d array of length T
+    """
+    obs_vel = np.stack((VE, VN), axis=2)  # T x 3 x 2
+    if design_inverse is not None:
+        vel_grad = np.matmul(design_inverse, obs_vel)
+    else:
+        Design_Matrix = np.stack((np.ones(np.shape(dE)), dE, dN), axis=2)  # T x 3 x 3
+        vel_grad = np.linalg.solve(Design_Matrix, obs_vel)  # this is the money step.
+    # VE_centroid, VN_centroid = vel_grad[:, 0, 0], vel_grad[:, 0, 1]
+    return [vel_grad[:, 1, 0], vel_grad[:, 2, 0], vel_grad[:, 1, 1], vel_grad[:, 2, 1]]
@@ -2,14 +2,23 @@
 # Maurer, 2021. (in prep)
 
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 import numpy as np
+from xarray import Dataset
+from scipy.cluster.vq import kmeans2
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.optimize import curve_fit
+from scipy.sparse import coo_matrix, identity, issparse
+from scipy.sparse.linalg import splu
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import pdist, cdist, squareform
 
 from strain.models.strain_2d import Strain_2d
 from .. import utilities
-from strain.strain_tensor_toolbox import strain_on_regular_grid, calc_strain_uncertainty
+from strain.strain_tensor_toolbox import strain_on_regular_grid, calc_strain_uncertainty, \
+    calc_strain_uncertainty_from_gradients
 from strain.utilities import getVels
 
 
@@ -38,25 +47,71 @@ class geostats(Strain_2d):
                 params.outdir,
             )
         self._Name = 'geostatistical'
+        self._dtype = params.precision
+        trend = (params.method_specific.get('trend', '') or '0').lower()
+        self._trend = 1 if trend == 'true' else 0 if trend == 'false' else int(trend)
+        if self._trend not in (0, 1, 2):
+            raise ValueError('Trend must be 0 (none), 1 (linear), or 2 (quadratic), not {}'.format(self._trend))
+        self._ktype = 'uk' if self._trend else 'ok'
+        self._fit_variogram = int(params.method_specific.get('fit_variogram', '') or 0)
+        max_lag = params.method_specific.get('max_lag', '')
+        self._max_lag = float(max_lag) if max_lag else None  # default is a third of the station extent
+        self._num_lags = int(params.method_specific.get('num_lags', '') or 20)
+        self._max_pairs = int(float(params.method_specific.get('max_pairs', '') or 1e6))
         if (model is not None) and callable(model):
             self._model_east = model
             self._model_north = model
         else:
+            # With fit_variogram, the variogram parameters are optional initial guesses
+            parms = {}
+            for name in ['sill_east', 'range_east', 'nugget_east', 'sill_north', 'range_north', 'nugget_north']:
+                value = params.method_specific.get(name, '')
+                parms[name] = None if (value == '' and self._fit_variogram) else np.float64(value)
             self._model_type = params.method_specific['model_type']
             self._model_east = self.getVariogram(
                     model_type=self._model_type,
-                    sill=np.float64(params.method_specific['sill_east']),
-                    rang=np.float64(params.method_specific['range_east']),
-                    nugget=np.float64(params.method_specific['nugget_east']),
-                    trend=bool(params.method_specific['trend']),
+                    sill=parms['sill_east'],
+                    rang=parms['range_east'],
+                    nugget=parms['nugget_east'],
+                    trend=self._trend,
                 )
             self._model_north = self.getVariogram(
                     model_type=self._model_type,
-                    sill=np.float64(params.method_specific['sill_north']),
-                    rang=np.float64(params.method_specific['range_north']),
-                    nugget=np.float64(params.method_specific['nugget_north']),
-                    trend=bool(params.method_specific['trend']),
+                    sill=parms['sill_north'],
+                    rang=parms['range_north'],
+                    nugget=parms['nugget_north'],
+                    trend=self._trend,
                 )
+        chunk_size = params.method_specific.get('chunk_size', '')
+        self._chunk_size = int(chunk_size) if chunk_size else 5000  # query points per chunk; 0 for all at once
+        self._neighborhood = params.method_specific.get('neighborhood', '') or 'global'
+        if self._neighborhood not in ('global', 'local'):
+            raise ValueError('Neighborhood "{}" is not implemented; use global or local'.format(self._neighborhood))
+        self._nstations = int(params.method_specific.get('nstations', '') or 50)
+        self._block_size = int(params.method_specific.get('block_size', '') or 10)
+        self._threads = int(params.method_specific.get('threads', '') or 0) or 1
+        self._approximation = params.method_specific.get('approximation', '') or 'none'
+        if self._approximation not in ('none', 'nystrom', 'inducing'):
+            raise ValueError('Approximation "{}" is not implemented; use none, nystrom, or inducing'.format(
+                self._approximation))
+        self._inducing_points = int(params.method_specific.get('inducing_points', '') or 200)
+        self._holdout_fraction = float(params.method_specific.get('holdout_fraction', '') or 0.1)
+        if self._neighborhood == 'local':
+            if self._approximation != 'none':
+                raise ValueError('Approximation "{}" requires the global neighborhood'.format(self._approximation))
+            if any(isinstance(model, (Spherical, Wendland)) for model in (self._model_east, self._model_north)):
+                print("Warning! The local neighborhood solves each block densely; "
+                      "use the global neighborhood for the sparse solver of compactly supported models.")
+        self._strain_mode = params.method_specific.get('strain_mode', '') or 'finite_difference'
+        if self._strain_mode not in ('finite_difference', 'analytic'):
+            raise ValueError('Strain mode "{}" is not implemented; use finite_difference or analytic'.format(
+                self._strain_mode))
+        if self._strain_mode == 'analytic':
+            if self._neighborhood == 'local':
+                raise ValueError('Analytic strain mode requires the global neighborhood')
+            if not self._fit_variogram:
+                self._model_east.getGradientVariance()  # raises if the model is not differentiable
+                self._model_north.getGradientVariance()
         self.setGrid(None)
 
     def __repr__(self):
@@ -88,7 +143,7 @@ class geostats(Strain_2d):
         sill:
         rang:
         nugget:
-        trend: boolean or list      Use a trend or not, can be a list of bool
+        trend: int                  Order of the polynomial drift (unused by the variogram itself)
         """
         try:
             _model = eval(model_type)
@@ -120,6 +175,9 @@ class geostats(Strain_2d):
         self._xy = xy
         self._easting = np.array(data)[:, 0]
         self._northing = np.array(data)[:, 1]
+        self._dist = None
+        self._Z = None
+        self._clearSolvers()
 
     def setGrid(self, XY=None, XY_shape=None):
         """
@@ -138,18 +196,279 @@ class geostats(Strain_2d):
         else:
             self._XY = XY
             self._grid_shape = XY_shape
+        self._clearSolvers()
 
-    def krige_east(self, model, ktype='ok'):
+    def _clearSolvers(self):
+        self._solvers = {}
+        self._local_solvers = {}
+
+    def getSolver(self, model):
+        """
+        Return the factored data covariance for a variogram model.
+        Solvers are cached by the model's parameters, so the east and north components share one factorization
+        when their variograms match. The station distance matrix is computed once and reused by every model.
+        With an approximation, the solver is a LowRankKriging on the inducing points instead, and with a
+        compactly supported model it is a SparseKriging.
+
+        Parameters
+        ----------
+        model: VariogramModel
+
+        Returns
+        -------
+        solver: CholeskyKriging - factored covariance of the data locations
+        """
+        key = (model._model,) + tuple(model.getParms())
+        if key not in self._solvers and self._approximation != 'none':
+            if self._Z is None:
+                self._Z = choose_inducing_points(self._xy, self._inducing_points, self._approximation)
+            self._solvers[key] = LowRankKriging(model, self._xy, self._Z, fitc=(self._approximation == 'inducing'))
+        if key not in self._solvers and model.getSupport() is not None:
+            self._solvers[key] = factor_covariance(model, self._xy)
+        if key not in self._solvers:
+            if self._dist is None:
+                self._dist = squareform(pdist(self._xy))
+            SIG = model(self._dist)
+            SIG = SIG + np.sqrt(np.finfo(float).eps)*np.eye(SIG.shape[0])
+            self._solvers[key] = CholeskyKriging(SIG)
+        return self._solvers[key]
+
+    def krige_east(self, model=None, ktype='ok'):
         """
         Interpolate velocities using kriging
         """
-        return krige(self._xy, self._XY, self._easting, self._model_east, ktype=ktype)
+        return krige(self._xy, self._XY, self._easting, self._model_east, ktype=ktype,
+                     solver=self.getSolver(self._model_east), chunk_size=self._chunk_size, order=self._trend)
 
-    def krige_north(self, model, ktype='ok'):
+    def krige_north(self, model=None, ktype='ok'):
         """
         Interpolate velocities using kriging
         """
-        return krige(self._xy, self._XY, self._northing, self._model_north, ktype=ktype)
+        return krige(self._xy, self._XY, self._northing, self._model_north, ktype=ktype,
+                     solver=self.getSolver(self._model_north), chunk_size=self._chunk_size, order=self._trend)
+
+    def krige_velocities(self, ktype='ok'):
+        """
+        Interpolate both velocity components, one chunk of query points at a time.
+        Each chunk's distances are computed once for both components, and so is its covariance when the
+        variograms match, so no N x M matrix covering the whole grid is ever formed.
+
+        Returns
+        -------
+        Dest_e, Dsig_e, Dest_n, Dsig_n: M x 1 ndarrays
+        """
+        components = [(self._easting, self._model_east), (self._northing, self._model_north)]
+        M = len(self._XY)
+        chunk_size = self._chunk_size if self._chunk_size > 0 else M
+        outputs = [np.empty(M, dtype=self._dtype) for _ in range(4)]
+        for start in range(0, M, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            cross_dist = None
+            sig0_by_key = {}
+            for k, (data, model) in enumerate(components):
+                key = (model._model,) + tuple(model.getParms())
+                solver = self.getSolver(model)
+                if key not in sig0_by_key:
+                    if cross_dist is None and not isinstance(solver, SparseKriging):
+                        cross_dist = cdist(self._xy, self._XY[chunk])
+                    sig0_by_key[key] = solver.crossCovariance(model, self._xy, self._XY[chunk], cross_dist)
+                Dest, Dsig = krige(self._xy, self._XY[chunk], data, model, ktype=ktype, solver=solver,
+                                   sig0=sig0_by_key[key], order=self._trend)[0:2]
+                outputs[2*k][chunk], outputs[2*k+1][chunk] = Dest, Dsig
+        return outputs
+
+    def getBlocks(self):
+        """
+        Partition the query points into square tiles of block_size x block_size grid nodes
+        (or consecutive runs of block_size^2 points, if the query points are not a grid).
+
+        Returns
+        -------
+        blocks: list of 1D integer ndarrays, indices into the query points
+        """
+        M = len(self._XY)
+        b = max(self._block_size, 1)
+        if self._grid_shape is not None and np.prod(self._grid_shape) == M:
+            ny, nx = self._grid_shape
+            iy, ix = np.divmod(np.arange(M), nx)
+            tile = (iy // b) * (-(-nx // b)) + ix // b
+        else:
+            tile = np.arange(M) // (b * b)
+        order = np.argsort(tile, kind='stable')
+        return np.split(order, np.flatnonzero(np.diff(tile[order])) + 1)
+
+    def getLocalSolver(self, model, neighbors):
+        """
+        Factored covariance of a subset of stations, cached by variogram parameters and by the (sorted) station
+        indices, since neighboring blocks often select the same stations.
+        """
+        key = (model._model,) + tuple(model.getParms()) + (neighbors.tobytes(),)
+        solver = self._local_solvers.get(key)
+        if solver is None:
+            SIG = compute_covariance(model, self._xy[neighbors])
+            SIG = SIG + np.sqrt(np.finfo(float).eps)*np.eye(SIG.shape[0])
+            solver = self._local_solvers.setdefault(key, CholeskyKriging(SIG))
+        return solver
+
+    def krige_velocities_local(self, ktype='ok'):
+        """
+        Moving-neighborhood kriging: each block of query points is kriged from the nstations stations nearest
+        to its center, found with a KD-tree. Each system is only nstations x nstations, so the cost grows
+        linearly with the number of blocks instead of cubically with the number of stations.
+        Blocks are kriged in parallel threads (the linear algebra releases the GIL). Each thread's BLAS calls
+        run multithreaded too, so more than one thread only helps with a single-threaded BLAS
+        (e.g. OMP_NUM_THREADS=1).
+
+        Returns
+        -------
+        Dest_e, Dsig_e, Dest_n, Dsig_n: M x 1 ndarrays
+        """
+        components = [(self._easting, self._model_east), (self._northing, self._model_north)]
+        M = len(self._XY)
+        K = min(self._nstations, len(self._xy))
+        tree = cKDTree(self._xy)
+        outputs = [np.empty(M, dtype=self._dtype) for _ in range(4)]
+
+        def krige_block(block):
+            XY = self._XY[block]
+            _, neighbors = tree.query(np.mean(XY, axis=0), k=K)
+            neighbors = np.sort(np.atleast_1d(neighbors))
+            xy = self._xy[neighbors]
+            cross_dist = cdist(xy, XY)
+            sig0_by_key = {}
+            for k, (data, model) in enumerate(components):
+                key = (model._model,) + tuple(model.getParms())
+                if key not in sig0_by_key:
+                    sig0_by_key[key] = model(cross_dist)
+                Dest, Dsig = krige(xy, XY, data[neighbors], model, ktype=ktype,
+                                   solver=self.getLocalSolver(model, neighbors), sig0=sig0_by_key[key],
+                                   order=self._trend)[0:2]
+                outputs[2*k][block], outputs[2*k+1][block] = Dest, Dsig
+
+        blocks = self.getBlocks()
+        print("Kriging %d blocks from their %d nearest stations, with %d threads" % (len(blocks), K, self._threads))
+        with ThreadPoolExecutor(max_workers=self._threads) as executor:
+            list(executor.map(krige_block, blocks))
+        return outputs
+
+    def reportApproximationError(self, ktype='ok'):
+        """
+        Cross-validate the low-rank approximation: hold out a random fraction of the stations, krige them from
+        the others with the same approximation, and write the RMS misfit to approximation_report.txt in outdir.
+
+        Returns
+        -------
+        rms_e, rms_n: float, RMS misfit of held-out east and north velocities
+        """
+        N = len(self._xy)
+        rng = np.random.default_rng(1)
+        held_out = np.zeros(N, dtype=bool)
+        held_out[rng.choice(N, size=min(max(int(round(self._holdout_fraction * N)), 1), N - 1), replace=False)] = True
+        xy_train, xy_test = self._xy[~held_out], self._xy[held_out]
+        Z = choose_inducing_points(xy_train, self._inducing_points, self._approximation)
+        rms = []
+        for data, model in [(self._easting, self._model_east), (self._northing, self._model_north)]:
+            solver = LowRankKriging(model, xy_train, Z, fitc=(self._approximation == 'inducing'))
+            Dest = krige(xy_train, xy_test, data[~held_out], model, ktype=ktype, solver=solver, order=self._trend)[0]
+            rms.append(np.sqrt(np.mean(np.square(Dest - data[held_out]))))
+
+        report = ("Approximation: {} with {} inducing points\n"
+                  "Held-out stations: {} of {}\n"
+                  "RMS misfit of held-out east velocities: {:.4f} mm/yr\n"
+                  "RMS misfit of held-out north velocities: {:.4f} mm/yr\n").format(
+            self._approximation, len(Z), np.sum(held_out), N, rms[0], rms[1])
+        print(report)
+        outfile = os.path.join(self._outdir, 'approximation_report.txt')
+        print("Writing file %s " % outfile)
+        with open(outfile, 'w') as ofile:
+            ofile.write(report)
+        return rms[0], rms[1]
+
+    def krige_strain(self, XY=None, ktype='ok'):
+        """
+        Strain rates at any query points, by kriging the velocity gradients directly with analytic derivatives
+        of the covariance models, instead of differencing velocities on a grid. The factorization is shared with
+        the velocity kriging, and the kriging covariances of the gradients give the strain rate variances.
+
+        Parameters
+        ----------
+        XY: M x 2 ndarray   - optional, query locations in lon/lat. Default is the grid.
+        ktype: str          - 'sk', 'ok', or 'uk'
+
+        Returns
+        -------
+        exx, eyy, exy, rot: M x 1 ndarrays, in mm/yr/km (i.e. microstrain/yr)
+        var_dil, var_max_shear: M x 1 ndarrays, variances of dilatation and maximum shear
+        """
+        XY = self._XY if XY is None else XY
+        gradients = []
+        for data, model in [(self._easting, self._model_east), (self._northing, self._model_north)]:
+            dDdx, dDdy, var_x, cov_xy, var_y = krige_gradient(self._xy, XY, data, model, ktype=ktype,
+                                                              solver=self.getSolver(model),
+                                                              chunk_size=self._chunk_size, order=self._trend)
+            # Gradients are per degree of lon and lat; convert to per km at each query point
+            km_x, km_y = 111 * np.cos(np.deg2rad(XY[:, 1])), 111
+            gradients.append((dDdx / km_x, dDdy / km_y, var_x / km_x**2, cov_xy / (km_x * km_y), var_y / km_y**2))
+        [dVEdx, dVEdy, *cov_e], [dVNdx, dVNdy, *cov_n] = gradients
+
+        exx, eyy = dVEdx, dVNdy
+        exy = 0.5*(dVEdy + dVNdx)
+        rot = 0.5*(dVEdy - dVNdx)
+        var_dil, var_max_shear = calc_strain_uncertainty_from_gradients(cov_e, cov_n, exx, eyy, exy)
+        return exx, eyy, exy, rot, var_dil, var_max_shear
+
+    def fitVariograms(self):
+        """
+        Estimate the empirical variograms of the east and north velocities, fit the variogram models to them
+        (starting from any parameters given in the config), and write the fitted parameters and the empirical
+        variograms to fitted_variogram.txt and empirical_variogram.txt in outdir.
+        """
+        max_lag = self._max_lag if self._max_lag else np.max(np.ptp(self._xy, axis=0)) / 3
+        lags, gamma, counts = empirical_variogram(self._xy, np.column_stack([self._easting, self._northing]),
+                                                  max_lag, num_lags=self._num_lags, max_pairs=self._max_pairs)
+        print("Fitting variograms to %d station pairs within %.3f degrees" % (np.sum(counts), max_lag))
+        for k, model in enumerate([self._model_east, self._model_north]):
+            p0 = model.getParms()
+            fit_variogram(model, lags, gamma[:, k], counts, p0=None if None in p0 else p0)
+        self._clearSolvers()
+
+        outfile = os.path.join(self._outdir, 'fitted_variogram.txt')
+        print("Writing file %s " % outfile)
+        with open(outfile, 'w') as ofile:
+            ofile.write("# Variogram models fitted to %d stations; ranges in degrees\n" % len(self._xy))
+            ofile.write("model_type = %s\n" % self._model_east._model)
+            for name, model in [('east', self._model_east), ('north', self._model_north)]:
+                sill, rang, nugget = model.getParms()
+                print("Fitted %s variogram: sill %.4f, range %.4f, nugget %.4f" % (name, sill, rang, nugget))
+                ofile.write("sill_%s = %.6f\nrange_%s = %.6f\nnugget_%s = %.6f\n" % (name, sill, name, rang,
+                                                                                    name, nugget))
+        outfile = os.path.join(self._outdir, 'empirical_variogram.txt')
+        print("Writing file %s " % outfile)
+        np.savetxt(outfile, np.column_stack([lags, gamma, counts]), fmt=['%.6f', '%.6f', '%.6f', '%d'],
+                   header='lag(deg) gamma_east(mm^2/yr^2) gamma_north(mm^2/yr^2) num_pairs')
+        return
+
+    def writeUncertainties(self, Se, Sn, var_dil, var_shear):
+        """
+        Write the kriging standard deviations of the velocities (mm/yr) and the variances of dilatation and
+        maximum shear ((nanostrain/yr)^2) on the grid to geostats_uncertainty.nc in outdir.
+        """
+        ds = Dataset(
+            {
+                "Ve_std": (("y", "x"), Se),
+                "Vn_std": (("y", "x"), Sn),
+                "var_dilatation": (("y", "x"), var_dil),
+                "var_max_shear": (("y", "x"), var_shear),
+            },
+            coords={
+                "x": ('x', self._xdata),
+                "y": ('y', self._ydata),
+            },
+        )
+        outfile = os.path.join(self._outdir, 'geostats_uncertainty.nc')
+        print("Writing file %s " % outfile)
+        ds.to_netcdf(outfile, encoding={name: {'dtype': self._dtype} for name in ds.data_vars})
+        return
 
     def compute(self, myVelfield):
         """Compute the interpolated velocity field"""
@@ -158,9 +477,15 @@ class geostats(Strain_2d):
         xy = np.stack([dlon, dlat], axis=-1)
         data = np.stack([e, n], axis=1)
         self.setPoints(xy=xy, data=data)
+        if self._fit_variogram:
+            self.fitVariograms()
 
-        Dest_e, Dsig_e, _ = self.krige_east('ok')
-        Dest_n, Dsig_n, _ = self.krige_north('ok')
+        if self._neighborhood == 'local':
+            Dest_e, Dsig_e, Dest_n, Dsig_n = self.krige_velocities_local(self._ktype)
+        else:
+            Dest_e, Dsig_e, Dest_n, Dsig_n = self.krige_velocities(self._ktype)
+            if self._approximation != 'none' and self._holdout_fraction > 0:
+                self.reportApproximationError(self._ktype)
         
         Ve = Dest_e.reshape(self._grid_shape)
         Vn = Dest_n.reshape(self._grid_shape)
@@ -168,14 +493,18 @@ class geostats(Strain_2d):
         Sn = Dsig_n.reshape(self._grid_shape)
 
         # Compute strain rates
-        dx, dy = self._grid_inc[0] * 111 * np.cos(np.deg2rad(self._strain_range[2])), self._grid_inc[1] * 111
-        exx, eyy, exy, rot = strain_on_regular_grid(dx, dy, Ve, Vn)
-
         # Right now we aren't calculating uncertainties for any method except geostats.
         # We might want to consider exploring adding uncertainties to other methods if
         # they are amenable; e.g. local average gradient and visr *should* be able to 
         # provide them. Others may not (wavelets, gpsgridder esp). 
-        var_dil, var_shear = calc_strain_uncertainty(np.square(Se), np.square(Sn), self._grid_inc[0], self._grid_inc[1], exx, eyy, exy)
+        if self._strain_mode == 'analytic':
+            exx, eyy, exy, rot, var_dil, var_shear = [np.asarray(x, dtype=self._dtype).reshape(self._grid_shape)
+                                                      for x in self.krige_strain(ktype=self._ktype)]
+        else:
+            dx, dy = self._grid_inc[0] * 111 * np.cos(np.deg2rad(self._strain_range[2])), self._grid_inc[1] * 111
+            exx, eyy, exy, rot = strain_on_regular_grid(dx, dy, Ve, Vn)
+            var_dil, var_shear = calc_strain_uncertainty(np.square(Se), np.square(Sn), dx, dy, exx, eyy, exy)
+        self.writeUncertainties(Se, Sn, var_dil*1e6, var_shear*1e6)
 
         # Report observed and residual velocities within bounding box
         velfield_within_box = utilities.filter_by_bounding_box(myVelfield, self._strain_range)
@@ -186,33 +515,451 @@ class geostats(Strain_2d):
         return Ve, Vn, rot*1000, exx*1000, exy*1000, eyy*1000, velfield_within_box, residual_velfield
         
 
-def krige(xy, XY, data, model, ktype='ok'):
+def krige(xy, XY, data, model, ktype='ok', solver=None, sig0=None, chunk_size=None, order=1):
     """
     Interpolate velocities using kriging
+
+    Parameters
+    ----------
+    xy: N x 2 ndarray           - Locations of the observed data
+    XY: M x 2 ndarray           - Query locations
+    data: N x 1 ndarray         - Observed data values
+    model: VariogramModel
+    ktype: str                  - 'sk', 'ok', or 'uk'
+    solver: CholeskyKriging     - optional, factored data covariance for this model, e.g. shared between components.
+                                  By default, from factor_covariance()
+    sig0: N x M ndarray         - optional, covariance of observed vs query locations for this model
+    chunk_size: int             - optional, number of query locations kriged at once, bounding memory to
+                                  a few N x chunk_size arrays. The weights lam are then not returned (None).
+    order: int                  - order of the polynomial drift for universal kriging, 1 (linear) or 2 (quadratic)
     """
-    # Create the data covariance matrix
-    SIG = compute_covariance(model, xy)
-    SIG = SIG + np.sqrt(np.finfo(float).eps)*np.eye(SIG.shape[0])
-    if not is_pos_def(SIG):
-        raise RuntimeError('SIG matrix is not positive definite, probably meaning it is ill-conditioned')
+    # Create and factor the data covariance matrix
+    if solver is None:
+        solver = factor_covariance(model, xy)
+
+    if sig0 is None and chunk_size and len(XY) > chunk_size:
+        Dest, Dsig = np.empty(len(XY)), np.empty(len(XY))
+        for start in range(0, len(XY), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            Dest[chunk], Dsig[chunk], _ = krige(xy, XY[chunk], data, model, ktype=ktype, solver=solver, order=order)
+        return Dest, Dsig, None
 
     # create the data/grid covariance and point-wise terms
-    sig0 = compute_covariance(model, xy, XY)
+    if sig0 is None:
+        sig0 = solver.crossCovariance(model, xy, XY)
     sig2 = model.getSigma00()
 
     # Do different things, depending on if SK, OK, or UK is desired
     if ktype == 'sk':
-        Dest, Dsig, lam = simple_kriging(SIG, sig0, data, sig2)
+        Dest, Dsig, lam = solver.simple(sig0, data, sig2)
     elif ktype == 'ok':
-        Dest, Dsig, lam, nu = ordinary_kriging(SIG, sig0, data, sig2)
+        Dest, Dsig, lam, nu = solver.ordinary(sig0, data, sig2)
     elif ktype == 'uk':
-        Dest, Dsig, lam = universal_kriging(SIG, sig0, data, sig2, xy, XY)
+        Dest, Dsig, lam, nu = solver.universal(sig0, data, sig2, xy, XY, order=order)
     else:
         raise ValueError('Method "{}" is not implemented'.format(ktype))
 
     return Dest, Dsig, lam
 
 
+def krige_gradient(xy, XY, data, model, ktype='ok', solver=None, chunk_size=None, order=1):
+    """
+    Interpolate the gradient of the field using kriging, with analytic derivatives of a differentiable model.
+    The cross-covariance of the data with the gradient at X is dC/dX_a = C'(h)/h * (X_a - x_a).
+
+    Parameters
+    ----------
+    Same as krige().
+
+    Returns
+    -------
+    dDdx, dDdy: M x 1 ndarrays      - Gradient of the field at the query locations, per unit of x and y
+    var_x, cov_xy, var_y: M x 1     - Kriging covariance of the two gradient components
+    """
+    if solver is None:
+        solver = factor_covariance(model, xy)
+
+    if chunk_size and len(XY) > chunk_size:
+        outputs = [krige_gradient(xy, XY[start:start + chunk_size], data, model, ktype=ktype, solver=solver,
+                                  order=order)
+                   for start in range(0, len(XY), chunk_size)]
+        return tuple(np.concatenate(x) for x in zip(*outputs))
+
+    gx, gy = solver.crossGradient(model, xy, XY)
+    return solver.gradient(gx, gy, data, model.getGradientVariance(), ktype=ktype, xy=xy, XY=XY, order=order)
+
+
+class CholeskyKriging:
+    """
+    Kriging solver that factors the data covariance once.
+    The Cholesky factor is reused for every query location, and the ordinary-kriging constraint
+    (weights summing to one) is applied through the Schur complement of the bordered system,
+    so the (N+1) x (N+1) system is never formed.
+
+    Parameters
+    ----------
+    SIG: N x N ndarray  - Covariance of all observed data locations, symmetric positive definite
+    """
+    def __init__(self, SIG):
+        self.covariance = SIG
+        try:
+            self._factor = cho_factor(SIG, lower=True)
+        except np.linalg.LinAlgError:
+            raise RuntimeError('SIG matrix is not positive definite, probably meaning it is ill-conditioned')
+        self._setConstraint(SIG.shape[0])
+
+    def _setConstraint(self, N):
+        # SIG^-1 1 and 1^T SIG^-1 1, used by the Schur complement of the constraint
+        self._b = self.solve(np.ones(N))
+        self._sum_b = np.sum(self._b)
+        self._drift = {}
+
+    def _getDrift(self, xy, order):
+        """
+        Drift terms of the data locations for universal kriging, cached by order: the centering and scaling of
+        the coordinates, A = SIG^-1 F, and the Cholesky factor of the small p x p matrix S = F^T SIG^-1 F.
+        """
+        if order not in self._drift:
+            center, scale = np.mean(xy, axis=0), max(np.max(np.ptp(xy, axis=0)), np.finfo(float).eps)
+            F = drift_basis(xy, order, center, scale)[0]
+            A = self.solve(F)
+            try:
+                S = cho_factor(np.dot(F.T, A), lower=True)
+            except np.linalg.LinAlgError:
+                raise RuntimeError('Too few data locations to fit a drift of order {}'.format(order))
+            self._drift[order] = (center, scale, A, S)
+        return self._drift[order]
+
+    def solve(self, B):
+        """Return SIG^-1 B, for a 1D or 2D ndarray B"""
+        return cho_solve(self._factor, B)
+
+    def crossCovariance(self, model, xy, XY, dist=None):
+        """
+        Covariance of the data locations vs the query locations, N x M, from their distances if given.
+        Approximate solvers return the covariance implied by their approximation instead.
+        """
+        return model(cdist(xy, XY) if dist is None else dist)
+
+    def crossGradient(self, model, xy, XY):
+        """Covariance of the data locations vs the x and y derivatives at the query locations, two N x M ndarrays"""
+        factor = model.radialDerivative(cdist(xy, XY))
+        return factor * (XY[:, 0][None, :] - xy[:, 0][:, None]), factor * (XY[:, 1][None, :] - xy[:, 1][:, None])
+
+    def simple(self, sig0, data, sig2):
+        """
+        Simple (i.e. zero-mean) kriging. Same inputs and outputs as simple_kriging().
+        """
+        lam = self.solve(sig0)
+        Dest = np.dot(lam.T, data)
+        Dsig = np.sqrt(sig2 - column_dot(lam, sig0))
+        return Dest, Dsig, lam
+
+    def ordinary(self, sig0, data, sig2):
+        """
+        Ordinary kriging (stationary non-zero mean). Same inputs and outputs as ordinary_kriging().
+        With b = SIG^-1 1, the Lagrange multiplier is mu = (b^T sig0 - 1) / (1^T b)
+        and the weights are lam = SIG^-1 sig0 - b mu.
+        """
+        lam = self.solve(sig0)
+        mu = (sig0.T.dot(self._b) - 1) / self._sum_b
+        lam -= np.outer(self._b, mu)
+        Dest = np.dot(lam.T, data)
+        Dsig = np.sqrt(sig2 - column_dot(lam, sig0) - mu)
+        return Dest, Dsig, lam, -mu
+
+    def universal(self, sig0, data, sig2, xy, XY, order=1):
+        """
+        Universal kriging, with a polynomial drift of the coordinates. Same inputs and outputs as
+        universal_kriging(), plus the drift coefficients (Lagrange multipliers) nu, p x M.
+        With F and F0 the drift terms at the data and query locations, A = SIG^-1 F and S = F^T A,
+        the bordered system reduces to mu = S^-1 (A^T sig0 - F0^T) and lam = SIG^-1 sig0 - A mu,
+        so beyond the factorization shared with ordinary kriging only a p x p system is solved.
+        """
+        center, scale, A, S = self._getDrift(xy, order)
+        F0 = drift_basis(XY, order, center, scale)[0]
+        lam = self.solve(sig0)
+        mu = cho_solve(S, sig0.T.dot(A).T - F0.T)
+        lam -= np.dot(A, mu)
+        Dest = np.dot(lam.T, data)
+        Dsig = np.sqrt(sig2 - column_dot(lam, sig0) - np.einsum('ij,ji->j', mu, F0))
+        return Dest, Dsig, lam, -mu
+
+    def gradient(self, gx, gy, data, grad_var, ktype='ok', xy=None, XY=None, order=1):
+        """
+        Kriging of the gradient of the field: the derivatives of the simple, ordinary, or universal kriging predictor.
+        For ordinary kriging the mean's gradient is zero, so the weights of each gradient component sum to zero,
+        giving lam_a = SIG^-1 g_a - b (b^T g_a) / (1^T b). The kriging covariance is delta_ab grad_var - lam_a^T g_b.
+        For universal kriging the weights reproduce the derivatives of the drift terms instead, F^T lam_a = dF0/dX_a,
+        and the covariance gains the term -(dF0/dX_a)^T mu_b.
+
+        Parameters
+        ----------
+        gx, gy: N x M ndarrays  - Covariance of observed locations vs the x and y derivatives at query locations
+        data: N x 1 ndarray     - Observed data values
+        grad_var: float         - Variance of each component of the gradient, -C''(0)
+        ktype: str              - 'sk', 'ok', or 'uk'
+        xy, XY, order           - Data and query locations, and drift order, for universal kriging
+
+        Returns
+        -------
+        dDdx, dDdy, var_x, cov_xy, var_y: M x 1 ndarrays
+        """
+        M = gx.shape[1]
+        G = np.hstack([gx, gy])
+        lam = self.solve(G)
+        drift_x, drift_xy, drift_y = 0, 0, 0
+        if ktype == 'ok':
+            lam -= np.outer(self._b, np.dot(self._b, G) / self._sum_b)
+        elif ktype == 'uk':
+            center, scale, A, S = self._getDrift(xy, order)
+            _, Fx, Fy = drift_basis(XY, order, center, scale)
+            mu = cho_solve(S, np.dot(A.T, G) - np.vstack([Fx, Fy]).T)
+            lam -= np.dot(A, mu)
+            drift_x = np.einsum('ij,ji->j', mu[:, :M], Fx)
+            drift_xy = np.einsum('ij,ji->j', mu[:, :M], Fy)
+            drift_y = np.einsum('ij,ji->j', mu[:, M:], Fy)
+        elif ktype != 'sk':
+            raise ValueError('Method "{}" is not implemented for gradients'.format(ktype))
+        lam_x, lam_y = lam[:, :M], lam[:, M:]
+        return (np.dot(lam_x.T, data), np.dot(lam_y.T, data), grad_var - np.einsum('ij,ij->j', lam_x, gx) - drift_x,
+                -np.einsum('ij,ij->j', lam_x, gy) - drift_xy, grad_var - np.einsum('ij,ij->j', lam_y, gy) - drift_y)
+
+
+class LowRankKriging(CholeskyKriging):
+    """
+    Kriging solver with a low-rank-plus-diagonal approximation of the data covariance, SIG ~ D + U U^T,
+    built from M << N inducing points Z: U = K(xy, Z) L^-T, with L L^T = K(Z, Z) for the model without its nugget.
+    D holds the nugget, at least 1e-4 of the sill, and with fitc=True also the exact diagonal of the part of the
+    covariance that U misses.
+    Solves use the Woodbury identity, costing O(N M^2) instead of O(N^3).
+    The covariances of the data vs the query locations go through the inducing points too, U L^-1 K(Z, XY),
+    so that the kriging variances are those of the approximate model (DTC, or FITC with fitc=True) and stay
+    non-negative; with the exact cross-covariances they can be negative.
+
+    Parameters
+    ----------
+    model: VariogramModel
+    xy: N x 2 ndarray   - Locations of the observed data
+    Z: M x 2 ndarray    - Locations of the inducing points
+    fitc: bool          - Correct the diagonal of the approximation (fully independent training conditional)
+    """
+    def __init__(self, model, xy, Z, fitc=False):
+        self.covariance = None
+        jitter = np.sqrt(np.finfo(float).eps)
+        K_ZZ = signal_covariance(model, squareform(pdist(Z))) + jitter*np.eye(len(Z))
+        try:
+            L = np.linalg.cholesky(K_ZZ)
+        except np.linalg.LinAlgError:
+            raise RuntimeError('Inducing-point covariance is not positive definite; try fewer inducing points')
+        self._U = solve_triangular(L, signal_covariance(model, cdist(Z, xy)), lower=True).T
+        self._Z, self._L = Z, L
+        # The nugget, floored at 1e-4 of the sill: with only the jitter, the Woodbury solve loses about as many
+        # digits as the sill has over the jitter, and the kriging variances come out negative or NaN
+        self._D = np.full(len(xy), max(model(0) - signal_covariance(model, 0) + jitter, 1e-4 * model(0)))
+        if fitc:
+            self._D += signal_covariance(model, 0) - np.einsum('ij,ij->i', self._U, self._U)
+        self._UD = self._U / self._D[:, None]
+        self._inner_factor = cho_factor(np.eye(len(Z)) + np.dot(self._U.T, self._UD), lower=True)
+        self._setConstraint(len(xy))
+
+    def solve(self, B):
+        """Return (D + U U^T)^-1 B via the Woodbury identity, for a 1D or 2D ndarray B"""
+        DB = B / (self._D if np.ndim(B) == 1 else self._D[:, None])
+        return DB - np.dot(self._UD, cho_solve(self._inner_factor, np.dot(self._U.T, DB)))
+
+    def crossCovariance(self, model, xy, XY, dist=None):
+        """Covariance of the data locations vs the query locations implied by the approximation, U L^-1 K(Z, XY)"""
+        return np.dot(self._U, solve_triangular(self._L, signal_covariance(model, cdist(self._Z, XY)), lower=True))
+
+    def crossGradient(self, model, xy, XY):
+        """Covariance of the data locations vs the derivatives at the query locations implied by the approximation"""
+        return [np.dot(self._U, solve_triangular(self._L, g, lower=True))
+                for g in CholeskyKriging.crossGradient(self, model, self._Z, XY)]
+
+
+class SparseKriging(CholeskyKriging):
+    """
+    Kriging solver for a sparse data covariance, as produced by compactly supported models.
+    The covariance is factored with a sparse LU decomposition (SuperLU in symmetric mode: a fill-reducing
+    ordering of SIG + SIG^T and no pivoting, which a positive definite matrix does not need), so memory and
+    time scale with the number of station pairs within the model's support instead of with N^2 and N^3.
+
+    Parameters
+    ----------
+    SIG: N x N sparse matrix    - Covariance of all observed data locations, symmetric positive definite
+    """
+    def __init__(self, SIG):
+        self.covariance = SIG
+        try:
+            self._lu = splu(SIG.tocsc(), permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0.,
+                            options=dict(SymmetricMode=True))
+        except RuntimeError:
+            raise RuntimeError('SIG matrix is singular, probably meaning it is ill-conditioned')
+        self._setConstraint(SIG.shape[0])
+
+    def solve(self, B):
+        """Return SIG^-1 B, for a 1D or 2D ndarray B, or a sparse matrix B (the result is dense)"""
+        return self._lu.solve(B.toarray() if issparse(B) else np.asarray(B, dtype=float))
+
+    def crossCovariance(self, model, xy, XY, dist=None):
+        """Covariance of the data locations vs the query locations as a sparse N x M matrix, without distances"""
+        return compute_sparse_covariance(model, xy, XY)
+
+
+def column_dot(lam, sig0):
+    """Dot products of the matching columns of lam (dense) and sig0 (dense or sparse)"""
+    if issparse(sig0):
+        return np.asarray(sig0.multiply(lam).sum(axis=0)).ravel()
+    return np.einsum('ij,ij->j', lam, sig0)
+
+
+def factor_covariance(model, xy):
+    """
+    Build and factor the covariance of the data locations, with a small jitter on the diagonal.
+
+    Parameters
+    ----------
+    model: VariogramModel
+    xy: N x 2 ndarray   - Locations of the observed data
+
+    Returns
+    -------
+    solver: SparseKriging for compactly supported models, otherwise CholeskyKriging
+    """
+    jitter = np.sqrt(np.finfo(float).eps)
+    if model.getSupport() is not None:
+        SIG = compute_sparse_covariance(model, xy)
+        return SparseKriging(SIG + jitter*identity(SIG.shape[0], format='csc'))
+    SIG = compute_covariance(model, xy)
+    return CholeskyKriging(SIG + jitter*np.eye(SIG.shape[0]))
+
+
+def signal_covariance(model, dist):
+    """The covariance of a model without its nugget, i.e., the spatially correlated part"""
+    _, _, nugget = model.getParms()
+    C = model(dist)
+    if nugget is not None:
+        C = C - nugget*(np.asarray(dist) == 0)
+    return C
+
+
+def choose_inducing_points(xy, num_points, method='nystrom', seed=0):
+    """
+    Choose inducing points for LowRankKriging.
+
+    Parameters
+    ----------
+    xy: N x 2 ndarray   - Locations of the observed data
+    num_points: int     - Number of inducing points M; all stations are used if M >= N
+    method: str         - 'nystrom' for a random subset of the stations, or
+                          'inducing' for k-means cluster centers of the stations, which follow the station density
+    seed: int           - Seed of the random generator, for reproducible runs
+
+    Returns
+    -------
+    Z: M x 2 ndarray
+    """
+    if num_points >= len(xy):
+        return np.array(xy)
+    rng = np.random.default_rng(seed)
+    Z = xy[np.sort(rng.choice(len(xy), size=num_points, replace=False))]
+    if method == 'inducing':
+        Z, _ = kmeans2(xy, Z, minit='matrix')
+    return Z
+
+
+def empirical_variogram(xy, data, max_lag, num_lags=20, max_pairs=1000000, seed=0):
+    """
+    Binned empirical semivariogram, gamma(h) = 0.5 * mean((z_i - z_j)^2) over the pairs separated by about h.
+    Pairs within max_lag are found with a KD-tree, in chunks of stations, so all N^2 pairs are never formed.
+    If there are more than about max_pairs of them, only the pairs of a random subset of stations are used.
+
+    Parameters
+    ----------
+    xy: N x 2 ndarray       - Locations of the observed data
+    data: N x K ndarray     - Observed data values, e.g. east and north velocities; each column is binned
+    max_lag: float          - Largest separation considered
+    num_lags: int           - Number of equal-width distance bins
+    max_pairs: int          - Approximate number of pairs to use
+    seed: int               - Seed of the random generator, for reproducible subsets
+
+    Returns
+    -------
+    lags: B x 1 ndarray     - Mean separation of the pairs in each non-empty bin
+    gamma: B x K ndarray    - Semivariance of each column of data in each bin
+    counts: B x 1 ndarray   - Number of pairs in each bin
+    """
+    N = len(xy)
+    data = np.asarray(data, dtype=float).reshape(N, -1)
+    tree = cKDTree(xy)
+    rng = np.random.default_rng(seed)
+
+    # Number of stations whose pairs fit the budget, from the neighbor counts of a sample of stations
+    sample = rng.choice(N, size=min(N, 1000), replace=False)
+    pairs_per_station = max(np.mean(tree.query_ball_point(xy[sample], max_lag, return_length=True)) - 1, 1)
+    num_stations = min(N, max(int(max_pairs / pairs_per_station), 1))
+    if num_stations < N:
+        stations = np.sort(rng.choice(N, size=num_stations, replace=False))
+    else:
+        stations = np.arange(N)
+    chunk_size = max(int(100000 / pairs_per_station), 1)
+
+    counts, lag_sums = np.zeros(num_lags), np.zeros(num_lags)
+    sums = np.zeros((num_lags, data.shape[1]))
+    for start in range(0, num_stations, chunk_size):
+        chunk = stations[start:start + chunk_size]
+        pairs = cKDTree(xy[chunk]).sparse_distance_matrix(tree, max_lag, output_type='ndarray')
+        i, j, h = chunk[pairs['i']], pairs['j'], pairs['v']
+        keep = i < j if num_stations == N else i != j  # each pair once when all stations are used
+        i, j, h = i[keep], j[keep], h[keep]
+        bins = np.minimum((h / max_lag * num_lags).astype(int), num_lags - 1)
+        counts += np.bincount(bins, minlength=num_lags)
+        lag_sums += np.bincount(bins, weights=h, minlength=num_lags)
+        for k in range(data.shape[1]):
+            sums[:, k] += np.bincount(bins, weights=np.square(data[i, k] - data[j, k]), minlength=num_lags)
+
+    nonempty = counts > 0
+    return lag_sums[nonempty] / counts[nonempty], 0.5 * sums[nonempty] / counts[nonempty, None], counts[nonempty]
+
+
+def fit_variogram(model, lags, gamma, counts, p0=None):
+    """
+    Fit the sill, range, and nugget of a variogram model to an empirical semivariogram, by least squares
+    weighted by the number of pairs in each bin. The model's parameters are updated in place.
+
+    Parameters
+    ----------
+    model: VariogramModel       - Model with a sill and a range, e.g. Gaussian
+    lags: B x 1 ndarray         - Separations, from empirical_variogram()
+    gamma: B x 1 ndarray        - Semivariances of one data component, from empirical_variogram()
+    counts: B x 1 ndarray       - Number of pairs in each bin, from empirical_variogram()
+    p0: tuple                   - optional, initial (sill, range, nugget). Default is estimated from gamma.
+
+    Returns
+    -------
+    model: VariogramModel
+    """
+    if isinstance(model, Nugget):
+        raise ValueError('Only models with a sill and a range can be fitted, not {}'.format(model._model))
+
+    def semivariance(h, sill, rang, nugget):
+        model.setParms(sill=sill, range=rang, nugget=nugget)
+        return sill + nugget - signal_covariance(model, h)
+
+    tiny = np.finfo(float).eps
+    if p0 is None:
+        p0 = (max(np.max(gamma) - np.min(gamma), tiny), np.max(lags) / 3, max(np.min(gamma), tiny))
+    p0 = np.maximum(p0, tiny)
+    try:
+        popt, _ = curve_fit(semivariance, lags, gamma, p0=p0, sigma=1 / np.sqrt(counts),
+                            bounds=([0, tiny, 0], [np.inf, np.inf, np.inf]))
+    except RuntimeError:
+        raise RuntimeError('Variogram fit did not converge; try giving initial sill, range, and nugget values')
+    model.setParms(sill=popt[0], range=popt[1], nugget=popt[2])
+    return model
+
+
 def simple_kriging(SIG, sig0, data, sig2):
     """
     Perform simple (i.e. zero-mean) kriging
@@ -230,14 +977,7 @@ def simple_kriging(SIG, sig0, data, sig2):
     Dsig: M x 1 ndarray - Sqrt of the kriging variance for each query location
     lam:  N x M ndarray - weights relating all of the data locations to all of the query locations
     """
-    A = SIG
-    B = sig0
-    lam = np.linalg.lstsq(A, B, rcond=None)
-    Dest = np.dot(lam.T, data)
-    Dsig = []
-    for k in range(lam.shape[1]):
-        Dsig.append(np.sqrt(sig2 - np.dot(lam[:, k], sig0[:, k])))
-    return Dest, np.array(Dsig), lam
+    return CholeskyKriging(SIG).simple(sig0, data, sig2)
 
 
 def ordinary_kriging(SIG, sig0, data, sig2):
@@ -257,26 +997,14 @@ def ordinary_kriging(SIG, sig0, data, sig2):
     Dsig: M x 1 ndarray - Sqrt of the kriging variance for each query location
     lam:  N x M ndarray - weights relating all of the data locations to all of the query locations
     """
-    M, N = sig0.shape
-    A = np.block([
-        [SIG, np.ones((M, 1))],
-        [np.ones((1, M)), 0],
-    ])
-    B = np.vstack([sig0, np.ones((1, N))])
-    lam_nu, _, _, _ = np.linalg.lstsq(A, B, rcond=None)
-    lam = lam_nu[:-1, :]
-    nu = -lam_nu[-1, :]
-    Dest = np.dot(lam.T, data)
-    Dsig = []
-    for k in range(lam.shape[1]):
-        Dsig.append(np.sqrt(sig2 - np.dot(lam[:, k], sig0[:, k]) + nu[k]))
-    return Dest, np.array(Dsig), lam, nu
-
-
-def universal_kriging(SIG, sig0, data, sig2, xy, XY):
+    return CholeskyKriging(SIG).ordinary(sig0, data, sig2)
+
+
+def universal_kriging(SIG, sig0, data, sig2, xy, XY, order=1):
     """
     Perform universal kriging (field can be a linear function of "space". In reality 
     "space" can be any auxilliary variables, such as xy-location, topographic height, etc.)
+    Here the drift is a polynomial of the xy-location.
 
     Parameters
     ----------
@@ -284,8 +1012,9 @@ def universal_kriging(SIG, sig0, data, sig2, xy, XY):
     sig0: N x M ndarray - Covariance of observed vs query locations
     data: N x 1 ndarray - Observed data values
     sig2: 1 x 1 float   - point-wise variance
-    xy: N x D ndarray   - Location of the observed data in D-dimensional space
-    XY: M x D ndarray   - Location of the query locations in D-dimensional space
+    xy: N x 2 ndarray   - Location of the observed data
+    XY: M x 2 ndarray   - Location of the query locations
+    order: int          - Order of the polynomial drift, 1 (linear) or 2 (quadratic)
 
     Returns
     -------
@@ -293,7 +1022,34 @@ def universal_kriging(SIG, sig0, data, sig2, xy, XY):
     Dsig: M x 1 ndarray - Sqrt of the kriging variance for each query location
     lam:  N x M ndarray - weights relating all of the data locations to all of the query locations
     """
-    raise NotImplementedError
+    return CholeskyKriging(SIG).universal(sig0, data, sig2, xy, XY, order=order)[0:3]
+
+
+def drift_basis(XY, order, center, scale):
+    """
+    Polynomial drift terms for universal kriging, in coordinates centered and scaled for conditioning.
+
+    Parameters
+    ----------
+    XY: M x 2 ndarray   - Locations
+    order: int          - 1 for [1, u, v], 2 for [1, u, v, u^2, uv, v^2], with u, v = (XY - center) / scale
+    center: 1 x 2 ndarray
+    scale: float
+
+    Returns
+    -------
+    F, Fx, Fy: M x p ndarrays - Drift terms and their derivatives with respect to x and y
+    """
+    if order not in (1, 2):
+        raise ValueError('Drift order must be 1 (linear) or 2 (quadratic), not {}'.format(order))
+    u, v = ((np.asarray(XY) - center) / scale).T
+    one, zero = np.ones(len(u)), np.zeros(len(u))
+    F, Fx, Fy = [one, u, v], [zero, one / scale, zero], [zero, zero, one / scale]
+    if order == 2:
+        F += [u*u, u*v, v*v]
+        Fx += [2*u / scale, v / scale, zero]
+        Fy += [zero, u / scale, 2*v / scale]
+    return np.array(F).T, np.array(Fx).T, np.array(Fy).T
 
 
 def compute_covariance(model, xy, XY=None):
@@ -309,6 +1065,19 @@ def compute_covariance(model, xy, XY=None):
     return C
 
 
+def compute_sparse_covariance(model, xy, XY=None):
+    """
+    Returns the covariance matrix of a compactly supported model as a sparse matrix.
+    Only pairs of locations within the model's support are found (with a KD-tree) and evaluated,
+    so no dense N x N (or N x M) distance matrix is formed.
+    """
+    tree = cKDTree(xy)
+    other = tree if XY is None else cKDTree(XY)
+    pairs = tree.sparse_distance_matrix(other, model.getSupport(), output_type='ndarray')
+    shape = (len(xy), len(xy) if XY is None else len(XY))
+    return coo_matrix((model(pairs['v']), (pairs['i'], pairs['j'])), shape=shape).tocsc()
+
+
 class VariogramModel(ABC):
     """ Defines the base variogram model class"""
     def __init__(
@@ -351,6 +1120,18 @@ class VariogramModel(ABC):
     def getSigma00(self):
         return self._params['sill']
 
+    def getSupport(self):
+        """Distance beyond which the covariance is exactly zero, or None if it never is"""
+        return None
+
+    def radialDerivative(self, h):
+        """C'(h) / h, which gives the covariance of the field with its gradient; finite at h = 0 for smooth models"""
+        raise NotImplementedError('The {} model is not differentiable; use Gaussian or Wendland'.format(self._model))
+
+    def getGradientVariance(self):
+        """Variance of each component of the field's gradient, -C''(0)"""
+        return -self.radialDerivative(0.)
+
 class Nugget(VariogramModel):
     """Implements a nugget model"""
     def __init__(self, nugget=None):
@@ -381,6 +1162,12 @@ class Gaussian(VariogramModel):
             return self._params['sill']*np.exp(-np.square(h / self._params['range'])) + self._params['nugget']*(h == 0)
 
 
+    def radialDerivative(self, h):
+        if self._params['sill'] is None:
+            raise RuntimeError('You must first specify the parameters of the {} model'.format(self._model))
+        return -2*self._params['sill']/self._params['range']**2*np.exp(-np.square(h / self._params['range']))
+
+
 class Exponential(VariogramModel):
     """Implements an Exponential model"""
     def __init__(self,
@@ -400,6 +1187,61 @@ class Exponential(VariogramModel):
             return self._params['sill']*np.exp(-h/self._params['range']) + self._params['nugget']*(h == 0)  # add nugget
 
 
+class Spherical(VariogramModel):
+    """Implements a Spherical model, which is exactly zero beyond its range"""
+    def __init__(self,
+                 sill=None,
+                 range=None,
+                 nugget=None
+                 ):
+        VariogramModel.__init__(self, 'Spherical')
+        self.setParms(sill=sill, range=range, nugget=nugget)
+
+    def __call__(self, h):
+        if self._params['sill'] is None:
+            raise RuntimeError('You must first specify the parameters of the {} model'.format(self._model))
+        r = np.minimum(h / self._params['range'], 1)
+        C = self._params['sill']*(1 - 1.5*r + 0.5*r**3)
+        if self._params['nugget'] is not None:
+            C = C + self._params['nugget']*(h == 0)
+        return C
+
+    def getSupport(self):
+        return self._params['range']
+
+
+class Wendland(VariogramModel):
+    """
+    Implements a Wendland (C2, i.e. twice differentiable) model, which is exactly zero beyond its range.
+    Smooth like the Gaussian model near the origin, but with compact support.
+    """
+    def __init__(self,
+                 sill=None,
+                 range=None,
+                 nugget=None
+                 ):
+        VariogramModel.__init__(self, 'Wendland')
+        self.setParms(sill=sill, range=range, nugget=nugget)
+
+    def __call__(self, h):
+        if self._params['sill'] is None:
+            raise RuntimeError('You must first specify the parameters of the {} model'.format(self._model))
+        r = np.minimum(h / self._params['range'], 1)
+        C = self._params['sill']*(1 - r)**4*(4*r + 1)
+        if self._params['nugget'] is not None:
+            C = C + self._params['nugget']*(h == 0)
+        return C
+
+    def getSupport(self):
+        return self._params['range']
+
+    def radialDerivative(self, h):
+        if self._params['sill'] is None:
+            raise RuntimeError('You must first specify the parameters of the {} model'.format(self._model))
+        r = np.minimum(h / self._params['range'], 1)
+        return -20*self._params['sill']/self._params['range']**2*(1 - r)**3
+
+
 def is_pos_def(A):
     if np.array_equal(A, A.T):
         try:
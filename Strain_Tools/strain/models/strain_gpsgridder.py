@@ -1,10 +1,13 @@
-# Use GPS Gridder from GMT to interpolate between GPS stations
+# Use GPS Gridder to interpolate between GPS stations
 # The algorithm is based on the greens functions for elastic sheets with a given Poisson's ratio. 
 # From: Sandwell, D. T., and P. Wessel (2016),
 # Interpolation of 2-D vector data using constraints from elasticity, Geophys. Res.Lett. 
+# By default this calls 'gmt gpsgridder'. Set implementation = native to run the same interpolation in NumPy,
+# with the same -S, -Fd, -C, and -fg semantics, without GMT.
 
 
 import numpy as np
+from scipy.linalg import eigh
 import subprocess
 import xarray as xr
 import os
@@ -21,11 +24,21 @@ class gpsgridder(Strain_2d):
         self._Name = 'gpsgridder'
         self._tempdir = params.outdir
         self._poisson, self._fd, self._eigenvalue = verify_inputs_gpsgridder(params.method_specific)
+        self._implementation = params.method_specific.get('implementation', '') or 'gmt'
+        if self._implementation not in ('native', 'gmt'):
+            raise ValueError("\ngps_gridder implementation must be native or gmt, not " + self._implementation + "\n")
+        self._dtype = params.precision
 
     def compute(self, myVelfield):
-        [Ve, Vn, rot_grd, exx_grd, exy_grd, eyy_grd] = compute_gpsgridder(myVelfield, self._strain_range,
-                                                                          self._grid_inc, self._poisson, self._fd,
-                                                                          self._eigenvalue, self._tempdir)
+        if self._implementation == 'gmt':
+            [Ve, Vn, rot_grd, exx_grd, exy_grd, eyy_grd] = compute_gpsgridder(myVelfield, self._strain_range,
+                                                                              self._grid_inc, self._poisson, self._fd,
+                                                                              self._eigenvalue, self._tempdir,
+                                                                              self._dtype)
+        else:
+            [Ve, Vn, rot_grd, exx_grd, exy_grd, eyy_grd] = compute_gpsgridder_native(
+                myVelfield, self._xdata, self._ydata, self._strain_range, self._grid_inc, float(self._poisson),
+                float(self._fd), float(self._eigenvalue), self._tempdir, dtype=self._dtype)
         # Report observed and residual velocities within bounding box
         velfield_within_box = utilities.filter_by_bounding_box(myVelfield, self._strain_range)
         model_velfield = utilities.create_model_velfield(self._xdata, self._ydata, Ve, Vn, velfield_within_box)
@@ -48,7 +61,13 @@ def verify_inputs_gpsgridder(method_specific_dict):
 
 # ----------------- COMPUTE -------------------------
 
-def compute_gpsgridder(myVelfield, range_strain, inc, poisson, fd, eigenvalue, tempoutdir):
+# GMT's flat-earth conversion (-fg), from the mean Earth radius of 6371.0088 km.
+# The native path uses it both for the interpolation and for differencing the gridded velocities into strain rates.
+# The GMT path keeps differencing with 111.000 km per degree, so its results are unchanged.
+KM_PER_DEG = 111.195
+
+
+def compute_gpsgridder(myVelfield, range_strain, inc, poisson, fd, eigenvalue, tempoutdir, dtype=np.float64):
     print("------------------------------\nComputing strain via gpsgridder method.")
     velocity_io.write_gmt_format(myVelfield, "tempgps.txt")
     command = "gmt gpsgridder tempgps.txt" + \
@@ -79,9 +98,9 @@ def compute_gpsgridder(myVelfield, range_strain, inc, poisson, fd, eigenvalue, t
     file1 = tempoutdir+"nc_u.nc"
     file2 = tempoutdir+"nc_v.nc"
     ds = xr.open_dataset(file1)
-    udata = ds["z"].to_numpy()
+    udata = ds["z"].to_numpy().astype(dtype, copy=False)
     ds = xr.open_dataset(file2)
-    vdata = ds["z"].to_numpy()
+    vdata = ds["z"].to_numpy().astype(dtype, copy=False)
 
     xinc = float(subprocess.check_output('gmt grdinfo -M -C '+file1+' | awk \'{print $8}\'', shell=True))  # x-inc
     yinc = float(subprocess.check_output('gmt grdinfo -M -C '+file1+' | awk \'{print $9}\'', shell=True))  # y-inc
@@ -92,3 +111,129 @@ def compute_gpsgridder(myVelfield, range_strain, inc, poisson, fd, eigenvalue, t
 
     print("Success computing strain via gpsgridder method.\n")
     return [udata, vdata, rot, exx, exy, eyy]
+
+
+def compute_gpsgridder_native(myVelfield, xdata, ydata, range_strain, inc, poisson, fd, eigenvalue, outdir,
+                              chunk_size=2000, dtype=np.float64):
+    """
+    Sandwell & Wessel (2016) elastic interpolation, as in 'gmt gpsgridder -S<poisson> -Fd<fd> -C<eigenvalue> -fg',
+    without calling GMT. Writes the fit at the stations to misfitfile.txt in outdir, like gpsgridder -E.
+
+    :param myVelfield: VelocityField or list of StationVels
+    :param xdata: 1d array of grid longitudes
+    :param ydata: 1d array of grid latitudes
+    :param range_strain: list, [w, e, s, n]
+    :param inc: list, [xinc, yinc] in degrees
+    :param poisson: float, Poisson's ratio
+    :param fd: float, fudge distance in km added to all distances, avoiding the singularity at zero distance
+    :param eigenvalue: float, singular values smaller than this fraction of the largest are discarded
+    :param outdir: string
+    :param chunk_size: int, number of grid points evaluated at once
+    :param dtype: precision of the output grids. The fit is always done in float64.
+    :returns: [udata, vdata, rot, exx, exy, eyy], 2d arrays
+    """
+    print("------------------------------\nComputing strain via gpsgridder method (native).")
+    myVelfield = velocity_io.as_velocity_field(myVelfield)
+    lon, lat, e, n = myVelfield.elon, myVelfield.nlat, myVelfield.e, myVelfield.n
+    forces, mean_e, mean_n, num_kept = fit_body_forces(lon, lat, e, n, poisson, fd, eigenvalue)
+    print("Solved for body forces at %d stations, keeping %d of %d singular values" % (len(lon), num_kept,
+                                                                                     2 * len(lon)))
+
+    [X, Y] = np.meshgrid(xdata, ydata)
+    udata, vdata = evaluate_body_forces(lon, lat, forces, X.flatten(), Y.flatten(), poisson, fd, chunk_size, dtype)
+    udata, vdata = udata.reshape(X.shape), vdata.reshape(X.shape)
+    udata += mean_e
+    vdata += mean_n
+
+    model_e, model_n = evaluate_body_forces(lon, lat, forces, lon, lat, poisson, fd, chunk_size)
+    model_e, model_n = model_e + mean_e, model_n + mean_n
+    print("Misfit at stations: rms u %f, rms v %f" % (np.sqrt(np.mean(np.square(e - model_e))),
+                                                      np.sqrt(np.mean(np.square(n - model_n)))))
+    misfitfile = os.path.join(outdir, 'misfitfile.txt')
+    print("Writing file %s " % misfitfile)
+    np.savetxt(misfitfile, np.column_stack((lon, lat, e, model_e, e - model_e, n, model_n, n - model_n)), fmt='%f',
+               header='lon(deg) lat(deg) VE(mm) VE_model(mm) VE_misfit(mm) VN(mm) VN_model(mm) VN_misfit(mm)')
+
+    xinc = inc[0] * KM_PER_DEG * np.cos(np.deg2rad(range_strain[2]))  # in km (not degrees)
+    yinc = inc[1] * KM_PER_DEG   # in km (not degrees)
+    [exx, eyy, exy, rot] = strain_tensor_toolbox.strain_on_regular_grid(xinc, yinc, udata * 1000, vdata * 1000)
+
+    print("Success computing strain via gpsgridder method.\n")
+    return [udata, vdata, rot, exx, exy, eyy]
+
+
+def flat_earth_offsets(lon0, lat0, lon1, lat1):
+    """
+    East and north distances from points 1 to points 0, with the flat-earth approximation of gpsgridder -fg
+    at the mean latitude of each pair. Broadcasts like numpy arithmetic.
+
+    :returns: dx, dy, in km
+    """
+    dx = (lon0 - lon1) * np.cos(np.deg2rad(0.5 * (lat0 + lat1))) * KM_PER_DEG
+    dy = (lat0 - lat1) * KM_PER_DEG
+    return dx, dy
+
+
+def greens_functions(dx, dy, poisson, fd):
+    """
+    Green's functions of a thin elastic sheet for a point body force (Sandwell & Wessel, 2016), up to a constant:
+    q and p give the x and y displacements from x and y forces, and w the coupling between them.
+    Zero at zero distance if there is no fudge distance.
+
+    :param dx: array of east distances in km
+    :param dy: array of north distances in km
+    :param poisson: float, Poisson's ratio
+    :param fd: float, fudge distance in km
+    :returns: q, p, w, arrays like dx
+    """
+    c1, c2 = (3 - poisson) / 2, 1 + poisson
+    dr2 = dx * dx + dy * dy + fd * fd
+    singular = dr2 == 0
+    dr2 = np.where(singular, 1, dr2)
+    c1_log, c2_dr2 = c1 * np.log(dr2), np.where(singular, 0, c2 / dr2)
+    q = np.where(singular, 0, c1_log + c2_dr2 * dy * dy)
+    p = np.where(singular, 0, c1_log + c2_dr2 * dx * dx)
+    w = -c2_dr2 * dx * dy
+    return q, p, w
+
+
+def fit_body_forces(lon, lat, e, n, poisson, fd, eigenvalue):
+    """
+    Solve for the body forces at the stations that reproduce their velocities, after removing the mean velocity.
+    The 2N x 2N system [[Q, W], [W, P]] is symmetric, so its SVD comes from a symmetric eigen-decomposition;
+    singular values below eigenvalue times the largest are discarded, like gpsgridder -C.
+
+    :returns: forces (2N array, x forces then y forces), mean east velocity, mean north velocity, number of
+              singular values kept
+    """
+    dx, dy = flat_earth_offsets(lon[:, None], lat[:, None], lon[None, :], lat[None, :])
+    q, p, w = greens_functions(dx, dy, poisson, fd)
+    mean_e, mean_n = np.mean(e), np.mean(n)
+    values, vectors = eigh(np.block([[q, w], [w, p]]))
+    keep = np.abs(values) >= eigenvalue * np.max(np.abs(values))
+    vectors = vectors[:, keep]
+    forces = np.dot(vectors, np.dot(vectors.T, np.concatenate((e - mean_e, n - mean_n))) / values[keep])
+    return forces, mean_e, mean_n, np.sum(keep)
+
+
+def evaluate_body_forces(lon, lat, forces, xlons, ylats, poisson, fd, chunk_size=2000, dtype=np.float64):
+    """
+    Velocities at any points from the body forces at the stations, chunk_size points at a time.
+
+    :param lon: 1d array of station longitudes
+    :param lat: 1d array of station latitudes
+    :param forces: 1d array, from fit_body_forces
+    :param xlons: 1d array of longitudes of the points
+    :param ylats: 1d array of latitudes of the points
+    :param dtype: precision of u and v
+    :returns: u, v, 1d arrays (without the mean velocity)
+    """
+    fx, fy = forces[:len(lon)], forces[len(lon):]
+    u, v = np.empty(len(xlons), dtype=dtype), np.empty(len(xlons), dtype=dtype)
+    for start in range(0, len(xlons), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        dx, dy = flat_earth_offsets(xlons[chunk, None], ylats[chunk, None], lon[None, :], lat[None, :])
+        q, p, w = greens_functions(dx, dy, poisson, fd)
+        u[chunk] = np.dot(q, fx) + np.dot(w, fy)
+        v[chunk] = np.dot(w, fx) + np.dot(p, fy)
+    return u, v
@@ -2,8 +2,9 @@
 # Strain calculation tool based on a certain number of nearby stations
 
 import numpy as np
+from scipy.spatial import cKDTree
 from strain.models.strain_2d import Strain_2d
-from .. import utilities
+from .. import utilities, velocity_io
 
 
 class loc_avg_grad(Strain_2d):
@@ -12,11 +13,15 @@ class loc_avg_grad(Strain_2d):
         Strain_2d.__init__(self, params.inc, params.range_strain, params.range_data, params.xdata, params.ydata,
                            params.outdir)
         self._Name = 'loc_avg_grad'
-        self._radiuskm, self._nstations = verify_inputs_loc_avg_grad(params.method_specific)
+        [self._radiuskm, self._nstations, self._neighborhood,
+         self._weighting] = verify_inputs_loc_avg_grad(params.method_specific)
+        self._dtype = params.precision
 
     def compute(self, myVelfield):
         [Ve, Vn, rot_grd, exx_grd, exy_grd, eyy_grd] = compute_loc_avg_grad(myVelfield, self._xdata, self._ydata,
-                                                                            self._radiuskm, self._nstations)
+                                                                            self._radiuskm, self._nstations,
+                                                                            self._neighborhood, self._weighting,
+                                                                            self._dtype)
         # Report observed and residual velocities within bounding box
         velfield_within_box = utilities.filter_by_bounding_box(myVelfield, self._strain_range)
         model_velfield = utilities.create_model_velfield(self._xdata, self._ydata, Ve, Vn, velfield_within_box)
@@ -32,19 +37,40 @@ def verify_inputs_loc_avg_grad(method_specific_dict):
         raise ValueError("\nloc_avg_grad requires nstations. Please add to method_specific config. Exiting.\n")
     radiuskm = float(method_specific_dict["estimateradiuskm"])
     nstations = int(method_specific_dict["nstations"])
-    return radiuskm, nstations
-
-
-def compute_loc_avg_grad(myVelfield, xlons, ylats, radiuskm, nstations):
+    neighborhood = method_specific_dict.get("neighborhood", "nearest") or "nearest"
+    weighting = method_specific_dict.get("weighting", "none") or "none"
+    if neighborhood not in ("nearest", "radius"):
+        raise ValueError("\nloc_avg_grad neighborhood must be nearest or radius, not " + neighborhood + ". Exiting.\n")
+    if weighting not in ("none", "inverse_distance", "uncertainty"):
+        raise ValueError("\nloc_avg_grad weighting must be none, inverse_distance, or uncertainty, not " + weighting +
+                         ". Exiting.\n")
+    return radiuskm, nstations, neighborhood, weighting
+
+
+def compute_loc_avg_grad(myVelfield, xlons, ylats, radiuskm, nstations, neighborhood='nearest', weighting='none',
+                         dtype=np.float64):
+    """
+    :param myVelfield: VelocityField or list of StationVels
+    :param xlons: 1d array of grid longitudes
+    :param ylats: 1d array of grid latitudes
+    :param radiuskm: float, radius of the neighborhood in km
+    :param nstations: int, the number of nearest stations used ('nearest'), or the minimum number ('radius')
+    :param neighborhood: 'nearest' uses the nstations nearest stations, if all are within the radius.
+        'radius' uses all stations within the radius, if there are at least nstations.
+    :param weighting: 'none', 'inverse_distance' (1/distance, floored at 1 km), or 'uncertainty' (1/sigma^2)
+    :param dtype: precision of the output grids. The plane fits are always done in float64.
+    :returns: [Ve, Vn, rot, exx, exy, eyy], 2d arrays
+    """
     print("------------------------------\nComputing strain via loc_avg_grad method.")
 
     # Set up grids for the computation
     gx = len(xlons)  # number of x - grid
     gy = len(ylats)  # number of y - grid
 
-    [elon, nlat, e, n, _, _] = velfield_to_LAG_non_utm(myVelfield)
-    reflon = np.min([item.elon for item in myVelfield])
-    reflat = np.min([item.nlat for item in myVelfield])
+    myVelfield = velocity_io.as_velocity_field(myVelfield)
+    [elon, nlat, e, n, esig, nsig] = velfield_to_LAG_non_utm(myVelfield)
+    reflon = np.min(myVelfield.elon)
+    reflat = np.min(myVelfield.nlat)
 
     # set up a local coordinate reference
     refx = np.min(elon)
@@ -56,112 +82,141 @@ def compute_loc_avg_grad(myVelfield, xlons, ylats, radiuskm, nstations):
     EstimateRadius = radiuskm * 1000  # convert to meters
     ns = nstations  # number of selected stations
 
-    # 2. The main loop, getting displacement gradients around ns nearest stations
-    Uxx = np.zeros((gy, gx))
-    Uyy = np.zeros((gy, gx))
-    Uxy = np.zeros((gy, gx))
-    Uyx = np.zeros((gy, gx))
-    exx = np.zeros((gy, gx))
-    exy = np.zeros((gy, gx))
-    eyy = np.zeros((gy, gx))
-    rot = np.zeros((gy, gx))
-    Ve = np.zeros((gy, gx))
-    Vn = np.zeros((gy, gx))
-    for i in range(gx):
-        for j in range(gy):
-            [gridX_loc, gridY_loc] = convert_to_local_planar(xlons[i], ylats[j], reflon, reflat)
-            X = elon   # in local coordinates, m
-            Y = nlat   # in local coordiantes, m
-            l1 = len(elon)
-
-            # the distance from stations to grid
-            r = np.zeros((l1,))
-            for ii in range(l1):
-                r[ii] = np.sqrt((gridX_loc - X[ii]) * (gridX_loc - X[ii]) + (gridY_loc - Y[ii]) * (gridY_loc - Y[ii]))
-                # for a particular grid point, we are computing the distance to every station
-
-            stations = np.zeros((l1, 5))
-            stations[:, 0] = r
-            stations[:, 1] = elon.reshape((l1,))
-            stations[:, 2] = nlat.reshape((l1,))
-            stations[:, 3] = e.reshape((l1,))
-            stations[:, 4] = n.reshape((l1,))
-
-            iX = stations[stations[:, 0].argsort()]  # sort data, iX represented the order of the sorting of 1st column
-            # we choose the first ns data
-            SelectStations = np.zeros((ns, 5))
-            for iiii in range(ns):
-                SelectStations[iiii, :] = iX[iiii, :]
-            # print(SelectStations)
-            Px, Py = 0, 0
-            Px2, Py2, Pxy = 0, 0, 0
-            dU, dV = 0, 0
-            dxU, dyU = 0, 0
-            dxV, dyV = 0, 0  # should be inside the if statement or not?
-            # print(SelectStations[ns-1, 0])  # the distance of the cutoff station (in m)
-            if SelectStations[ns-1, 0] <= EstimateRadius:
-                for iii in range(ns):
-                    Px = Px + SelectStations[iii, 1]
-                    Py = Py + SelectStations[iii, 2]
-                    Px2 = Px2 + SelectStations[iii, 1] * SelectStations[iii, 1]
-                    Py2 = Py2 + SelectStations[iii, 2] * SelectStations[iii, 2]
-                    Pxy = Pxy + SelectStations[iii, 1] * SelectStations[iii, 2]
-                    dU = dU + SelectStations[iii, 3]
-                    dxU = dxU + SelectStations[iii, 1] * SelectStations[iii, 3]
-                    dyU = dyU + SelectStations[iii, 2] * SelectStations[iii, 3]
-                    dV = dV + SelectStations[iii, 4]
-                    dxV = dxV + SelectStations[iii, 1] * SelectStations[iii, 4]
-                    dyV = dyV + SelectStations[iii, 2] * SelectStations[iii, 4]
-            G = [[ns, Px, Py], [Px, Px2, Pxy], [Py, Pxy, Py2]]
-            if np.sum(G) == ns:
-                Uxx[j, i], Uyy[j, i], Uxy[j, i], Uyx[j, i] = 0, 0, 0, 0
-            else:
-                dx = np.array([[dU], [dxU], [dyU]])
-                dy = np.array([[dV], [dxV], [dyV]])
-                modelx = np.dot(np.linalg.inv(G), dx)
-                modely = np.dot(np.linalg.inv(G), dy)
-                Uxx[j, i] = modelx[1][0]
-                Uyy[j, i] = modely[2][0]
-                Uxy[j, i] = modelx[2][0]
-                Uyx[j, i] = modely[1][0]
-
-                Ve[j, i] = 1000 * (modelx[0][0] + modelx[1][0]*SelectStations[0, 1] + modelx[2][0]*SelectStations[0, 2])  # mm
-                Vn[j, i] = 1000 * (modely[0][0] + modely[1][0]*SelectStations[0, 1] + modely[2][0]*SelectStations[0, 2])  # mm
-
-            # skipping misfit right now
-            # misfit estimation   d = m1 + m2 x + m3 y
-
-            # 3. Moving on to strain calculation
-            sxx = Uxx[j, i]
-            syy = Uyy[j, i]
-            sxy = .5 * (Uxy[j, i] + Uyx[j, i])
-            omega = .5 * (Uxy[j, i] - Uyx[j, i])
-            exx[j, i] = sxx * 1e9
-            exy[j, i] = sxy * 1e9
-            eyy[j, i] = syy * 1e9
-            rot[j, i] = omega * 1e9
+    # 2. Find the neighborhood of every grid node at once, as a ragged (CSR-style) batch
+    gridX_loc, gridY_loc = convert_to_local_planar(*np.meshgrid(xlons, ylats), reflon, reflat)
+    grid_points = np.column_stack((gridX_loc.ravel(), gridY_loc.ravel()))
+    tree = cKDTree(np.column_stack((elon, nlat)))
+    if neighborhood == 'radius':
+        nodes, indptr, stations, distances = find_stations_in_radius(tree, grid_points, EstimateRadius, ns)
+    else:
+        nodes, indptr, stations, distances = find_nearest_stations(tree, grid_points, EstimateRadius, ns)
+
+    # 3. Fit a plane d = m1 + m2 x + m3 y to each node's velocities: normal equations for all nodes, one solve
+    if weighting == 'inverse_distance':
+        weights = np.repeat(1 / np.maximum(distances, 1000.0), 2).reshape(-1, 2)
+    elif weighting == 'uncertainty':
+        weights = np.column_stack((1 / np.square(esig[stations]), 1 / np.square(nsig[stations])))
+    else:
+        weights = np.ones((len(stations), 2))
+    nodes, model = fit_local_planes(indptr, stations, elon, nlat, e, n, weights, nodes)
+
+    Uxx = np.zeros(gx * gy, dtype=dtype)
+    Uyy = np.zeros(gx * gy, dtype=dtype)
+    Uxy = np.zeros(gx * gy, dtype=dtype)
+    Uyx = np.zeros(gx * gy, dtype=dtype)
+    Ve = np.zeros(gx * gy, dtype=dtype)
+    Vn = np.zeros(gx * gy, dtype=dtype)
+    Uxx[nodes] = model[:, 0, 1]
+    Uyy[nodes] = model[:, 1, 2]
+    Uxy[nodes] = model[:, 0, 2]
+    Uyx[nodes] = model[:, 1, 1]
+    Ve[nodes] = 1000 * model[:, 0, 0]  # mm
+    Vn[nodes] = 1000 * model[:, 1, 0]  # mm
+
+    # skipping misfit right now
+    # misfit estimation   d = m1 + m2 x + m3 y
+
+    # 4. Moving on to strain calculation
+    sxx = Uxx.reshape((gy, gx))
+    syy = Uyy.reshape((gy, gx))
+    sxy = .5 * (Uxy + Uyx).reshape((gy, gx))
+    omega = .5 * (Uxy - Uyx).reshape((gy, gx))
+    exx = sxx * 1e9
+    exy = sxy * 1e9
+    eyy = syy * 1e9
+    rot = omega * 1e9
+    Ve, Vn = Ve.reshape((gy, gx)), Vn.reshape((gy, gx))
 
     print("Success computing strain via loc_avg_grad method.\n")
 
     return [Ve, Vn, rot, exx, exy, eyy]
 
 
+def find_nearest_stations(tree, grid_points, radius, ns):
+    """
+    The ns nearest stations of each grid node, keeping only nodes whose ns-th station is within the radius.
+
+    :param tree: cKDTree of station coordinates
+    :param grid_points: 2d array (Q, 2) of grid node coordinates
+    :param radius: float, same units as the coordinates
+    :param ns: int
+    :returns: nodes (flat indices of the kept grid nodes), indptr, stations, distances. Row k of the batch is
+        stations[indptr[k]:indptr[k+1]], nearest first.
+    """
+    distances, neighbors = tree.query(grid_points, k=ns, distance_upper_bound=np.nextafter(radius, np.inf))
+    distances, neighbors = np.reshape(distances, (-1, ns)), np.reshape(neighbors, (-1, ns))
+    selected = np.isfinite(distances[:, ns-1])  # SelectStations[ns-1, 0] <= EstimateRadius
+    nodes = np.flatnonzero(selected)
+    indptr = np.arange(len(nodes) + 1) * ns
+    return nodes, indptr, neighbors[selected].ravel(), distances[selected].ravel()
+
+
+def find_stations_in_radius(tree, grid_points, radius, min_stations):
+    """
+    All stations within the radius of each grid node, keeping only nodes with at least min_stations.
+
+    :param tree: cKDTree of station coordinates
+    :param grid_points: 2d array (Q, 2) of grid node coordinates
+    :param radius: float, same units as the coordinates
+    :param min_stations: int
+    :returns: nodes, indptr, stations, distances, in the same ragged layout as find_nearest_stations
+    """
+    pairs = cKDTree(grid_points).sparse_distance_matrix(tree, radius, output_type='ndarray')
+    order = np.lexsort((pairs['v'], pairs['i']))  # by grid node, then by distance
+    node_of_pair, stations, distances = pairs['i'][order], pairs['j'][order], pairs['v'][order]
+    counts = np.bincount(node_of_pair, minlength=len(grid_points))
+    keep = counts[node_of_pair] >= min_stations
+    nodes = np.flatnonzero(counts >= min_stations)
+    indptr = np.concatenate(([0], np.cumsum(counts[nodes])))
+    return nodes, indptr, stations[keep], distances[keep]
+
+
+def fit_local_planes(indptr, stations, x, y, e, n, weights, nodes):
+    """
+    Weighted least-squares planes through the velocities of each neighborhood in a ragged batch.
+    Coordinates are taken relative to each neighborhood's first (nearest) station, where velocities are evaluated.
+    The 3x3 normal equations of all neighborhoods are accumulated with one segmented sum and solved together.
+
+    :param indptr: 1d array, row k of the batch is stations[indptr[k]:indptr[k+1]]
+    :param stations: 1d array of station indices
+    :param x: 1d array of station x-coordinates
+    :param y: 1d array of station y-coordinates
+    :param e: 1d array of east velocities
+    :param n: 1d array of north velocities
+    :param weights: 2d array (len(stations), 2), weight of each station for the east and north fits
+    :param nodes: 1d array, the grid node of each row
+    :returns: nodes with a well-posed fit, and their models, 3d array (nodes, [east, north], [m1, m2, m3])
+    """
+    # reduceat would return the first element of the next row for an empty row, so empty rows are left out
+    counts = np.diff(indptr)
+    nonempty = counts > 0
+    if not np.any(nonempty):
+        return nodes[:0], np.zeros((0, 2, 3))
+    starts = indptr[:-1][nonempty]
+    nearest = np.repeat(stations[starts], counts[nonempty])
+    X = x[stations] - x[nearest]  # in local coordinates, m
+    Y = y[stations] - y[nearest]
+    A = np.column_stack((np.ones(np.shape(X)), X, Y))  # pairs x 3
+    obs_vel = np.column_stack((e[stations], n[stations]))  # pairs x 2
+    G = np.add.reduceat(np.einsum('pc,pi,pj->pcij', weights, A, A), starts, axis=0)  # nodes x 2 x 3 x 3
+    rhs = np.add.reduceat(np.einsum('pc,pi,pc->pci', weights, A, obs_vel), starts, axis=0)  # nodes x 2 x 3
+    nodes = nodes[nonempty]
+
+    # Degenerate nodes (e.g., collinear stations) are left out
+    well_posed = np.abs(np.linalg.det(G)) > 100 * np.finfo(float).eps * G[..., 0, 0] * G[..., 1, 1] * G[..., 2, 2]
+    well_posed = np.all(well_posed, axis=1)
+    model = np.linalg.solve(G[well_posed], rhs[well_posed][..., None])[..., 0]
+    return nodes[well_posed], model
+
+
 def velfield_to_LAG_non_utm(myVelfield):
-    elon, nlat = [], []
-    e, n, esig, nsig = [], [], [], []
-    elon_all = [item.elon for item in myVelfield]
-    nlat_all = [item.nlat for item in myVelfield]
-    reflon = np.min(elon_all)
-    reflat = np.min(nlat_all)
-    for item in myVelfield:
-        [x_meters, y_meters] = convert_to_local_planar(item.elon, item.nlat, reflon, reflat)
-        elon.append(x_meters)
-        nlat.append(y_meters)
-        e.append(item.e*0.001)
-        n.append(item.n*0.001)
-        esig.append(item.se*0.001)
-        nsig.append(item.sn*0.001)
-    return [np.array(elon), np.array(nlat), np.array(e), np.array(n), np.array(esig), np.array(nsig)]
+    myVelfield = velocity_io.as_velocity_field(myVelfield)
+    reflon = np.min(myVelfield.elon)
+    reflat = np.min(myVelfield.nlat)
+    [elon, nlat] = convert_to_local_planar(myVelfield.elon, myVelfield.nlat, reflon, reflat)
+    e, n = myVelfield.e*0.001, myVelfield.n*0.001
+    esig, nsig = myVelfield.se*0.001, myVelfield.sn*0.001
+    return [elon, nlat, e, n, esig, nsig]
 
 
 def convert_to_local_planar(lon, lat, reflon, reflat):
@@ -45,6 +45,7 @@ class simple_visr(Strain_2d):
         super().__init__(params.inc, params.range_strain, params.range_data,
                          params.xdata, params.ydata, params.outdir)
         self._Name = "simple_visr"
+        self._dtype = params.precision
         # read required method-specific parameters
         # can fail if key is missing or cannot be cast to correct data type
         self.weighting_threshold = float(params.method_specific["weighting_threshold"])
@@ -173,7 +174,8 @@ class simple_visr(Strain_2d):
                                  utmzone: int,
                                  distance_method: Literal["gaussian", "quadratic"],
                                  coverage_method: Literal["azimuth", "voronoi"],
-                                 estimate_within: float | None
+                                 estimate_within: float | None,
+                                 dtype: np.dtype = np.float64
                                  ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
         r"""
         For a set of horizontal velocities on a 2D cartesian grid, estimate the
@@ -214,6 +216,8 @@ class simple_visr(Strain_2d):
         estimate_within
             If set, only estimate the values at target points that are this distance [m]
             away from the convex hull of all stations.
+        dtype
+            Precision of the outputs. The local least-squares fits are always in float64.
 
         Returns
         -------
@@ -329,9 +333,9 @@ class simple_visr(Strain_2d):
         G = simple_visr._get_vel_strain_rot_mapping(num_stations=num_stations)
 
         # create empty field output
-        v = np.full((num_field, 2), np.nan)
-        epsilon = np.full((num_field, 2, 2), np.nan)
-        omega = np.full((num_field, 2, 2), np.nan)
+        v = np.full((num_field, 2), np.nan, dtype=dtype)
+        epsilon = np.full((num_field, 2, 2), np.nan, dtype=dtype)
+        omega = np.full((num_field, 2, 2), np.nan, dtype=dtype)
 
         # start loop
         for i_field_sub, i_field in enumerate(ix_field_inside):
@@ -380,7 +384,7 @@ class simple_visr(Strain_2d):
         print("Running computation...", flush=True, end="")
         v, epsilon, omega = simple_visr.get_field_vel_strain_rot(
             locations, velocities, field, self.weighting_threshold, uncertainties,
-            self.utmzone, self.distance_method, self.coverage_method, self.estimate_within)
+            self.utmzone, self.distance_method, self.coverage_method, self.estimate_within, self._dtype)
         print(" done")
         print("Formatting outputs...", flush=True, end="")
         # reformat velocity field
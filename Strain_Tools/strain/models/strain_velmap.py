@@ -17,6 +17,7 @@ class velmap(Strain_2d):
         self._Name = 'velmap'
         self._tempdir = params.outdir;
         self._smoothing_constant = verify_inputs_velmap(params.method_specific);
+        self._dtype = params.precision
 
     def compute(self, myVelfield):
         [Ve, Vn, rot_grd, exx_grd, exy_grd, eyy_grd] = compute_velmap(myVelfield, self, self._smoothing_constant);
@@ -104,8 +105,8 @@ def compute_velmap(myVelfield, self, smoothing_constant):
     Ve_pred = vhat[:Nc]
     Vn_pred = vhat[Nc:2*Nc]  
 
-    Ve = Ve_pred.reshape(ncols, nrows)
-    Vn = Vn_pred.reshape(ncols, nrows)
+    Ve = Ve_pred.reshape(ncols, nrows).astype(self._dtype, copy=False)
+    Vn = Vn_pred.reshape(ncols, nrows).astype(self._dtype, copy=False)
 
     # Calculate strain rate
     dx, dy = self._grid_inc[0] * 111 * np.cos(np.deg2rad(self._strain_range[2])), self._grid_inc[1] * 111
@@ -25,13 +25,15 @@ class visr(Strain_2d):
         self._tempdir = params.outdir
         self._distwgt, self._spatwgt, self._smoothincs, self._wgt, self._unc_thresh, \
         self._num_creep_faults, self._creep_file, self._exec = verify_inputs_visr(params.method_specific)
+        self._dtype = params.precision
 
     def compute(self, myVelfield):
         [Ve, Vn, rot_grd, exx_grd, exy_grd, eyy_grd] = compute_visr(myVelfield, self._strain_range, self._grid_inc,
                                                                     self._xdata, self._ydata,
                                                                     self._distwgt, self._spatwgt, self._smoothincs,
                                                                     self._wgt, self._unc_thresh, self._num_creep_faults,
-                                                                    self._creep_file, self._exec, self._tempdir)
+                                                                    self._creep_file, self._exec, self._tempdir,
+                                                                    self._dtype)
         # Report observed and residual velocities within bounding box
         velfield_within_box = utilities.filter_by_bounding_box(myVelfield, self._strain_range)
         model_velfield = utilities.create_model_velfield(self._xdata, self._ydata, Ve, Vn, velfield_within_box)
@@ -68,7 +70,7 @@ def verify_inputs_visr(method_specific_dict):
 
 
 def compute_visr(myVelfield, strain_range, inc, xdata, ydata, distwgt, spatwgt, smoothincs, wgt, unc_thresh,
-                 num_creep_faults, creep_file, executable, tempdir):
+                 num_creep_faults, creep_file, executable, tempdir, dtype=np.float64):
     print("------------------------------\nComputing strain via Visr method.")
     strain_config_file = 'visr_strain.drv'
     strain_data_file = 'strain_input.txt'  # can only be 20 characters long bc fortran!
@@ -80,7 +82,7 @@ def compute_visr(myVelfield, strain_range, inc, xdata, ydata, distwgt, spatwgt,
     call_fortran_compute(strain_config_file, executable)
 
     # We convert that text file into grids, which we will write as GMT grd files.
-    [Ve, Vn, rot, exx, exy, eyy] = make_output_grids_from_strain_out(strain_output_file, xdata, ydata)
+    [Ve, Vn, rot, exx, exy, eyy] = make_output_grids_from_strain_out(strain_output_file, xdata, ydata, dtype)
     shutil.move(src=strain_config_file, dst=os.path.join(tempdir, strain_config_file))
     shutil.move(src=strain_data_file, dst=os.path.join(tempdir, strain_data_file))
     shutil.move(src=strain_output_file, dst=os.path.join(tempdir, strain_output_file))
@@ -166,7 +168,7 @@ def call_fortran_compute(config_file, executable):
     return
 
 
-def make_output_grids_from_strain_out(infile, xdata, ydata):
+def make_output_grids_from_strain_out(infile, xdata, ydata, dtype=np.float64):
     x, y, Ve, Vn, rotation, exx, exy, eyy = [], [], [], [], [], [], [], []
     ifile = open(infile, 'r')
     for line in ifile:
@@ -198,8 +200,8 @@ def make_output_grids_from_strain_out(infile, xdata, ydata):
 
     # Loop through x and y lists, find the index of coordinates in xaxis and yaxis sets, place them into 2d arrays.
     grdshape = (len(ydata), len(xdata))
-    Ve_grd, Vn_grd = np.zeros(grdshape), np.zeros(grdshape)
-    rot_grd, exx_grd, exy_grd, eyy_grd = np.zeros(grdshape), np.zeros(grdshape), np.zeros(grdshape), np.zeros(grdshape)
+    Ve_grd, Vn_grd = np.zeros(grdshape, dtype=dtype), np.zeros(grdshape, dtype=dtype)
+    rot_grd, exx_grd, exy_grd, eyy_grd = [np.zeros(grdshape, dtype=dtype) for _ in range(4)]
     lons = np.round(xdata, 6)
     lats = np.round(ydata, 6)
     x = np.round(x, 6)
@@ -12,6 +12,7 @@ class wavelets(Strain_2d):
                            params.outdir)
         self._Name = 'wavelets'
         self._code_dir, self._qmin, self._qmax, self._qsec = verify_inputs_wavelets(params.method_specific)
+        self._dtype = params.precision
 
     def compute(self, myVelfield):
         # Setup for Matlab calculation
@@ -29,13 +30,13 @@ class wavelets(Strain_2d):
         # Parse the results
         x, y, tt, tp, pp, rot = input_wavelets(output_tag + "_strain.dat", output_tag + "_Dtensor_6entries.dat", output_tag + "_Wtensor_3entries.dat")
         exx, exy, eyy, rot = compute_wavelets(tt, tp, pp, rot)
-        _, _, exx = nn_interp(x, y, exx, self._xdata, self._ydata)
-        _, _, exy = nn_interp(x, y, exy, self._xdata, self._ydata)
-        _, _, eyy = nn_interp(x, y, eyy, self._xdata, self._ydata)
-        _, _, rot = nn_interp(x, y, rot, self._xdata, self._ydata)
+        _, _, exx = nn_interp(x, y, exx, self._xdata, self._ydata, self._dtype)
+        _, _, exy = nn_interp(x, y, exy, self._xdata, self._ydata, self._dtype)
+        _, _, eyy = nn_interp(x, y, eyy, self._xdata, self._ydata, self._dtype)
+        _, _, rot = nn_interp(x, y, rot, self._xdata, self._ydata, self._dtype)
 
         # Not sure whether Wavelets gives velocities or not
-        Ve, Vn = np.nan*np.empty(exx.shape), np.nan*np.empty(exx.shape),
+        Ve, Vn = np.full(exx.shape, np.nan, dtype=self._dtype), np.full(exx.shape, np.nan, dtype=self._dtype)
 
         # Get residuals
         resid_file = output_tag + "_vfield_residual.dat"
@@ -150,7 +151,7 @@ def compute_wavelets(thth, thph, phph, rot_sph):
     return exx, exy, eyy, rot
 
 
-def nn_interp(x, y, vals, newx, newy):
+def nn_interp(x, y, vals, newx, newy, dtype=np.float64):
     """
     Performs scipy nearest-neighbor interpolation on the data to a new regular grid of (newx, newy)
     newx, newy are both 1D arrays.
@@ -169,7 +170,7 @@ def nn_interp(x, y, vals, newx, newy):
     for i in np.arange(0, len(tempvals), len(newy)):
         newvals.append(tempvals[i:i+len(newy)])
 
-    newvals = np.transpose(newvals)
+    newvals = np.transpose(np.array(newvals, dtype=dtype))
 
     return newx, newy, newvals
 
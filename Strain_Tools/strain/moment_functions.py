@@ -4,7 +4,7 @@ import argparse
 import sys
 import os
 import numpy as np
-from . import strain_tensor_toolbox, utilities
+from . import compiled_kernels, strain_tensor_toolbox, utilities
 
 help_message = "Compute moment accumulation rate via method of Savage and Simpson (1997) "
 
@@ -31,6 +31,8 @@ def cmd_parser(cmdargs):
                    help='''controls verbosity [default 0]''')
     p.add_argument('--use_landmask', type=bool, default=1,
                    help='''whether or not to apply landmask [0 or 1; default 1]''')
+    p.add_argument('--backend', type=str, default='',
+                   help='''numpy or numba [default: environment variable STRAIN_2D_BACKEND, or numpy]''')
     config_default = {}
     p.set_defaults(**config_default)
     config = vars(p.parse_args())
@@ -44,6 +46,7 @@ def moment_coordinator(MyParams):
 
     :param MyParams: a dictionary
     """
+    compiled_kernels.set_backend(MyParams.get("backend", ""))
     # Input, Compute, Output
     lons, lats, exx, exy, eyy = utilities.read_basic_fields_from_netcdf(MyParams["netcdf"])
     landmask = np.ones(np.shape(exx))
@@ -58,32 +61,34 @@ def get_savage_simpson_moment(exx, exy, eyy, mu_GPa, depth_km, area_km2):
     """
     Minimum moment accumulation rate associated with a surface strain rate tensor.
     as per Savage and Simpson 1997, Equation 22
-    exx, exy, eyy assumed in units of nanostrain
+    exx, exy, eyy assumed in units of nanostrain, as floats or arrays
     With strain in nanostrain and mu in GPa, we don't need to multiply and then divide by 1e9
     """
-    [e1, e2, _] = strain_tensor_toolbox.eigenvector_eigenvalue(exx, exy, eyy)
+    [e1, e2, _, _, _, _] = strain_tensor_toolbox.compute_eigenvectors(exx, exy, eyy)
     depth_m = depth_km * 1000
     area_m2 = area_km2 * 1e6
-    M0_min = 2 * mu_GPa * depth_m * area_m2 * np.max([np.abs(e1), np.abs(e2), np.abs(e1+e2)])
+    M0_min = 2 * mu_GPa * depth_m * area_m2 * np.maximum(np.maximum(np.abs(e1), np.abs(e2)), np.abs(e1+e2))
     return M0_min
 
 
 def compute_moments_loop(lons, lats, exx, exy, eyy, landmask, mu, depth):
     print("Computing total moment rate of strain rate field from Savage and Simpson (1997).")
-    Mo = 0
     xinc_km = (lons[1] - lons[0]) * (111.000*np.cos(np.deg2rad(lats[0])))
     yinc_km = (lats[1] - lats[0]) * 111.000
     area_km2 = xinc_km * yinc_km
     exx = np.multiply(exx, landmask)
     exy = np.multiply(exy, landmask)
     eyy = np.multiply(eyy, landmask)
-    moment_map = np.zeros(np.shape(exx))
-    for i in range(len(lats)):
-        for j in range(len(lons)):
-            if landmask[i][j] > 0:
-                incremental_moment = get_savage_simpson_moment(exx[i][j], exy[i][j], eyy[i][j], mu, depth, area_km2)
-                Mo = Mo + incremental_moment
-                moment_map[i][j] = incremental_moment
+    if compiled_kernels.use_numba():
+        moment_map = np.empty(np.shape(exx))
+        factor = 2 * mu * (depth * 1000) * (area_km2 * 1e6)
+        compiled_kernels.savage_simpson_moments(np.ravel(exx), np.ravel(exy), np.ravel(eyy),
+                                                np.ravel(np.asarray(landmask, dtype=np.float64)), factor,
+                                                moment_map.reshape(-1))
+    else:
+        moment_map = np.where(np.asarray(landmask) > 0,
+                              get_savage_simpson_moment(exx, exy, eyy, mu, depth, area_km2), 0.0)
+    Mo = np.sum(moment_map)
     return Mo, moment_map
 
 
@@ -20,8 +20,8 @@ def outputs_2d(Ve, Vn, rot, exx, exy, eyy, MyParams, myVelfield, residfield):
         raise ValueError("Error! Velocity field and residual field have different lengths "
                          "("+str(len(myVelfield))+" vs "+str(len(residfield))+").")
 
-    [I2nd, max_shear, dilatation, azimuth] = strain_tensor_toolbox.compute_derived_quantities(exx, exy, eyy)
-    [e1, e2, v00, v01, v10, v11] = strain_tensor_toolbox.compute_eigenvectors(exx, exy, eyy)
+    [I2nd, max_shear, dilatation, azimuth, e1, e2, v00, v01, v10,
+     v11] = strain_tensor_toolbox.compute_strain_products(exx, exy, eyy)
 
     # get grid eigenvectors for plotting
     [positive_eigs, negative_eigs] = get_grid_eigenvectors(MyParams.xdata, MyParams.ydata, e1, e2, v00, v01, v10, v11)
@@ -50,7 +50,7 @@ def outputs_2d(Ve, Vn, rot, exx, exy, eyy, MyParams, myVelfield, residfield):
 
     output_filename = os.path.join(MyParams.outdir, '{}_strain.nc'.format(MyParams.strain_method))
     print("Writing file %s " % output_filename)
-    ds.to_netcdf(output_filename)
+    ds.to_netcdf(output_filename, encoding={name: {'dtype': MyParams.precision} for name in ds.data_vars})
 
     print("Max I2: %f " % (np.nanmax(I2nd)))
     print("Min/Max rot:   %f,   %f " % (np.nanmin(rot), np.nanmax(rot)))
@@ -86,8 +86,8 @@ def outputs_2d(Ve, Vn, rot, exx, exy, eyy, MyParams, myVelfield, residfield):
 def outputs_1d(xcentroid, ycentroid, polygon_vertices, rot, exx, exy, eyy, range_strain, myVelfield, outdir):
     print("------------------------------\nWriting 1d outputs:")
     exx, exy, eyy = np.array(exx), np.array(exy), np.array(eyy)
-    [I2nd, max_shear, dilatation, azimuth] = strain_tensor_toolbox.compute_derived_quantities(exx, exy, eyy)
-    [e1, e2, v00, v01, v10, v11] = strain_tensor_toolbox.compute_eigenvectors(exx, exy, eyy)
+    [I2nd, max_shear, dilatation, azimuth, e1, e2, v00, v01, v10,
+     v11] = strain_tensor_toolbox.compute_strain_products(exx, exy, eyy)
     [positive_eigs, negative_eigs] = get_list_eigenvectors(xcentroid, ycentroid, e1, e2, v00, v01, v10, v11)
     I2nd = np.log10(np.abs(I2nd))  # for convenient plotting
 
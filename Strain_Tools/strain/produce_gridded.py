@@ -1,12 +1,13 @@
 # Convert triangulation polygon values into gridded netcdf
 
 import numpy as np
-import matplotlib.path
+import matplotlib.tri
 
 
-def tri2grid(lons, lats, triangle_vertices, rot, exx, exy, eyy):
+def tri2grid(lons, lats, triangle_vertices, rot, exx, exy, eyy, *other_values, tri=None, index_map=None, dtype=float):
     """
-    Bring delaunay 1-D quantities into the same 2-D form as the other methods
+    Bring delaunay 1-D quantities into the same 2-D form as the other methods.
+    The gridpoints are located in the triangles once, and every quantity is gathered through the same index map.
 
     :param lons: list
     :param lats: list
@@ -15,19 +16,19 @@ def tri2grid(lons, lats, triangle_vertices, rot, exx, exy, eyy):
     :param exx: 1D array
     :param exy: 1D array
     :param eyy: 1D array
+    :param other_values: any number of additional 1D arrays (e.g., uncertainties), also gridded
+    :param tri: optional scipy.spatial.Delaunay object that produced triangle_vertices
+    :param index_map: optional precomputed result of locate_in_triangles, which skips the point location
+    :param dtype: floating-point type of the grids, e.g., np.float32 to halve their memory
+    :returns: rot_grd, exx_grd, exy_grd, eyy_grd, followed by one grid for each of other_values
     """
-    print("Producing gridded dataset of: Exx")
-    exx_grd = find_in_triangles(triangle_vertices, exx, lons, lats)
-    print("Producing gridded dataset of: Exy")
-    exy_grd = find_in_triangles(triangle_vertices, exy, lons, lats)
-    print("Producing gridded dataset of: Eyy")
-    eyy_grd = find_in_triangles(triangle_vertices, eyy, lons, lats)
-    print("Producing gridded dataset of: Rot")
-    rot_grd = find_in_triangles(triangle_vertices, rot, lons, lats)
-    return rot_grd, exx_grd, exy_grd, eyy_grd
+    print("Producing gridded dataset of: Exx, Exy, Eyy, Rot")
+    if index_map is None:
+        index_map = locate_in_triangles(triangle_vertices, lons, lats, tri=tri)
+    return values_to_grid(index_map, rot, exx, exy, eyy, *other_values, dtype=dtype)
 
 
-def find_in_triangles(triangles, values, lons, lats):
+def find_in_triangles(triangles, values, lons, lats, tri=None):
     """
     search triangle vertices for each gridpoint, then assigns that triangle's value to gridpoint
 
@@ -35,25 +36,45 @@ def find_in_triangles(triangles, values, lons, lats):
     :param values: list
     :param lons: list
     :param lats: list
+    :param tri: optional scipy.spatial.Delaunay object that produced the triangles
     """
-    val_arr = np.nan*np.ones((len(lats), len(lons)))
-
-    for i, triangle in enumerate(triangles):
-        tri_lons = [triangle[0][0], triangle[1][0], triangle[2][0]]
-        tri_lats = [triangle[0][1], triangle[1][1], triangle[2][1]]
-        above_min_lon = np.where(lons >= np.min(tri_lons))[0]
-        below_max_lon = np.where(lons <= np.max(tri_lons))[0]
-        fitting_lon = list(set(above_min_lon) & set(below_max_lon))
-        above_min_lat = np.where(lats >= np.min(tri_lats))[0]
-        below_max_lat = np.where(lats <= np.max(tri_lats))[0]
-        fitting_lat = list(set(above_min_lat) & set(below_max_lat))
-
-        tripath = matplotlib.path.Path(triangle)
-        for j in range(len(fitting_lat)):
-            for k in range(len(fitting_lon)):
-                if tripath.contains_point((lons[fitting_lon[k]], lats[fitting_lat[j]])):
-                    x_idx = np.where(lons == lons[fitting_lon[k]])[0]
-                    y_idx = np.where(lats == lats[fitting_lat[j]])[0]
-                    val_arr[y_idx[0]][x_idx[0]] = values[i]
-
-    return val_arr
+    index_map = locate_in_triangles(triangles, lons, lats, tri=tri)
+    return values_to_grid(index_map, values)[0]
+
+
+def locate_in_triangles(triangle_vertices, lons, lats, tri=None):
+    """
+    Find the triangle that contains each gridpoint, for all gridpoints in one vectorized pass.
+
+    :param triangle_vertices: array of shape (n_triangles, 3, 2) with the lon/lat of each triangle's corners
+    :param lons: 1D array
+    :param lats: 1D array
+    :param tri: optional scipy.spatial.Delaunay object whose simplices produced triangle_vertices.
+        If given, its point-location is used directly. Otherwise, a trapezoid map is built on the triangles.
+    :returns: 2D integer array of shape (len(lats), len(lons)), index of the containing triangle, -1 outside all triangles
+    """
+    xgrid, ygrid = np.meshgrid(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+    if tri is not None:
+        points = np.column_stack((xgrid.ravel(), ygrid.ravel()))
+        return tri.find_simplex(points).reshape(xgrid.shape)
+    triangle_vertices = np.asarray(triangle_vertices, dtype=float)
+    if len(triangle_vertices) == 0:
+        return -np.ones(xgrid.shape, dtype=int)
+    vertices, corners = np.unique(triangle_vertices.reshape(-1, 2), axis=0, return_inverse=True)
+    triangulation = matplotlib.tri.Triangulation(vertices[:, 0], vertices[:, 1], corners.reshape(-1, 3))
+    return np.asarray(triangulation.get_trifinder()(xgrid, ygrid), dtype=int)
+
+
+def values_to_grid(index_map, *values, dtype=float):
+    """
+    Gather any number of per-triangle quantities onto the grid in one fancy-indexing pass,
+    using an index map from locate_in_triangles.
+
+    :param index_map: 2D integer array, -1 for gridpoints outside all triangles
+    :param values: one or more 1D arrays, one value per triangle
+    :param dtype: floating-point type of the grids
+    :returns: list of 2D arrays, NaN outside all triangles
+    """
+    stacked = np.array(values, dtype=dtype, ndmin=2)
+    stacked = np.hstack((stacked, np.full((len(stacked), 1), np.nan, dtype=dtype)))  # index -1 picks up the NaN column
+    return list(stacked[:, index_map])
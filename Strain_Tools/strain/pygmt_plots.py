@@ -1,6 +1,7 @@
 import pygmt
 import numpy as np
 import os
+from . import velocity_io
 
 
 def get_map_scale(region):
@@ -17,14 +18,9 @@ def get_map_scale(region):
 
 
 def station_vels_to_arrays(vectors):
-    """ Unpack a list of station_vels vectors into arrays for pygmt plotting """
-    elon, nlat, e, n = [], [], [], []
-    for item in vectors:
-        elon.append(item.elon)
-        nlat.append(item.nlat)
-        e.append(item.e)
-        n.append(item.n)
-    return np.array(elon), np.array(nlat), np.array(e), np.array(n)
+    """ Unpack a VelocityField or a list of station_vels vectors into arrays for pygmt plotting """
+    vectors = velocity_io.as_velocity_field(vectors)
+    return vectors.elon, vectors.nlat, vectors.e, vectors.n
 
 
 def filter_vectors_to_land_only(region, elon, nlat, e, n):
@@ -4,6 +4,7 @@
 
 import numpy as np
 import math as m
+from . import compiled_kernels
 
 
 def strain_on_regular_grid(dx, dy, V1, V2):
@@ -32,16 +33,17 @@ def compute_strain_components_from_dx(dudx, dvdx, dudy, dvdy):
     Given a displacement tensor, compute the relevant parts of the strain and rotation tensors.
     Rot is the off-diagonal element of the rotation tensor
     Rot has native units radians/year. Here we return radians per 1000 yrs (easier to interpret numbers)
+    Works elementwise, so arrays of gradients (e.g., one per triangle) give arrays of components.
     http://www.engr.colostate.edu/~thompson/hPage/CourseMat/Tutorials/Solid_Mechanics/rotations.pdf
 
     :param dudx: displacement gradient
-    :type dudx: float
+    :type dudx: float or array
     :param dvdx: displacement gradient
-    :type dvdx: float
+    :type dvdx: float or array
     :param dudy: displacement gradient
-    :type dudy: float
+    :type dudy: float or array
     :param dvdy: displacement gradient
-    :type dvdy: float
+    :type dvdy: float or array
     :returns: strain and rotation components
     :rtype: list
     """
@@ -63,27 +65,12 @@ def compute_derived_quantities(exx, exy, eyy):
     :param eyy: strain component, float or 1d array or 2d array
     :rtype: list
     """
-    # Since exx etc. are numpy arrays, we can use numpy's vectorized math
-    max_shear = 0.5 * np.sqrt(np.square(exx - eyy) + 4*np.square(exy))
-    I2nd = 0.5 * (exx*eyy - np.square(exy))
-    dilatation = exx + eyy
-
-    # Azimuth is tricky so leaving it as a for-loop for now
-    azimuth = np.zeros(np.shape(exx))
-    [e1, e2, v00, v01, v10, v11] = compute_eigenvectors(exx, exy, eyy)
-
     dshape = np.shape(exx)
     if len(dshape) == 1:
-        datalength = dshape[0]
-        print("Computing strain invariants for 1d dataset with length %d." % datalength)
-        for i in range(datalength):
-            azimuth[i] = compute_max_shortening_azimuth(e1[i], e2[i], v00[i], v01[i], v10[i], v11[i])
+        print("Computing strain invariants for 1d dataset with length %d." % dshape[0])
     elif len(dshape) == 2:
         print("Computing strain invariants for 2d dataset.")
-        for j in range(dshape[0]):
-            for i in range(dshape[1]):
-                azimuth[j][i] = compute_max_shortening_azimuth(e1[j][i], e2[j][i], v00[j][i], v01[j][i],
-                                                               v10[j][i], v11[j][i])
+    [I2nd, max_shear, dilatation, azimuth, _, _, _, _, _, _] = compute_strain_products(exx, exy, eyy)
     return [I2nd, max_shear, dilatation, azimuth]
 
 
@@ -96,26 +83,89 @@ def compute_eigenvectors(exx, exy, eyy):
     :param eyy: strain component, float or 1d array
     :rtype: list
     """
-    e1, e2 = np.zeros(np.shape(exx)), np.zeros(np.shape(exx))  # eigenvalues
-    v00, v01 = np.zeros(np.shape(exx)), np.zeros(np.shape(exx))
-    v10, v11 = np.zeros(np.shape(exx)), np.zeros(np.shape(exx))  # eigenvectors
-    dshape = np.shape(exx)
-    if len(dshape) == 1:
-        for i in range(len(exx)):
-            [e11, e22, v] = eigenvector_eigenvalue(exx[i], exy[i], eyy[i])
-            e1[i], e2[i] = e11, e22  # convention of this code returns negative eigenvalues compared to my other codes
-            v00[i], v10[i] = v[0][0], v[1][0]
-            v01[i], v11[i] = v[0][1], v[1][1]
-    elif len(dshape) == 2:
-        for j in range(dshape[0]):
-            for i in range(dshape[1]):
-                [e11, e22, v] = eigenvector_eigenvalue(exx[j][i], exy[j][i], eyy[j][i])
-                e1[j][i], e2[j][i] = e11, e22
-                v00[j][i], v01[j][i] = v[0][0], v[0][1]
-                v10[j][i], v11[j][i] = v[1][0], v[1][1]
+    [_, _, _, _, e1, e2, v00, v01, v10, v11] = compute_strain_products(exx, exy, eyy)
     return [e1, e2, v00, v01, v10, v11]
 
 
+def compute_strain_products(exx, exy, eyy, out=None):
+    """
+    Everything derived from the strain tensor components, in one call:
+    2nd invariant, max shear, dilatation, azimuth of maximum shortening, eigenvalues and eigenvectors.
+    The eigen-decomposition of the symmetric 2x2 tensor is in closed form. Its ordering and signs follow
+    np.linalg.eig (LAPACK's 2x2 Schur step), so it agrees with eigenvector_eigenvalue() to rounding.
+    Where a component is NaN, eigenvalues are 0 and eigenvectors and azimuth are NaN.
+    With the numba backend (see compiled_kernels), the same arithmetic runs element by element across cores,
+    in double precision.
+
+    :param exx: strain component, float or 1d array or 2d array
+    :param exy: strain component, float or 1d array or 2d array
+    :param eyy: strain component, float or 1d array or 2d array
+    :param out: optional list of 10 preallocated arrays with the shape of exx, to be filled in
+    :returns: [I2nd, max_shear, dilatation, azimuth, e1, e2, v00, v01, v10, v11]
+    :rtype: list
+    """
+    exx, exy, eyy = np.asarray(exx), np.asarray(exy), np.asarray(eyy)
+    dtype = np.result_type(exx, exy, eyy, np.float32)
+    if compiled_kernels.use_numba():
+        if out is None:
+            out = [np.empty(np.shape(exx), dtype=dtype) for _ in range(10)]
+        return compute_strain_products_numba(exx, exy, eyy, out)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        max_shear = np.sqrt((exx - eyy) * (exx - eyy) + exy * exy * 4) * 0.5
+        I2nd = (exx * eyy - exy * exy) * 0.5
+        dilatation = exx + eyy
+
+        # Eigenvalues: z = p + sign(p)*sqrt(p^2 + exy^2) with p = (exx-eyy)/2, scaled like LAPACK to avoid overflow
+        p = (exx - eyy) * 0.5
+        abs_exy = np.abs(exy)
+        scale = np.maximum(np.abs(p), abs_exy)
+        z = np.copysign(np.sqrt(scale) * np.sqrt(p / scale * p + abs_exy / scale * abs_exy), p) + p
+        e1 = eyy + z
+        e2 = eyy - abs_exy / z * abs_exy
+
+        # Eigenvectors: the Schur rotation (z, exy)/hypot(z, exy) and its orthogonal complement
+        h = np.hypot(exy, z)
+        v00 = z / h
+        v10 = exy / h
+        v01 = -v10
+        v11 = v00
+
+    # Already-diagonal tensors keep their order, with identity eigenvectors
+    diagonal = exy == 0
+    e1, e2 = np.where(diagonal, exx, e1), np.where(diagonal, eyy, e2)
+    v00, v01 = np.where(diagonal, 1, v00), np.where(diagonal, 0, v01)
+    v10, v11 = np.where(diagonal, 0, v10), np.where(diagonal, 1, v11)
+
+    undefined = np.isnan(exx) | np.isnan(exy) | np.isnan(eyy)
+    e1, e2 = np.where(undefined, 0, e1), np.where(undefined, 0, e2)
+    v00, v01 = np.where(undefined, np.nan, v00), np.where(undefined, np.nan, v01)
+    v10, v11 = np.where(undefined, np.nan, v10), np.where(undefined, np.nan, v11)
+
+    # Azimuth of the maximum shortening axis, in degrees CW from north, within [0, 180]
+    azimuth = 90 - np.degrees(np.where(e1 < e2, np.arctan2(v10, v00), np.arctan2(v11, v01)))
+    azimuth = np.where(azimuth < 0, azimuth + 180, azimuth)
+    azimuth = np.where(azimuth > 180, azimuth - 180, azimuth)
+
+    products = [I2nd, max_shear, dilatation, azimuth, e1, e2, v00, v01, v10, v11]
+    if out is None:
+        return [np.asarray(product, dtype=dtype) for product in products]
+    for array, product in zip(out, products):
+        np.copyto(array, product, casting='unsafe')
+    return out
+
+
+def compute_strain_products_numba(exx, exy, eyy, out):
+    """The compiled version of compute_strain_products, filling the list of 10 arrays in out."""
+    shape = np.broadcast_shapes(np.shape(exx), np.shape(exy), np.shape(eyy))
+    flat = [np.ascontiguousarray(np.broadcast_to(x, shape), dtype=np.float64).ravel() for x in (exx, exy, eyy)]
+    results = np.empty((10, flat[0].size))
+    compiled_kernels.strain_products(flat[0], flat[1], flat[2], results)
+    for array, result in zip(out, results):
+        np.copyto(array, result.reshape(shape), casting='unsafe')
+    return out
+
+
 def eigenvector_eigenvalue(exx, exy, eyy):
     """
     :param exx: strain component
@@ -170,29 +220,37 @@ def compute_max_shortening_azimuth(e1, e2, v00, v01, v10, v11):
 
 def angle_mean_math(azimuth_values):
     """
+    Circular mean of axial data (azimuths modulo 180 degrees). NaNs are ignored.
+    A 2d or 3d array is reduced along its last axis, giving a mean and standard deviation for each point.
+
     :param azimuth_values: azimuths in degrees
-    :type azimuth_values: list
+    :type azimuth_values: list or array
     :returns: an average azimuth and standard deviation of azimuths, in degrees
-    :rtype: float
+    :rtype: float, or arrays with the shape of azimuth_values minus its last axis
     """
-    sin_list, cos_list = [], []
-    for phi in azimuth_values:
-        sin_list.append(np.sin(2 * np.radians(90 - phi)))
-        cos_list.append(np.cos(2 * np.radians(90 - phi)))
-    s = np.nanmean(sin_list)
-    c = np.nanmean(cos_list)
-    R = ((s ** 2 + c ** 2) ** .5)
-    sd = np.degrees((-2 * np.log(R)) ** .5) / 2
-    # V = 1 - R
-    # sd = np.degrees((2*V)**.5)
-    # t = np.arctan2(s, c)
-    # strike = R*math.e**(math.i*t)
-    strike = np.arctan2(s, c) / 2
-    theta = 90 - np.degrees(strike)
-    if theta < 0:
-        theta = 180 + theta
-    elif theta > 180:
-        theta = theta - 180
+    azimuth_values = np.asarray(azimuth_values, dtype=np.float64)
+    if compiled_kernels.use_numba():
+        values = np.ascontiguousarray(azimuth_values.reshape(-1, np.shape(azimuth_values)[-1]))
+        theta, sd = np.empty(len(values)), np.empty(len(values))
+        compiled_kernels.angle_means(values, theta, sd)
+        theta, sd = theta.reshape(np.shape(azimuth_values)[:-1]), sd.reshape(np.shape(azimuth_values)[:-1])
+    else:
+        doubled = np.radians(90 - azimuth_values) * 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            count = np.sum(~np.isnan(doubled), axis=-1)
+            s = np.nansum(np.sin(doubled), axis=-1) / count
+            c = np.nansum(np.cos(doubled), axis=-1) / count
+            R = np.sqrt(s * s + c * c)
+            sd = np.degrees(np.sqrt(-2 * np.log(R))) / 2
+        # V = 1 - R
+        # sd = np.degrees((2*V)**.5)
+        # t = np.arctan2(s, c)
+        # strike = R*math.e**(math.i*t)
+        strike = np.arctan2(s, c) / 2
+        theta = 90 - np.degrees(strike)
+        theta = np.where(theta < 0, 180 + theta, np.where(theta > 180, theta - 180, theta))
+    if np.ndim(theta) == 0:
+        return theta[()], sd[()]
     return theta, sd
 
 
@@ -212,3 +270,30 @@ def calc_strain_uncertainty(VarE, VarN, grid_x, grid_y, exx, eyy, exy):
     var_max_shear = (d1 * var_dil + d2 * cvar1 + 4 * d3 * cvar2) / np.square(max_shear)
 
     return var_dil, var_max_shear
+
+
+def calc_strain_uncertainty_from_gradients(cov_e, cov_n, exx, eyy, exy):
+    """
+    Strain rate variance from the covariances of the velocity gradients (e.g., kriged),
+    with east and north velocities independent. Max shear is propagated to first order.
+
+    :param cov_e: tuple of arrays (var_x, cov_xy, var_y), covariance of the gradient of the east velocity
+    :param cov_n: tuple of arrays (var_x, cov_xy, var_y), covariance of the gradient of the north velocity
+    :param exx: array
+    :param eyy: array
+    :param exy: array
+    :returns: var_dil, var_max_shear, arrays
+    """
+    var_exx, var_eyy = cov_e[0], cov_n[2]
+    var_exy = 0.25 * (cov_e[2] + cov_n[0])
+    cov_exx_exy, cov_eyy_exy = 0.5 * cov_e[1], 0.5 * cov_n[1]
+    var_dil = var_exx + var_eyy
+
+    # derivatives of max shear with respect to exx (= -d/deyy) and exy
+    max_shear = 0.5 * np.sqrt(np.square(exx - eyy) + 4*np.square(exy))
+    d1 = (exx - eyy) / (4 * max_shear)
+    d2 = exy / max_shear
+    var_max_shear = (np.square(d1) * (var_exx + var_eyy) + np.square(d2) * var_exy +
+                     2 * d1 * d2 * (cov_exx_exy - cov_eyy_exy))
+
+    return var_dil, var_max_shear
@@ -0,0 +1,80 @@
+# Persistent cache of station-geometry products for the Delaunay methods.
+# The triangulation, the inverses of the per-triangle design matrices, and the map from grid nodes to triangles
+# depend only on station coordinates and the grid. When a network is re-processed with new velocities,
+# these can be read back instead of being recomputed.
+
+import hashlib
+import os
+import numpy as np
+from scipy.spatial import Delaunay
+from . import produce_gridded
+
+
+def get_geometry_cache_name(cache_dir, method_name, elon, nlat, lons, lats):
+    """
+    Name of the cache file for one station network and one grid.
+
+    :param cache_dir: string, directory holding the cache files
+    :param method_name: string, e.g., 'delaunay'. Different methods keep different design-matrix products.
+    :param elon: 1d array of station longitudes
+    :param nlat: 1d array of station latitudes
+    :param lons: 1d array of grid longitudes
+    :param lats: 1d array of grid latitudes
+    :returns: string, name of the .npz cache file
+    """
+    key = hashlib.sha1()
+    for array in (elon, nlat, lons, lats):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        key.update(str(array.shape).encode())
+        key.update(array.tobytes())
+    return os.path.join(cache_dir, method_name + '_geometry_' + key.hexdigest()[0:16] + '.npz')
+
+
+def get_triangle_geometry(elon, nlat, lons, lats, design_inverse_function, cache_dir=None, method_name='delaunay'):
+    """
+    Triangulate the stations and precompute everything that depends only on geometry, using the cache if possible.
+
+    :param elon: 1d array of station longitudes
+    :param nlat: 1d array of station latitudes
+    :param lons: 1d array of grid longitudes
+    :param lats: 1d array of grid latitudes
+    :param design_inverse_function: function taking the (T, 3, 2) triangle vertices, returning the stacked inverses
+        of the method's design matrices
+    :param cache_dir: optional string, directory for the cache. None means no caching.
+    :param method_name: string, used in the cache file name
+    :returns: dict with 'simplices' (T, 3) station indices, 'design_inverse', and 'index_map' (len(lats), len(lons))
+    """
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = get_geometry_cache_name(cache_dir, method_name, elon, nlat, lons, lats)
+        if os.path.isfile(cache_file):
+            return read_geometry_cache(cache_file)
+    z = np.column_stack((elon, nlat))
+    tri = Delaunay(z)
+    geometry = {'simplices': tri.simplices,
+                'design_inverse': design_inverse_function(z[tri.simplices]),
+                'index_map': produce_gridded.locate_in_triangles(z[tri.simplices], lons, lats, tri=tri)}
+    if cache_file is not None:
+        write_geometry_cache(geometry, cache_file)
+    return geometry
+
+
+def read_geometry_cache(cache_file):
+    """Read the triangulation, design-matrix inverses, and grid index map from a cache file."""
+    print("Reading cached triangle geometry %s " % cache_file)
+    with np.load(cache_file) as cached:
+        return {'simplices': cached['simplices'], 'design_inverse': cached['design_inverse'],
+                'index_map': cached['index_map']}
+
+
+def write_geometry_cache(geometry, cache_file):
+    """Write the triangle geometry into a cache file, through a temporary file so a partial write is never read."""
+    print("Writing cached triangle geometry %s " % cache_file)
+    try:
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        with open(cache_file + '.tmp', 'wb') as ofile:
+            np.savez(ofile, **geometry)
+        os.replace(cache_file + '.tmp', cache_file)
+    except OSError as err:  # e.g., read-only cache directory: run without the cache
+        print("Warning! Could not write triangle geometry cache (%s)." % err)
+    return
@@ -108,6 +108,17 @@ def check_coregistered_shapes(strain_values_ds):
 
 # --------- GRID AND VELFIELD NAMED TUPLE UTILITIES ------------------ #
 
+def get_float_precision(string_precision):
+    """
+    :param string_precision: 'float32' or 'float64'
+    :type string_precision: string
+    :returns: numpy dtype
+    """
+    if string_precision not in ('float32', 'float64'):
+        raise ValueError("Error! Precision must be float32 or float64, not " + string_precision)
+    return np.dtype(string_precision)
+
+
 def make_grid(coordbox, inc):
     """
     Assumption is a pixel-node-registered grid.
@@ -127,14 +138,9 @@ def make_grid(coordbox, inc):
 
 
 def getVels(velField):
-    """Extract velocities from a list of NamedTuples"""
-    lon = np.array([x.elon for x in velField])
-    lat = np.array([x.nlat for x in velField])
-    e = np.array([x.e for x in velField])
-    n = np.array([x.n for x in velField])
-    se = np.array([x.se for x in velField])
-    sn = np.array([x.se for x in velField])
-    return lon, lat, e, n, se, sn
+    """Extract velocity arrays from a VelocityField or a list of StationVels"""
+    velField = velocity_io.as_velocity_field(velField)
+    return velField.elon, velField.nlat, velField.e, velField.n, velField.se, velField.sn
 
 
 def get_index_of_nearest_point(xvals, target_val):
@@ -142,38 +148,47 @@ def get_index_of_nearest_point(xvals, target_val):
     return idx
 
 
+def get_index_of_nearest_points(xvals, target_vals):
+    """
+    Vectorized version of get_index_of_nearest_point, for xvals sorted in increasing order.
+    Ties go to the lower index, as with argmin.
+
+    :param xvals: 1d array, increasing
+    :param target_vals: 1d array
+    :returns: 1d array of integer indices into xvals
+    """
+    xvals, target_vals = np.asarray(xvals), np.asarray(target_vals)
+    if len(xvals) == 1:
+        return np.zeros(np.shape(target_vals), dtype=int)
+    idx = np.clip(np.searchsorted(xvals, target_vals), 1, len(xvals) - 1)
+    lower_is_closer = np.abs(target_vals - xvals[idx - 1]) <= np.abs(xvals[idx] - target_vals)
+    return np.where(lower_is_closer, idx - 1, idx)
+
+
 def subtract_two_velfields(obsfield, modelfield):
     # Perform residual subtraction
-    residual_velfield = []
-    for obs, model in zip(obsfield, modelfield):
-        newVelPoint = velocity_io.StationVel(elon=obs.elon, nlat=obs.nlat, e=obs.e - model.e,
-                                             n=obs.n - model.n, u=obs.u - model.u, se=0, sn=0, su=0, name=obs.name)
-        residual_velfield.append(newVelPoint)
-    return residual_velfield
+    obsfield = velocity_io.as_velocity_field(obsfield)
+    modelfield = velocity_io.as_velocity_field(modelfield)
+    return velocity_io.VelocityField(elon=obsfield.elon, nlat=obsfield.nlat, e=obsfield.e - modelfield.e,
+                                     n=obsfield.n - modelfield.n, u=obsfield.u - modelfield.u, se=0, sn=0, su=0,
+                                     name=obsfield.name)
 
 
 def create_model_velfield(xdata, ydata, Ve, Vn, myVelfield):
     """xdata, ydata are 1D arrays of lon and lat.  Ve, Vn are 2d arrays of interpolated velocities
     Returns MODEL velocities at points in myVelfield. """
-    model_velfield = []
-    for item in myVelfield:
-        target_lon = item.elon
-        target_lat = item.nlat
-        lon_idx = get_index_of_nearest_point(xdata, target_lon)
-        lat_idx = get_index_of_nearest_point(ydata, target_lat)
-        modelPoint = velocity_io.StationVel(elon=item.elon, nlat=item.nlat, e=Ve[lat_idx, lon_idx],
-                                            n=Vn[lat_idx, lon_idx], u=0, se=0, sn=0, su=0, name=item.name)
-        model_velfield.append(modelPoint)
-    return model_velfield
+    myVelfield = velocity_io.as_velocity_field(myVelfield)
+    lon_idx = get_index_of_nearest_points(xdata, myVelfield.elon)
+    lat_idx = get_index_of_nearest_points(ydata, myVelfield.nlat)
+    return velocity_io.VelocityField(elon=myVelfield.elon, nlat=myVelfield.nlat, e=Ve[lat_idx, lon_idx],
+                                     n=Vn[lat_idx, lon_idx], u=0, se=0, sn=0, su=0, name=myVelfield.name)
 
 
 def filter_by_bounding_box(velfield, bbox):
-    filtered_velfield = []
-    for item in velfield:
-        if bbox[0] <= item.elon <= bbox[1]:
-            if bbox[2] <= item.nlat <= bbox[3]:
-                filtered_velfield.append(item)
-    return filtered_velfield
+    velfield = velocity_io.as_velocity_field(velfield)
+    within_box = (bbox[0] <= velfield.elon) & (velfield.elon <= bbox[1]) & \
+                 (bbox[2] <= velfield.nlat) & (velfield.nlat <= bbox[3])
+    return velfield[within_box]
 
 
 # --------- GRD/NETCDF UTILITIES ------------------ #
@@ -1,5 +1,8 @@
 import glob
+import itertools
 import os
+import re
+import numpy as np
 import xarray as xr
 
 
@@ -16,33 +19,207 @@ class StationVel:
         self.name = name
 
 
+def _column(row):
+    """Property returning one row of the VelocityField data block as a zero-copy view."""
+    return property(lambda self: self._data[row])
+
+
+class VelocityField:
+    """
+    Columnar container for a 2D velocity field.
+    The numeric quantities live in one contiguous (8, N) float64 block, ordered
+    elon, nlat, e, n, u, se, sn, su, so that each quantity is a zero-copy view.
+    Iterating yields StationVel objects, so code written for lists of StationVel keeps working.
+
+    :param elon: 1d array of longitudes
+    :param nlat: 1d array of latitudes
+    :param e: 1d array of east velocities
+    :param n: 1d array of north velocities
+    :param u: 1d array of vertical velocities
+    :param se: 1d array of east uncertainties
+    :param sn: 1d array of north uncertainties
+    :param su: 1d array of vertical uncertainties
+    :param name: optional 1d array of station names
+    """
+    columns = ('elon', 'nlat', 'e', 'n', 'u', 'se', 'sn', 'su')
+
+    def __init__(self, elon, nlat, e, n, u, se, sn, su, name=None):
+        columns = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=np.float64))
+                                        for x in (elon, nlat, e, n, u, se, sn, su)])
+        data = np.array(columns, dtype=np.float64)
+        self._data = data
+        self.name = self._names(name, data.shape[1])
+
+    elon = _column(0)
+    nlat = _column(1)
+    e = _column(2)
+    n = _column(3)
+    u = _column(4)
+    se = _column(5)
+    sn = _column(6)
+    su = _column(7)
+
+    @staticmethod
+    def _names(name, length):
+        if name is None:
+            return np.full(length, '', dtype=str)
+        name = np.asarray(name, dtype=str)
+        if name.shape != (length,):
+            raise ValueError("Error! Station names do not match the number of velocities.")
+        return name
+
+    @classmethod
+    def from_array(cls, data, name=None):
+        """
+        Wrap an existing (8, N) block of elon, nlat, e, n, u, se, sn, su without copying it.
+
+        :param data: 2d array of shape (8, N)
+        :param name: optional 1d array of station names
+        :returns: VelocityField
+        """
+        if np.ndim(data) != 2 or np.shape(data)[0] != len(cls.columns):
+            raise ValueError("Error! Velocity data block must have shape (8, N).")
+        obj = cls.__new__(cls)
+        obj._data = np.asarray(data, dtype=np.float64)
+        obj.name = cls._names(name, obj._data.shape[1])
+        return obj
+
+    @classmethod
+    def from_stationvels(cls, myVelfield):
+        """
+        Build a VelocityField from a list of StationVel objects.
+
+        :param myVelfield: list of StationVel
+        :returns: VelocityField
+        """
+        if isinstance(myVelfield, cls):
+            return myVelfield
+        data = np.array([[item.elon, item.nlat, item.e, item.n, item.u, item.se, item.sn, item.su]
+                         for item in myVelfield], dtype=np.float64).reshape(-1, len(cls.columns))
+        return cls.from_array(data.T.copy(), name=[item.name for item in myVelfield])
+
+    @classmethod
+    def concatenate(cls, fields):
+        """
+        Join several VelocityFields end to end.
+
+        :param fields: iterable of VelocityField
+        :returns: VelocityField
+        """
+        fields = list(fields)
+        if len(fields) == 0:
+            return cls.from_array(np.zeros((len(cls.columns), 0)))
+        if len(fields) == 1:
+            return fields[0]
+        return cls.from_array(np.concatenate([item.data for item in fields], axis=1),
+                              name=np.concatenate([item.name for item in fields]))
+
+    @property
+    def data(self):
+        """The (8, N) float64 block backing this VelocityField."""
+        return self._data
+
+    def to_stationvels(self):
+        """Return the velocity field as a list of StationVel objects."""
+        return list(self)
+
+    def __len__(self):
+        return self._data.shape[1]
+
+    def __iter__(self):
+        for row, name in zip(self._data.T.tolist(), self.name.tolist()):
+            yield StationVel(*row, name=name)
+
+    def __getitem__(self, key):
+        """Integer keys return a StationVel; slices, index arrays and boolean masks return a VelocityField."""
+        if isinstance(key, (int, np.integer)):
+            return StationVel(*self._data[:, key].tolist(), name=str(self.name[key]))
+        return VelocityField.from_array(self._data[:, key], name=self.name[key])
+
+    def __repr__(self):
+        return "VelocityField with %d stations" % len(self)
+
+
+def as_velocity_field(myVelfield):
+    """
+    Accept either a VelocityField or a list of StationVel objects, and return a VelocityField.
+
+    :param myVelfield: VelocityField or list of StationVel
+    :returns: VelocityField
+    """
+    return VelocityField.from_stationvels(myVelfield)
+
+
+# A line holds data if its first token is a number, same as the original line-by-line readers
+_DATA_LINE = re.compile(r'^[ \t]*[-+]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|nan|inf(?:inity)?)(?:[ \t\r].*)?$',
+                        re.MULTILINE | re.IGNORECASE)
+
+
+def _select_data_lines(raw_lines):
+    """Classify a block of text lines in one regex pass over their joined text, keeping the data lines."""
+    return _DATA_LINE.findall(''.join(raw_lines))
+
+
+def _parse_numeric_block(lines, ncols):
+    """Parse the first ncols columns of many text lines in one vectorized pass. Returns an (ncols, N) array."""
+    if len(lines) == 0:
+        return np.zeros((ncols, 0))
+    return np.loadtxt(lines, usecols=range(ncols), dtype=np.float64, ndmin=2).T
+
+
+def _parse_name_column(lines, column):
+    """
+    Parse an optional string column in one regex pass, using '' where a line does not have one
+    (including ragged files, where only some lines have it). Anything after '#' is a comment.
+    """
+    if len(lines) == 0:
+        return np.zeros(0, dtype=str)
+    pattern = re.compile(r'^(?:[ \t]*(?:[^\s#]+[ \t]+){%d}([^\s#]+))?.*$' % column, re.MULTILINE)
+    return np.array(pattern.findall('\n'.join(lines))[:len(lines)], dtype=str)
+
+
+def _read_data_lines(ifile, chunksize=None):
+    """Yield lists of at most chunksize data lines (all of them if chunksize is None) from an open file."""
+    while True:
+        raw_lines = ifile.readlines() if chunksize is None else list(itertools.islice(ifile, chunksize))
+        if len(raw_lines) == 0:
+            return
+        yield _select_data_lines(raw_lines)
+        if chunksize is None:
+            return
+
+
 def read_stationvels(input_file):
     """
     Reading basic format for 2D velocity data.
     Format: lon(deg) lat(deg) VE(mm) VN(mm) VU(mm) SE(mm) SN(mm) SU(mm) name(optional)
+    Lines whose first entry is not a number are skipped.
 
     :param input_file: name of velocity file
-    :returns: list of stationvels
+    :returns: VelocityField
     """
     print("Reading file %s " % input_file)
-    myVelfield = []
-    ifile = open(input_file, 'r')
-    for line in ifile:
-        temp = line.split()
-        try:
-            lon = float(temp[0])
-        except ValueError:
-            continue
-        lat, VE, VN, VU = float(temp[1]), float(temp[2]), float(temp[3]), float(temp[4])
-        SE, SN, SU = float(temp[5]), float(temp[6]), float(temp[7])
-        if len(temp) > 8:
-            name = temp[8]
-        else:
-            name = ''
-        mystation = StationVel(elon=lon, nlat=lat, e=VE, n=VN, u=VU, se=SE, sn=SN, su=SU, name=name)
-        myVelfield.append(mystation)
-    ifile.close()
-    return myVelfield
+    blocks = list(iter_stationvels(input_file, chunksize=None, verbose=False))
+    return VelocityField.concatenate(blocks)
+
+
+def iter_stationvels(input_file, chunksize=1000000, verbose=True):
+    """
+    Streaming reader for the basic format for 2D velocity data, for files too large to hold in memory at once.
+    Format: lon(deg) lat(deg) VE(mm) VN(mm) VU(mm) SE(mm) SN(mm) SU(mm) name(optional)
+
+    :param input_file: name of velocity file
+    :param chunksize: int, maximum number of lines parsed into each block. None reads the whole file at once.
+    :param verbose: bool, print the file name
+    :returns: generator of VelocityField blocks
+    """
+    if verbose:
+        print("Reading file %s in blocks of %s lines" % (input_file, chunksize))
+    with open(input_file, 'r') as ifile:
+        for lines in _read_data_lines(ifile, chunksize):
+            data = _parse_numeric_block(lines, ncols=8)
+            names = _parse_name_column(lines, column=8)
+            yield VelocityField.from_array(data, name=names)
 
 
 def write_stationvels(myVelfield, output_file, header=""):
@@ -71,28 +248,15 @@ def read_gmt_format(filename, wrap_lons_greater_than_180=False):
 
     :param filename: name of velocity file
     :param wrap_lons_greater_than_180: bool, whether to convert lons 240E to -120E. By default, will not.
-    :returns: list of stationvels
+    :returns: VelocityField
     """
     print("reading file %s " % filename)
-    myVelfield = []
-    ifile = open(filename, 'r')
-    for line in ifile:
-        if len(line.split()) == 0:
-            continue
-        if line.split()[0] == "#":
-            continue
-        temp = line.split()
-        try:
-            _lon = float(temp[0])
-        except ValueError:
-            continue
-        lon, lat, VE, VN = float(temp[0]), float(temp[1]), float(temp[2]), float(temp[3])
-        se, sn = float(temp[4]), float(temp[5])
-        if wrap_lons_greater_than_180 and lon > 180:  # catch for longitudes like 240°E (should be -120°E)
-            lon = lon - 360
-        myVelfield.append(StationVel(elon=lon, nlat=lat, e=VE, n=VN, u=0, se=se, sn=sn, su=0.1))
-    ifile.close()
-    return myVelfield
+    with open(filename, 'r') as ifile:
+        lines = next(_read_data_lines(ifile), [])
+    lon, lat, VE, VN, se, sn = _parse_numeric_block(lines, ncols=6)
+    if wrap_lons_greater_than_180:  # catch for longitudes like 240°E (should be -120°E)
+        lon = np.where(lon > 180, lon - 360, lon)
+    return VelocityField(elon=lon, nlat=lat, e=VE, n=VN, u=0, se=se, sn=sn, su=0.1)
 
 
 def write_gmt_format(myVelfield, outfile):
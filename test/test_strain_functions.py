@@ -1,7 +1,15 @@
+import os
+import shutil
+import tempfile
+import types
 import unittest
 import numpy as np
-from Strain_Tools.strain import strain_tensor_toolbox, configure_functions, velocity_io
-from Strain_Tools.strain.models import strain_delaunay_flat, strain_delaunay
+from scipy.spatial import Delaunay
+from xarray import open_dataset
+from Strain_Tools.strain import strain_tensor_toolbox, configure_functions, velocity_io, produce_gridded, \
+    compiled_kernels, moment_functions, input_manager, utilities, triangulation_cache, internal_coordinator
+from Strain_Tools.strain.models import strain_delaunay_flat, strain_delaunay, strain_loc_avg_grad, strain_geostats, \
+    strain_gpsgridder
 
 
 class Tests(unittest.TestCase):
@@ -61,6 +69,7 @@ class Tests(unittest.TestCase):
     def test_reading_config(self):
         MyParams = configure_functions.read_strain_config(configfile="example/00_example_strain_config.txt")
         self.assertTrue(MyParams)
+        self.assertEqual(MyParams.precision, np.float64)  # the default
         return
 
     def test_delaunay_signs(self):
@@ -81,6 +90,327 @@ class Tests(unittest.TestCase):
         self.assertLess(abs(rot1[0]-rot2[0]), abs(rot1[0]*0.05))  # less than 5% difference
         return
 
+    def test_flat_velocity_gradients(self):
+        # A linear velocity field should be recovered exactly in every triangle
+        dE = np.array([[-10.0, 5.0, 5.0], [0.0, 20.0, -20.0]])
+        dN = np.array([[-5.0, -5.0, 10.0], [15.0, -5.0, -10.0]])
+        VE, VN = 2 + 0.1 * dE - 0.2 * dN, -1 + 0.3 * dE + 0.05 * dN
+        [dVEdE, dVEdN, dVNdE, dVNdN] = strain_delaunay_flat.solve_velocity_gradients(dE, dN, VE, VN)
+        np.testing.assert_allclose(dVEdE, [0.1, 0.1])
+        np.testing.assert_allclose(dVEdN, [-0.2, -0.2])
+        np.testing.assert_allclose(dVNdE, [0.3, 0.3])
+        np.testing.assert_allclose(dVNdN, [0.05, 0.05])
+        return
+
+    def test_strain_sphere_batch(self):
+        # The batched spherical inversion should match the one-triangle-at-a-time inversion
+        phi = np.array([[-123, -123, -123.5], [-124, -123.2, -123.9]])
+        theta = np.array([[40, 40.25, 40.5], [38, 38.1, 39]]) - 90
+        u_phi = np.array([[0.023, 0.025, 0.027], [0.01, -0.02, 0.005]])
+        u_theta = np.array([[0.013, 0.011, 0.011], [-0.004, 0.002, 0.008]])
+        sigmas = np.array([[0.002, 0.002, 0.002], [0.001, 0.003, 0.002]])
+        batch = strain_delaunay.strain_sphere_batch(phi, theta, u_phi, u_theta, sigmas, sigmas, 1, 0)
+        for i in range(2):
+            single = strain_delaunay.strain_sphere(phi[i], theta[i], u_phi[i], u_theta[i], sigmas[i], sigmas[i], 1, 0)
+            for k in [0, 1, 2, 3, 6, 13, 14, 15, 16, 17, 18, 19]:  # strains, rotations, Euler poles, uncertainties
+                np.testing.assert_allclose(batch[k][i], single[k], rtol=1e-6)
+        return
+
+    def test_locate_in_triangles(self):
+        # Test the gridding of triangle values, with and without the scipy triangulation
+        points = np.array([[-124, 39], [-123, 39], [-123, 40], [-124, 40], [-123.4, 39.6]])
+        tri = Delaunay(points)
+        triangle_vertices = points[tri.simplices]
+        lons, lats = np.arange(-124.5, -122.5, 0.1), np.arange(38.5, 40.5, 0.1)
+        index_map = produce_gridded.locate_in_triangles(triangle_vertices, lons, lats, tri=tri)
+        np.testing.assert_array_equal(index_map, produce_gridded.locate_in_triangles(triangle_vertices, lons, lats))
+        self.assertEqual(index_map[0, 0], -1)  # outside the convex hull
+        grid = produce_gridded.find_in_triangles(triangle_vertices, np.arange(len(triangle_vertices)), lons, lats)
+        self.assertTrue(np.isnan(grid[0, 0]))
+        np.testing.assert_array_equal(grid[index_map >= 0], index_map[index_map >= 0])
+        grid32 = produce_gridded.values_to_grid(index_map, np.arange(len(triangle_vertices)), dtype=np.float32)[0]
+        self.assertEqual(grid32.dtype, np.float32)
+        np.testing.assert_array_equal(grid32, grid)
+        return
+
+    def test_loc_avg_grad_uniform_extension(self):
+        # East velocity growing by 1 mm/yr per 1000 km of local easting should give exx = 1 nanostrain/yr
+        lons, lats = np.meshgrid(np.arange(-124, -121.9, 0.25), np.arange(38, 40.1, 0.25))
+        x, _ = strain_loc_avg_grad.convert_to_local_planar(lons.ravel(), lats.ravel(), np.min(lons), np.min(lats))
+        stations = [velocity_io.StationVel(name="s%03d" % i, elon=lon, nlat=lat, e=x[i] * 1e-6, n=0, u=0, se=1, sn=1,
+                                           su=1) for i, (lon, lat) in enumerate(zip(lons.ravel(), lats.ravel()))]
+        xlons, ylats = np.arange(-123.5, -122.4, 0.1), np.arange(38.5, 39.6, 0.1)
+        [_, Vn, rot, exx, exy, eyy] = strain_loc_avg_grad.compute_loc_avg_grad(stations, xlons, ylats, 60, 5)
+        np.testing.assert_allclose(exx, 1, rtol=1e-6)
+        np.testing.assert_allclose(np.array([Vn, rot, exy, eyy]), 0, atol=1e-6)
+        [_, _, _, exx, _, _] = strain_loc_avg_grad.compute_loc_avg_grad(stations, xlons, ylats, 10, 5)
+        np.testing.assert_array_equal(exx, 0)  # too few stations within the radius
+        for weighting in ["none", "inverse_distance", "uncertainty"]:
+            [_, _, _, exx, _, _] = strain_loc_avg_grad.compute_loc_avg_grad(stations, xlons, ylats, 60, 5,
+                                                                            neighborhood="radius", weighting=weighting)
+            np.testing.assert_allclose(exx, 1, rtol=1e-6)
+        # Grid nodes without any station in the radius are left out, wherever they fall in the batch
+        far_lons = np.concatenate(([-126.5], xlons, [-120]))
+        [_, _, _, exx, _, _] = strain_loc_avg_grad.compute_loc_avg_grad(stations, far_lons, ylats, 60, 0,
+                                                                        neighborhood="radius")
+        np.testing.assert_array_equal(exx[:, [0, -1]], 0)
+        np.testing.assert_allclose(exx[:, 1:-1], 1, rtol=1e-6)
+        x, y = np.array([0., 1, 0, 5, 6, 5]), np.array([0., 0, 1, 5, 5, 6])
+        nodes, model = strain_loc_avg_grad.fit_local_planes(np.array([0, 3, 3, 6, 6]), np.arange(6), x, y, 2 * x,
+                                                            -y, np.ones((6, 2)), np.arange(4))
+        np.testing.assert_array_equal(nodes, [0, 2])
+        np.testing.assert_allclose(model[:, 0, 1], 2)
+        np.testing.assert_allclose(model[:, 1, 2], -1)
+        collinear = [station for station in stations if station.nlat == 39]
+        [_, _, _, exx, _, _] = strain_loc_avg_grad.compute_loc_avg_grad(collinear, xlons, ylats, 200, 5)
+        np.testing.assert_array_equal(exx, 0)  # degenerate plane fits are masked
+        return
+
+    def test_output_precision(self):
+        # Models allocate their grids in the configured precision, matching float64 runs to float32 rounding
+        with tempfile.TemporaryDirectory() as outdir:
+            for method in ['delaunay_flat', 'loc_avg_grad', 'geostats', 'gpsgridder']:
+                MyParams = configure_functions.read_strain_config("test/testing_data/00_example_strain_config.txt",
+                                                                  desired_method=method)
+                MyParams.method_specific.update(implementation='native', strain_mode='analytic')
+                myVelfield = velocity_io.read_stationvels(MyParams.input_file)
+                model = internal_coordinator.get_model(method)
+                expected = model(MyParams._replace(outdir=outdir + os.sep)).compute(myVelfield)[0:6]
+                grids = model(MyParams._replace(outdir=outdir + os.sep,
+                                                precision=np.dtype('float32'))).compute(myVelfield)[0:6]
+                for grid, grid64 in zip(grids, expected):
+                    self.assertEqual(grid.dtype, np.float32)
+                    self.assertEqual(grid64.dtype, np.float64)
+                    scale = np.max(np.abs(grid64), initial=0, where=np.isfinite(grid64))
+                    np.testing.assert_allclose(grid, grid64, rtol=1e-4, atol=1e-4 * scale)
+        return
+
+    def test_ordinary_kriging(self):
+        # The factored solver should agree with the bordered ordinary-kriging system
+        rng = np.random.default_rng(0)
+        xy, XY, data = rng.uniform(0, 2, (50, 2)), rng.uniform(0, 2, (20, 2)), rng.normal(size=50)
+        model = strain_geostats.Gaussian(sill=20., range=0.3, nugget=3.)
+        SIG = strain_geostats.compute_covariance(model, xy) + 1e-8 * np.eye(50)
+        sig0 = strain_geostats.compute_covariance(model, xy, XY)
+        Dest, Dsig, lam, nu = strain_geostats.ordinary_kriging(SIG, sig0, data, 20.)
+        bordered = np.block([[SIG, np.ones((50, 1))], [np.ones((1, 50)), 0]])
+        lam_nu = np.linalg.solve(bordered, np.vstack([sig0, np.ones((1, 20))]))
+        np.testing.assert_allclose(lam, lam_nu[:-1, :], atol=1e-10)
+        np.testing.assert_allclose(nu, -lam_nu[-1, :], atol=1e-10)
+        np.testing.assert_allclose(Dest, np.dot(lam_nu[:-1, :].T, data), atol=1e-10)
+        np.testing.assert_allclose(np.sum(lam, axis=0), 1)
+        Dest_chunked, Dsig_chunked, _ = strain_geostats.krige(xy, XY, data, model, chunk_size=7)
+        Dest_whole, Dsig_whole, _ = strain_geostats.krige(xy, XY, data, model)
+        np.testing.assert_allclose(Dest_chunked, Dest_whole, atol=1e-12)
+        np.testing.assert_allclose(Dsig_chunked, Dsig_whole, atol=1e-12)
+        return
+
+    def test_universal_kriging(self):
+        # The Schur-complement solve should agree with the bordered universal-kriging system
+        rng = np.random.default_rng(5)
+        xy, XY = rng.uniform([-124, 38], [-121, 41], (50, 2)), rng.uniform([-124, 38], [-121, 41], (20, 2))
+        data = rng.normal(size=50) + 3 * xy[:, 0] - 2 * xy[:, 1]
+        model = strain_geostats.Gaussian(sill=20., range=0.3, nugget=3.)
+        SIG = strain_geostats.compute_covariance(model, xy) + 1e-8 * np.eye(50)
+        sig0 = strain_geostats.compute_covariance(model, xy, XY)
+        F, F0 = np.column_stack([np.ones(50), xy]), np.column_stack([np.ones(20), XY])
+        bordered = np.block([[SIG, F], [F.T, np.zeros((3, 3))]])
+        lam_mu = np.linalg.solve(bordered, np.vstack([sig0, F0.T]))
+        Dest, Dsig, lam = strain_geostats.universal_kriging(SIG, sig0, data, 20., xy, XY)
+        np.testing.assert_allclose(lam, lam_mu[:-3, :], atol=1e-8)
+        np.testing.assert_allclose(Dest, np.dot(lam_mu[:-3, :].T, data), atol=1e-8)
+        Dest_chunked = strain_geostats.krige(xy, XY, data, model, ktype='uk', order=2, chunk_size=7)[0]
+        np.testing.assert_allclose(Dest_chunked, strain_geostats.krige(xy, XY, data, model, ktype='uk', order=2)[0],
+                                   atol=1e-10)
+        return
+
+    def test_variogram_fit(self):
+        # Fitting the empirical variogram of a simulated field should recover its model parameters
+        rng = np.random.default_rng(0)
+        xy = rng.uniform(0, 4, (600, 2))
+        model = strain_geostats.Gaussian(sill=20., range=0.5, nugget=3.)
+        L = np.linalg.cholesky(strain_geostats.compute_covariance(model, xy) + 1e-8 * np.eye(600))
+        data = np.dot(L, rng.normal(size=(600, 2)))
+        lags, gamma, counts = strain_geostats.empirical_variogram(xy, data, 1.5)
+        self.assertEqual(gamma.shape, (len(lags), 2))
+        self.assertEqual(np.sum(counts), len(strain_geostats.cKDTree(xy).query_pairs(1.5)))
+        for k in range(2):
+            fitted = strain_geostats.fit_variogram(strain_geostats.Gaussian(), lags, gamma[:, k], counts)
+            sill, rang, nugget = fitted.getParms()
+            self.assertAlmostEqual(rang, 0.5, delta=0.1)
+            self.assertAlmostEqual((sill + nugget) / np.var(data[:, k]), 1, delta=0.2)
+        subsampled = strain_geostats.empirical_variogram(xy, data, 1.5, max_pairs=20000)
+        self.assertLess(np.sum(subsampled[2]), np.sum(counts))
+        return
+
+    def test_local_kriging(self):
+        # With every station in the neighborhood, local kriging should reproduce global kriging
+        MyParams = configure_functions.read_strain_config("example/00_example_strain_config.txt",
+                                                          desired_method='geostats')
+        MyParams.method_specific.update(neighborhood='local', nstations='100', block_size='3', threads='2')
+        rng = np.random.default_rng(1)
+        xy, data = rng.uniform([-124, 38], [-121, 41], (40, 2)), rng.normal(size=(40, 2))
+        [X, Y] = np.meshgrid(np.arange(-124, -121, 0.25), np.arange(38, 41, 0.25))
+        model = strain_geostats.geostats(MyParams)
+        model.setPoints(xy=xy, data=data)
+        model.setGrid(np.array([X.flatten(), Y.flatten()]).T, X.shape)
+        self.assertEqual(len(model.getBlocks()), 16)
+        for expected, actual in zip(model.krige_velocities(), model.krige_velocities_local()):
+            np.testing.assert_allclose(actual, expected, atol=1e-10)
+        MyParams.method_specific.update(approximation='nystrom')
+        with self.assertRaises(ValueError):
+            strain_geostats.geostats(MyParams)
+        return
+
+    def test_low_rank_kriging(self):
+        # With every station as an inducing point, the low-rank solver is exact
+        rng = np.random.default_rng(2)
+        xy, XY, data = rng.uniform(0, 2, (60, 2)), rng.uniform(0, 2, (20, 2)), rng.normal(size=60)
+        model = strain_geostats.Gaussian(sill=20., range=0.3, nugget=3.)
+        exact = strain_geostats.krige(xy, XY, data, model)
+        for fitc in [False, True]:
+            solver = strain_geostats.LowRankKriging(model, xy, xy, fitc=fitc)
+            approx = strain_geostats.krige(xy, XY, data, model, solver=solver)
+            np.testing.assert_allclose(approx[0], exact[0], atol=1e-6)
+            np.testing.assert_allclose(approx[1], exact[1], atol=1e-6)
+        Z = strain_geostats.choose_inducing_points(xy, 15, method='inducing')
+        self.assertEqual(Z.shape, (15, 2))
+
+        # With few inducing points the kriging variances must stay finite and non-negative, at stations too
+        xy, data = rng.uniform(0, 2, (300, 2)), rng.normal(size=300)
+        XY = np.vstack([xy[:50], rng.uniform(0, 2, (50, 2))])
+        for method in ['nystrom', 'inducing']:
+            solver = strain_geostats.LowRankKriging(model, xy, strain_geostats.choose_inducing_points(xy, 20, method),
+                                                    fitc=(method == 'inducing'))
+            for ktype in ['sk', 'ok', 'uk']:
+                Dsig = strain_geostats.krige(xy, XY, data, model, ktype=ktype, solver=solver)[1]
+                self.assertTrue(np.all(np.isfinite(Dsig)))
+                self.assertTrue(np.all(Dsig >= 0))
+            var_x, cov_xy, var_y = strain_geostats.krige_gradient(xy, XY, data, model, solver=solver)[2:5]
+            self.assertTrue(np.all(var_x >= 0) and np.all(var_y >= 0))
+
+        # Without a nugget, the floor on D keeps the solves accurate and the variances valid
+        model = strain_geostats.Gaussian(sill=20., range=0.3, nugget=0.)
+        data = np.sin(3 * xy[:, 0]) + np.cos(2 * xy[:, 1])
+        for method in ['nystrom', 'inducing']:
+            solver = strain_geostats.LowRankKriging(model, xy, strain_geostats.choose_inducing_points(xy, 40, method),
+                                                    fitc=(method == 'inducing'))
+            B = rng.normal(size=(300, 3))
+            np.testing.assert_allclose(solver._D[:, None] * solver.solve(B) +
+                                       np.dot(solver._U, np.dot(solver._U.T, solver.solve(B))), B, atol=1e-8)
+            for ktype in ['sk', 'ok', 'uk']:
+                Dest, Dsig, _ = strain_geostats.krige(xy, XY, data, model, ktype=ktype, solver=solver)
+                self.assertTrue(np.all(np.isfinite(Dsig)))
+                self.assertTrue(np.all(Dsig >= 0))
+                self.assertLess(np.max(np.abs(Dest[:50] - data[:50])), 1)
+        return
+
+    def test_sparse_kriging(self):
+        # Compactly supported models are kriged with sparse matrices, matching the dense solution
+        rng = np.random.default_rng(3)
+        xy, XY, data = rng.uniform(0, 2, (80, 2)), rng.uniform(0, 2, (20, 2)), rng.normal(size=80)
+        for model in [strain_geostats.Spherical(sill=20., range=0.3, nugget=3.),
+                      strain_geostats.Wendland(sill=20., range=0.3, nugget=3.)]:
+            np.testing.assert_allclose(model(np.array([0.3, 0.5])), 0)
+            solver = strain_geostats.factor_covariance(model, xy)
+            self.assertIsInstance(solver, strain_geostats.SparseKriging)
+            SIG = strain_geostats.compute_covariance(model, xy) + np.sqrt(np.finfo(float).eps) * np.eye(80)
+            sig0 = solver.crossCovariance(model, xy, XY)
+            self.assertTrue(strain_geostats.issparse(sig0))
+            self.assertLess(sig0.nnz, 0.5 * 80 * 20)
+            np.testing.assert_allclose(sig0.toarray(), strain_geostats.compute_covariance(model, xy, XY), atol=1e-12)
+            for ktype in ['sk', 'ok', 'uk']:
+                dense = strain_geostats.krige(xy, XY, data, model, ktype=ktype,
+                                              solver=strain_geostats.CholeskyKriging(SIG))
+                sparse = strain_geostats.krige(xy, XY, data, model, ktype=ktype, solver=solver)
+                np.testing.assert_allclose(sparse[0], dense[0], atol=1e-10)
+                np.testing.assert_allclose(sparse[1], dense[1], atol=1e-10)
+        return
+
+    def test_kriged_gradients(self):
+        # Analytic gradients should match central differences of the kriged field
+        rng = np.random.default_rng(4)
+        xy, XY, data = rng.uniform(0, 2, (60, 2)), rng.uniform(0.2, 1.8, (15, 2)), rng.normal(size=60)
+        for model in [strain_geostats.Gaussian(sill=20., range=0.3, nugget=3.),
+                      strain_geostats.Wendland(sill=20., range=0.6, nugget=3.)]:
+            dDdx, dDdy, var_x, cov_xy, var_y = strain_geostats.krige_gradient(xy, XY, data, model, chunk_size=4)
+            h = 1e-5
+            for grad, step in [(dDdx, [h, 0]), (dDdy, [0, h])]:
+                central = (strain_geostats.krige(xy, XY + step, data, model)[0] -
+                           strain_geostats.krige(xy, XY - step, data, model)[0]) / (2 * h)
+                np.testing.assert_allclose(grad, central, atol=1e-6)
+            self.assertTrue(np.all(var_x * var_y - cov_xy**2 > 0))
+        with self.assertRaises(NotImplementedError):
+            strain_geostats.Exponential(sill=20., range=0.3, nugget=3.).getGradientVariance()
+        return
+
+    def test_kriged_strain_modes(self):
+        # On a smooth field, differencing the kriged velocities and kriging the gradients give the same strain rates.
+        # At the equator and with equal grid spacing in km, strain_on_regular_grid's axis spacings do not matter.
+        MyParams = configure_functions.read_strain_config("example/00_example_strain_config.txt",
+                                                          desired_method='geostats')
+        rng = np.random.default_rng(7)
+        lon, lat = rng.uniform(-1.5, 1.5, 300), rng.uniform(-1.5, 1.5, 300)
+        myVelfield = velocity_io.VelocityField(elon=lon, nlat=lat, e=3 + 2 * lon + lat + 0.2 * np.sin(lat),
+                                               n=-1 - lon + 0.5 * lat, u=0, se=1., sn=1., su=1.)
+        xdata, ydata = np.arange(-1, 1.01, 0.1), np.arange(-1, 1.01, 0.1)
+        results = {}
+        with tempfile.TemporaryDirectory() as outdir:
+            for strain_mode in ['finite_difference', 'analytic']:
+                MyParams.method_specific.update(trend='1', strain_mode=strain_mode)
+                model = strain_geostats.geostats(MyParams._replace(inc=[0.1, 0.1], range_strain=[-1, 1, -1, 1],
+                                                                   xdata=xdata, ydata=ydata,
+                                                                   outdir=outdir + os.sep))
+                results[strain_mode] = model.compute(myVelfield)[2:6]
+                with open_dataset(os.path.join(outdir, 'geostats_uncertainty.nc')) as ds:
+                    self.assertTrue(np.all(ds['var_dilatation'].values[1:-1, 1:-1] > 0))
+        for fd, analytic in zip(results['finite_difference'], results['analytic']):
+            np.testing.assert_allclose(fd[1:-1, 1:-1], analytic[1:-1, 1:-1], atol=0.05)
+        np.testing.assert_allclose(results['analytic'][1], 2 / 111 * 1000, rtol=0.05)  # exx, nanostrain/yr
+        return
+
+    def test_gpsgridder_native(self):
+        # The elastic interpolator should fit the stations exactly without an eigenvalue cutoff,
+        # and turn a uniform velocity field into a uniform grid without strain
+        rng = np.random.default_rng(6)
+        lon, lat = rng.uniform(-124, -121, 40), rng.uniform(38, 41, 40)
+        e, n = rng.normal(size=40), rng.normal(size=40)
+        forces, mean_e, mean_n, num_kept = strain_gpsgridder.fit_body_forces(lon, lat, e, n, 0.5, 0.01, 0)
+        self.assertEqual(num_kept, 80)
+        u, v = strain_gpsgridder.evaluate_body_forces(lon, lat, forces, lon, lat, 0.5, 0.01, chunk_size=7)
+        np.testing.assert_allclose(u + mean_e, e, atol=1e-6)
+        np.testing.assert_allclose(v + mean_n, n, atol=1e-6)
+
+        myVelfield = velocity_io.VelocityField(elon=lon, nlat=lat, e=2., n=-3., u=0, se=1., sn=1., su=1.)
+        xdata, ydata = np.arange(-124, -121, 0.5), np.arange(38, 41, 0.5)
+        with tempfile.TemporaryDirectory() as outdir:
+            Ve, Vn, rot, exx, exy, eyy = strain_gpsgridder.compute_gpsgridder_native(
+                myVelfield, xdata, ydata, [-124, -121, 38, 41], [0.5, 0.5], 0.5, 0.01, 0.0005, outdir)
+            self.assertTrue(os.path.isfile(os.path.join(outdir, 'misfitfile.txt')))
+        np.testing.assert_allclose(Ve, 2)
+        np.testing.assert_allclose(Vn, -3)
+        np.testing.assert_allclose(exx, 0, atol=1e-10)
+        MyParams = configure_functions.read_strain_config("example/00_example_strain_config.txt",
+                                                          desired_method='gpsgridder')
+        self.assertEqual(strain_gpsgridder.gpsgridder(MyParams)._implementation, 'gmt')  # native is opt-in
+        return
+
+    @unittest.skipUnless(os.path.isfile("test/testing_data/gpsgridder_gmt/nc_u.nc"),
+                         "GMT reference grids not generated; see test/testing_data/gpsgridder_gmt/make_reference.sh")
+    def test_gpsgridder_gmt_reference(self):
+        # The native interpolator should reproduce the grids of 'gmt gpsgridder' on the same stations and settings
+        fixture_dir = "test/testing_data/gpsgridder_gmt/"
+        myVelfield = velocity_io.read_stationvels("test/testing_data/euler_pole_rotation_vels.txt")
+        nc_u, nc_v = open_dataset(fixture_dir + "nc_u.nc"), open_dataset(fixture_dir + "nc_v.nc")
+        with tempfile.TemporaryDirectory() as outdir:
+            Ve, Vn, _, _, _, _ = strain_gpsgridder.compute_gpsgridder_native(
+                myVelfield, nc_u["x"].to_numpy(), nc_u["y"].to_numpy(), [-125, -120, 39.5, 42.5], [0.5, 0.5],
+                0.5, 0.01, 0.0005, outdir)
+        scale = np.max(np.abs(myVelfield.e) + np.abs(myVelfield.n))
+        np.testing.assert_allclose(Ve, nc_u["z"].to_numpy(), atol=1e-3 * scale)
+        np.testing.assert_allclose(Vn, nc_v["z"].to_numpy(), atol=1e-3 * scale)
+        return
+
     def test_azimuth_math(self):
         # Test angular math functions
         azimuth_array = [0, 1, 179, 0]
@@ -88,11 +418,191 @@ class Tests(unittest.TestCase):
         self.assertEqual(theta, 0)
         return
 
+    def test_eigenvectors(self):
+        # The closed-form eigen-decomposition should agree with np.linalg.eig at every point
+        exx = np.array([[1.0, 2.0, -3.0], [0.5, np.nan, 4.0]])
+        exy = np.array([[0.0, 1.5, 2.0], [-0.7, 1.0, 0.0]])
+        eyy = np.array([[2.0, 2.0, 1.0], [-4.0, 1.0, -1.0]])
+        [e1, e2, v00, v01, v10, v11] = strain_tensor_toolbox.compute_eigenvectors(exx, exy, eyy)
+        for j in range(2):
+            for i in range(3):
+                [w1, w2, v] = strain_tensor_toolbox.eigenvector_eigenvalue(exx[j, i], exy[j, i], eyy[j, i])
+                np.testing.assert_allclose([e1[j, i], e2[j, i]], [w1, w2], rtol=1e-12)
+                np.testing.assert_allclose([[v00[j, i], v01[j, i]], [v10[j, i], v11[j, i]]], v, rtol=1e-12)
+                if not np.isnan(exx[j, i]):
+                    azimuth = strain_tensor_toolbox.compute_max_shortening_azimuth(e1[j, i], e2[j, i], v00[j, i],
+                                                                                  v01[j, i], v10[j, i], v11[j, i])
+                    self.assertAlmostEqual(strain_tensor_toolbox.compute_derived_quantities(exx, exy, eyy)[3][j, i],
+                                           azimuth)
+        return
+
+    def test_strain_products(self):
+        # All ten products should match the separate invariant and eigenvector functions, whether or not
+        # the output arrays are provided
+        rng = np.random.default_rng(3)
+        exx, exy, eyy = [rng.normal(size=(6, 7)) * 50 for _ in range(3)]
+        exy[0, 0:3] = 0
+        eyy[1, 2] = np.nan
+        expected = strain_tensor_toolbox.compute_derived_quantities(exx, exy, eyy) + \
+            strain_tensor_toolbox.compute_eigenvectors(exx, exy, eyy)
+        np.testing.assert_allclose(expected[0], 0.5 * (exx * eyy - exy * exy))
+        np.testing.assert_allclose(expected[1], 0.5 * np.sqrt((exx - eyy)**2 + 4 * exy**2))
+        np.testing.assert_allclose(expected[2], exx + eyy)
+        out = [np.zeros(exx.shape) for _ in range(10)]
+        for products in (strain_tensor_toolbox.compute_strain_products(exx, exy, eyy),
+                         strain_tensor_toolbox.compute_strain_products(exx, exy, eyy, out=out)):
+            self.assertEqual(len(products), 10)
+            for product, quantity in zip(products, expected):
+                np.testing.assert_array_equal(product, quantity)
+        for array, product in zip(out, products):
+            self.assertIs(product, array)  # filled in place
+        return
+
+    @unittest.skipUnless(compiled_kernels.NUMBA_AVAILABLE, "numba is not installed")
+    def test_numba_backend(self):
+        # The compiled kernels should agree with the numpy path.
+        # Azimuths go through each backend's own atan2/sin/cos, so those may differ in the last bit.
+        rng = np.random.default_rng(0)
+        exx, exy, eyy = [rng.normal(size=(20, 30)) * 50 for _ in range(3)]
+        exy[0, 0:5] = 0
+        exx[1, 0:3] = np.nan
+        azimuths = rng.uniform(0, 180, size=(20, 30, 4))
+        azimuths[0, 0, :] = np.nan
+        landmask = (rng.uniform(size=(20, 30)) > 0.3).astype(float)
+        lons, lats = np.arange(30) * 0.04 - 122, np.arange(20) * 0.04 + 38
+        results = {}
+        try:
+            for backend in ["numpy", "numba"]:
+                compiled_kernels.set_backend(backend)
+                results[backend] = [strain_tensor_toolbox.compute_strain_products(exx, exy, eyy),
+                                    strain_tensor_toolbox.angle_mean_math(azimuths),
+                                    moment_functions.compute_moments_loop(lons, lats, exx, exy, eyy, landmask, 30, 10)]
+        finally:
+            compiled_kernels.set_backend("numpy")
+        for k, (expected, actual) in enumerate(zip(results["numpy"][0], results["numba"][0])):
+            if k == 3:
+                np.testing.assert_allclose(actual, expected, rtol=1e-12)
+            else:
+                np.testing.assert_array_equal(actual, expected)
+        np.testing.assert_allclose(results["numba"][1], results["numpy"][1], rtol=1e-12)
+        np.testing.assert_array_equal(results["numba"][2][1], results["numpy"][2][1])
+        return
+
+    def test_velocity_field(self):
+        # Test the columnar velocity container against a list of StationVels
+        station1 = velocity_io.StationVel(name="xxxx", elon=-123, nlat=39, e=0, n=0, u=0, se=1, sn=1, su=1)
+        station2 = velocity_io.StationVel(name="yyyy", elon=-124, nlat=39, e=-1, n=2, u=0, se=1, sn=1, su=1)
+        station3 = velocity_io.StationVel(name="zzzz", elon=-124, nlat=40, e=-3, n=4, u=0, se=1, sn=1, su=1)
+        myVelfield = velocity_io.VelocityField.from_stationvels([station1, station2, station3])
+        self.assertEqual(len(myVelfield), 3)
+        self.assertTrue(np.shares_memory(myVelfield.e, myVelfield.data))  # columns are views
+        self.assertEqual(list(myVelfield.n), [0, 2, 4])
+        subset = myVelfield[myVelfield.elon < -123.5]
+        self.assertEqual(len(subset), 2)
+        self.assertEqual([item.name for item in subset], ["yyyy", "zzzz"])
+        self.assertEqual(myVelfield[2].e, -3)
+        return
+
     def test_readvels(self):
         # Test reading velocity files
         datafile = "test/testing_data/NorCal_stationvels.txt"
         myVelfield = velocity_io.read_stationvels(datafile)
         self.assertGreater(len(myVelfield), 5)
+        blocks = list(velocity_io.iter_stationvels(datafile, chunksize=100))
+        self.assertEqual(len(blocks), 3)
+        streamed = velocity_io.VelocityField.concatenate(blocks)
+        np.testing.assert_array_equal(streamed.data, myVelfield.data)
+        np.testing.assert_array_equal(streamed.name, myVelfield.name)
+        return
+
+    def test_readvels_line_classification(self):
+        # Data lines start with a number; names are optional per line, and '#' starts a comment
+        lines = ['lon lat VE VN VU SE SN SU name\n', '# comment\n', '\n', '1# 2 3 4 5 6 7 8\n',
+                 '-122.5 38.1 1 2 3 .1 .2 .3 P123 extra\n', '1e2 3 1 2 3 4 5 6\n',
+                 '-5. 1 1 2 3 4 5 6 #P9\r\n', '+3 1 1 2 3 4 5 6 NAME\n']
+        data_lines = velocity_io._select_data_lines(lines)
+        self.assertEqual(len(data_lines), 4)
+        np.testing.assert_array_equal(velocity_io._parse_name_column(data_lines, 8), ['P123', '', '', 'NAME'])
+        np.testing.assert_allclose(velocity_io._parse_numeric_block(data_lines, 2)[0], [-122.5, 100, -5, 3])
+        return
+
+    def test_velocity_cache(self):
+        # A cache hit matches the parsed field, and the key follows the file and range_data
+        range_data = [-125, -121, 37, 42]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            datafile = os.path.join(tmpdir, "vels.txt")
+            shutil.copy("test/testing_data/NorCal_stationvels.txt", datafile)
+            params = types.SimpleNamespace(input_file=datafile, range_data=range_data, cache_inputs=1)
+            parsed = input_manager.inputs(params)
+            cache_file = input_manager.get_velocity_cache_name(datafile, range_data)
+            self.assertTrue(os.path.isfile(cache_file))
+            cached = input_manager.inputs(params)
+            np.testing.assert_array_equal(cached.data, parsed.data)
+            np.testing.assert_array_equal(cached.name, parsed.name)
+
+            # The memory-mapped field is read-only, but cleaning and filtering return writable copies
+            self.assertFalse(cached.data.flags.writeable)
+            cleaned = input_manager.clean_velfield(cached, coord_box=[-124, -122, 38, 41])
+            filtered = utilities.filter_by_bounding_box(cached, [-124, -122, 38, 41])
+            np.testing.assert_array_equal(cleaned.data, parsed[(parsed.elon > -124) & (parsed.elon < -122) &
+                                                               (parsed.nlat > 38) & (parsed.nlat < 41)].data)
+            filtered.e[:] = 0
+            np.testing.assert_array_equal(cached.data, parsed.data)
+
+            self.assertNotEqual(input_manager.get_velocity_cache_name(datafile, [-125, -121, 37, 41]), cache_file)
+            stats = os.stat(datafile)
+            os.utime(datafile, ns=(stats.st_atime_ns, stats.st_mtime_ns + 10**9))
+            self.assertNotEqual(input_manager.get_velocity_cache_name(datafile, range_data), cache_file)
+            with open(datafile, 'a') as ofile:
+                ofile.write("-122.0 39.0 1 1 1 1 1 1 NEWS\n")
+            os.utime(datafile, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+            new_cache_file = input_manager.get_velocity_cache_name(datafile, range_data)
+            self.assertNotEqual(new_cache_file, cache_file)
+
+            # Re-reading the changed file replaces the stale sidecar instead of adding to it
+            self.assertEqual(len(input_manager.inputs(params)), len(parsed) + 1)
+            self.assertEqual(sorted(os.listdir(tmpdir)), sorted(["vels.txt", os.path.basename(new_cache_file),
+                                                                 os.path.basename(new_cache_file)[:-4] + '.names.npy']))
+        return
+
+    def test_geometry_cache(self):
+        # A cached run matches a fresh run, and the cache key follows the stations and the grid
+        myVelfield = velocity_io.read_stationvels("test/testing_data/NorCal_stationvels.txt")
+        lons, lats = np.arange(-124, -121, 0.05), np.arange(38, 41, 0.05)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_dir = os.path.join(tmpdir, "cache")
+            fresh = triangulation_cache.get_triangle_geometry(myVelfield.elon, myVelfield.nlat, lons, lats,
+                                                              strain_delaunay_flat.flat_design_inverses)
+            written = triangulation_cache.get_triangle_geometry(myVelfield.elon, myVelfield.nlat, lons, lats,
+                                                                strain_delaunay_flat.flat_design_inverses, cache_dir)
+            cached = triangulation_cache.get_triangle_geometry(myVelfield.elon, myVelfield.nlat, lons, lats,
+                                                               strain_delaunay_flat.flat_design_inverses, cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            for key in ['simplices', 'design_inverse', 'index_map']:
+                np.testing.assert_array_equal(written[key], fresh[key])
+                np.testing.assert_array_equal(cached[key], fresh[key])
+
+            cache_file = triangulation_cache.get_geometry_cache_name(cache_dir, 'delaunay_flat', myVelfield.elon,
+                                                                     myVelfield.nlat, lons, lats)
+            moved = myVelfield.elon.copy()
+            moved[0] += 1e-6
+            self.assertNotEqual(triangulation_cache.get_geometry_cache_name(cache_dir, 'delaunay_flat', moved,
+                                                                            myVelfield.nlat, lons, lats), cache_file)
+            self.assertNotEqual(triangulation_cache.get_geometry_cache_name(cache_dir, 'delaunay_flat', myVelfield.elon,
+                                                                            myVelfield.nlat, lons, lats[:-1]),
+                                cache_file)
+
+            # Strain grids from the model are identical with and without the cache
+            grids = []
+            for method_specific in [{}, {'geometry_cache': cache_dir}, {'geometry_cache': cache_dir}]:
+                params = types.SimpleNamespace(inc=[0.05, 0.05], range_strain=[-124, -121, 38, 41],
+                                               range_data=[-125, -120, 37, 42], xdata=lons, ydata=lats,
+                                               outdir=tmpdir + os.sep, method_specific=method_specific,
+                                               precision=np.float64)
+                grids.append(strain_delaunay_flat.delaunay_flat(params).compute(myVelfield)[2:6])
+            for grid in grids[1:]:
+                for result, expected in zip(grid, grids[0]):
+                    np.testing.assert_array_equal(result, expected)
         return
 
 
@@ -0,0 +1,9 @@
+#!/bin/bash
+# Reference grids for comparing the native gpsgridder against GMT (test_gpsgridder_gmt_reference).
+# gps_input.txt is euler_pole_rotation_vels.txt written by velocity_io.write_gmt_format, as compute_gpsgridder does.
+# The command and settings are those of compute_gpsgridder with test/testing_data/00_example_strain_config.txt.
+# Run from this directory with GMT 6 and check in the resulting nc_u.nc and nc_v.nc.
+
+gmt gpsgridder gps_input.txt -R-125.25/-119.75/39.25/42.75 -I0.5/0.5 -S0.5 -Fd0.01 -C0.0005 -Emisfitfile.txt -fg -r -Gnc_%s.nc
+gmt --version > gmt_version.txt
+rm -f gmt.history misfitfile.txt